@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import tempfile
+from pathlib import Path
+import argparse
+from qlib.defs import *
+from qlib.pagecache import residency, fadvise
+from qlib.hashing import hash_file
+from qlib.copier import copy_file
+
+def percent(p: Path) -> str:
+    resident, total = residency(p)
+    return f'{resident * 100 / max(total, 1):5.1f}%'
+
+def warm(p: Path):
+    with open(p, 'rb', buffering=0) as f:
+        while f.read(16*MiB):
+            pass
+
+def drop(p: Path):
+    with open(p, 'rb') as f:
+        fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+def main():
+    parser = argparse.ArgumentParser(description='Show how hashing and copying outputs affect page cache residency')
+    parser.add_argument('bin', type=Path,
+                        help='The shared model (e.g. $R.bin) that should stay cached')
+    parser.add_argument('files', type=Path, nargs='+',
+                        help='Outputs to hash (and copy); make them larger than free RAM to see the .bin evicted')
+    parser.add_argument('--copy', '-c', type=Path,
+                        help='Also copy the outputs into this directory')
+    args = parser.parse_args()
+
+    warm(args.bin)
+    print(f'{args.bin.name}: {percent(args.bin)} resident after reading it')
+    for mode in ('', 'fadvise', 'direct'):
+        for p in args.files:
+            drop(p)
+        warm(args.bin)
+        t = time.perf_counter()
+        for p in args.files:
+            hash_file(p, stream=mode)
+            if args.copy:
+                with tempfile.NamedTemporaryFile(dir=args.copy) as tmp:
+                    copy_file(p, tmp.name, stream=mode, userspace=True)
+                    copied = percent(Path(tmp.name))
+        t = time.perf_counter() - t
+        outputs = ' '.join(f'{p.name} {percent(p)}' for p in args.files)
+        print(f'{mode or "plain":>8}: {t:6.2f} s, {args.bin.name} {percent(args.bin)}, {outputs}'
+              + (f', last copy {copied}' if args.copy else ''))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import tempfile
+from pathlib import Path
+import argparse
+import numpy
+import gguf
+from qlib.xguf import GGUFMetadataReader
+
+class SeekReadMapper(GGUFMetadataReader.FileMapper):
+    """The FileMapper as it was: a seek and a read for every slice"""
+    def _getrange(self, offset:int, nbytes:int = 1):
+        self.reads += 1
+        self.file.seek(offset)
+        return numpy.frombuffer(self.file.read(nbytes), dtype=numpy.uint8)
+
+class PerElementReader(GGUFMetadataReader):
+    """Array fields read as they were: a part (or two) for every element"""
+    _get_field_parts = gguf.gguf_reader.GGUFReader._get_field_parts
+
+def per_element_decode(field) -> list:
+    # The decode of the time, one small ndarray at a time
+    return [bytes(field.parts[i]).decode('utf-8') if field.types[-1] == gguf.GGUFValueType.STRING
+            else field.parts[i].item() for i in field.data]
+
+def make_gguf(path: Path, vocab: int):
+    w = gguf.GGUFWriter(path, 'llama')
+    w.add_name('bench')
+    w.add_tokenizer_model('gpt2')
+    w.add_token_list([f'<token {i}>' for i in range(vocab)])
+    w.add_token_types([1] * vocab)
+    w.add_token_scores([float(i) for i in range(vocab)])
+    w.add_token_merges([f'a{i} b{i}' for i in range(vocab)])
+    w.add_tensor('token_embd.weight', numpy.zeros((8, 8), dtype=numpy.float32))
+    w.write_header_to_file()
+    w.write_kv_data_to_file()
+    w.write_tensors_to_file()
+    w.close()
+
+def parse(path: Path, mapper: type, reader: type = GGUFMetadataReader) -> tuple[float, int]:
+    readers = []
+    def tracking(*args, **kwargs):
+        readers.append(m := mapper(*args, **kwargs))
+        return m
+    t = time.perf_counter()
+    reader(path, cls=tracking)
+    return time.perf_counter() - t, readers[0].reads
+
+def decode(path: Path, reader: type, bulk: bool) -> float:
+    r = reader(path)
+    arrays = [f for f in r.fields.values() if f.types and f.types[0] == gguf.GGUFValueType.ARRAY]
+    t = time.perf_counter()
+    for f in arrays:
+        f.decode() if bulk else per_element_decode(f)
+    return time.perf_counter() - t
+
+def main():
+    parser = argparse.ArgumentParser(description='Time GGUF metadata parsing and array decoding')
+    parser.add_argument('gguf', type=Path, nargs='?',
+                        help='GGUF to parse (default: a generated one with a large vocabulary)')
+    parser.add_argument('--vocab', '-v', type=int, default=150_000,
+                        help='Vocabulary size of the generated GGUF')
+    parser.add_argument('--runs', '-n', type=int, default=3,
+                        help='Runs of each mapper; the best is reported')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if not (path := args.gguf):
+            make_gguf(path := Path(tmp) / 'vocab.gguf', args.vocab)
+        print(f'{path.name}: {path.stat().st_size:,} bytes')
+        for name, mapper in (('seek+read', SeekReadMapper), ('block cache', GGUFMetadataReader.FileMapper)):
+            t, reads = min(parse(path, mapper) for _ in range(args.runs))
+            print(f'{name:>12}: {t*1000:8.1f} ms, {reads:,} file reads')
+        for name, reader, bulk in (('per element', PerElementReader, False), ('bulk', GGUFMetadataReader, True)):
+            t, _ = min(parse(path, GGUFMetadataReader.FileMapper, reader) for _ in range(args.runs))
+            d = min(decode(path, reader, bulk) for _ in range(args.runs))
+            print(f'{name:>12}: {t*1000:8.1f} ms to parse, {d*1000:8.1f} ms to decode the arrays')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import hashlib
+from pathlib import Path
+import argparse
+from qlib.defs import *
+from qlib import IOBuffer, hash_file, hash_files
+
+def drop_cache(p: Path):
+    # Only clean pages are dropped, which is all a freshly written model has
+    with open(p, 'rb') as f:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+def loop_hash(p: Path):
+    # The single threaded loop that the scripts used before qlib.hashing
+    with p.open('rb') as f:
+        h = hashlib.sha256(usedforsecurity=False)
+        buffer = IOBuffer(MiB)
+        while buffer.readfrom(f):
+            h.update(buffer.bytes)
+    return h
+
+def loop(files):
+    return [loop_hash(p).hexdigest() for p in files]
+
+def pipelined(files):
+    return [hash_file(p).hexdigest() for p in files]
+
+def concurrent(files):
+    return dict((p, h.hexdigest()) for p,h in hash_files(files)).values()
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare hashing throughput of the old loop and qlib.hashing')
+    parser.add_argument('files', type=Path, nargs='+',
+                        help='Files to hash, ideally several multi-GB GGUFs')
+    parser.add_argument('--cached', '-c', action='store_true',
+                        help='Leave the files in page cache between runs, to measure hashing alone')
+    parser.add_argument('--runs', '-n', type=int, default=1,
+                        help='Runs of each method; the best is reported')
+    args = parser.parse_args()
+
+    total = sum(p.stat().st_size for p in args.files)
+    print(f'{len(args.files)} files, {total/GB:.2f} GB')
+    digests = None
+    for name, fn in (('loop', loop), ('pipelined', pipelined), ('concurrent', concurrent)):
+        best = None
+        for _ in range(args.runs):
+            if not args.cached:
+                for p in args.files:
+                    drop_cache(p)
+            t = time.perf_counter()
+            result = sorted(fn(args.files))
+            t = time.perf_counter() - t
+            best = t if best is None else min(best, t)
+        if digests is None:
+            digests = result
+        elif not result == digests:
+            sys.exit(f'{name} produced different digests')
+        print(f'{name:>10}: {total/GB/best:6.2f} GB/s ({best:.2f} s)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import json
+import struct
+import tempfile
+import subprocess
+from pathlib import Path
+import argparse
+from qlib.defs import *
+from qlib.fakehub import FakeHub
+
+script_dir = Path(__file__).parent
+
+config = {'architectures': ['LlamaForCausalLM'], 'model_type': 'llama', 'num_hidden_layers': 32,
+          'hidden_size': 4096, 'intermediate_size': 14336, 'num_attention_heads': 32,
+          'num_key_value_heads': 8, 'vocab_size': 128256, 'max_position_embeddings': 8192}
+
+source_files = {name + '.json': json.dumps(config if name == 'config' else {}).encode() for name in
+                ('config', 'generation_config', 'special_tokens_map', 'tokenizer', 'tokenizer_config')}
+
+def safetensors_header(name: str, n_params: int) -> bytes:
+    header = json.dumps({name: {'dtype': 'BF16', 'shape': [n_params], 'data_offsets': [0, 2*n_params]}}).encode()
+    return struct.pack('<Q', len(header)) + header
+
+def add_fixtures(hub: FakeHub, crawl_repos: int):
+    shards = {f'model-0000{i}-of-00002.safetensors': 4*10**9 for i in (1, 2)}
+    d = hub.add_repo('org/Source-8B', {**source_files, 'README.md': b'# Source-8B\n',
+                                       'model.safetensors.index.json': b'{"metadata": {}, "weight_map": {}}',
+                                       **{name: 2*n + KiB for name, n in shards.items()}})
+    # Sparse shards with real headers, so parameters can be counted from them
+    for name, n in shards.items():
+        with open(d / name, 'r+b') as f:
+            f.write(safetensors_header(name.split('-')[1], n))
+    for i in range(crawl_repos):
+        # A third are big enough, a third too small, a third lack the tokenizer
+        files = dict(source_files) if i % 3 < 2 else {'config.json': b'{}'}
+        files['model.safetensors'] = 13*GB if i % 3 == 0 else 2*GB
+        hub.add_repo(f'crawl/model-{i:04d}', files)
+    # upload.py expects its repo to exist
+    hub.add_repo('org/Single-8B-GGUF', {})
+
+def make_quant(d: Path, n_files: int, size: int) -> Path:
+    d.mkdir(parents=True)
+    (d / 'README.md').write_text('# Source-8B-GGUF\n')
+    for i in range(n_files):
+        with open(d / f'Source-8B.Q{i}_K.gguf', 'wb') as f:
+            f.write(b'GGUF' + os.urandom(size - 4))
+    return d
+
+classify = '''
+import qlib
+m = qlib.Model('org/Source-8B')
+print(type(m).__name__, len(m.files), 'files,', m.num_params, 'params', m.readme.strip())
+print(qlib.is_safetensors_model('org/Source-8B'))
+'''
+
+crawl = '''
+import qlib
+print(len(list(qlib.recent_safetensors_models(days=1, workers=8, rate=1000))), 'models')
+'''
+
+def scenarios(args, work: Path) -> dict[str, list[str]]:
+    py = sys.executable
+    size = int(args.size * MiB)
+    serial = make_quant(work / 'org' / 'Serial-8B-GGUF', args.files, size)
+    quant = make_quant(work / 'org' / 'Source-8B-GGUF', args.files, size)
+    single = make_quant(work / 'org' / 'Single-8B-GGUF', 1, size)
+    return {
+        'classify': [py, '-c', classify],
+        'classify-again': [py, '-c', classify],
+        'crawl': [py, '-c', crawl],
+        'crawl-again': [py, '-c', crawl],
+        'qupload-serial': [py, str(script_dir / 'qupload.py'), str(serial), '-o', 'org', '-j', '1', '-c', '1'],
+        'qupload': [py, str(script_dir / 'qupload.py'), str(quant), '-o', 'org'],
+        'qupload-again': [py, str(script_dir / 'qupload.py'), str(quant), '-o', 'org'],
+        'upload': [py, str(script_dir / 'upload.py'), '--dir', str(single)],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Run hub-facing scripts against a local fake hub, '
+                                                 'counting requests and timing them')
+    parser.add_argument('--latency', '-l', type=float, default=0.02,
+                        help='Seconds added to every request')
+    parser.add_argument('--error-rate', '-e', type=float, default=0.0,
+                        help='Fraction of requests that fail with a 500')
+    parser.add_argument('--upload-rate', '-u', type=float, default=None,
+                        help='Cap on each upload, in MB/s')
+    parser.add_argument('--files', '-f', type=int, default=4,
+                        help='GGUFs in the uploaded quant')
+    parser.add_argument('--size', '-s', type=float, default=24,
+                        help='Size of each GGUF, in MiB')
+    parser.add_argument('--crawl-repos', '-c', type=int, default=60,
+                        help='New repos for the crawler to look through')
+    parser.add_argument('--only', '-o', type=str, action='append',
+                        help='Run just this scenario; may be repeated')
+    parser.add_argument('--serve', action='store_true',
+                        help="Just serve the fixtures until interrupted, for running scripts by hand")
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help="Show the scripts' output")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_hub-') as tmp:
+        work = Path(tmp)
+        hub = FakeHub(work / 'hub', latency=args.latency, error_rate=args.error_rate,
+                      upload_rate=args.upload_rate and args.upload_rate * MB,
+                      multipart_threshold=16*MiB, chunk_size=8*MiB)
+        add_fixtures(hub, args.crawl_repos)
+        with hub:
+            env = {**os.environ, 'HF_ENDPOINT': hub.url, 'HF_TOKEN': 'hf_fake', 'HF_HUB_DISABLE_TELEMETRY': '1',
+                   'HF_HOME': str(work / 'hf'), 'QLIB_CACHE_DIR': str(work / 'qlib'),
+                   'PYTHONPATH': str(script_dir), 'HF_DEFAULT_ORGANIZATION': 'org', 'TOASTER_ROOT': str(work)}
+            env.pop('HF_HUB_ENABLE_HF_TRANSFER', None)
+            if args.serve:
+                print(f'Serving {hub.root} at {hub.url}; try HF_ENDPOINT={hub.url} HF_TOKEN=hf_fake')
+                try:
+                    while True:
+                        time.sleep(3600)
+                except KeyboardInterrupt:
+                    return
+
+            print(f'{"scenario":16} {"time":>8} {"requests":>9}  by route')
+            for name, cmd in scenarios(args, work / 'local').items():
+                if args.only and name not in args.only:
+                    continue
+                hub.reset()
+                t = time.perf_counter()
+                result = subprocess.run(cmd, env=env, capture_output=not args.verbose, text=True)
+                t = time.perf_counter() - t
+                counts = hub.counts()
+                print(f'{name:16} {t:7.2f}s {sum(counts.values()):9}  '
+                      + ' '.join(f'{r}:{n}' for r, n in counts.most_common()))
+                if result.returncode:
+                    print(f'{name} failed with status {result.returncode}')
+                    if result.stderr:
+                        print(result.stderr.strip().split('\n')[-1])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+import sys
+import subprocess
+import argparse
+
+heavy_modules = ('torch', 'safetensors', 'huggingface_hub', 'gguf', 'numpy', 'clear_screen', 'requests')
+
+probe = f'''
+import sys, time
+t = time.perf_counter()
+import qlib
+t = time.perf_counter() - t
+# Unknown names must fail without loading anything
+hasattr(qlib, 'no_such_symbol')
+print(t, *[m for m in {heavy_modules!r} if m in sys.modules])
+'''
+
+# Every lazy module's __all__ should be exactly its entry in qlib's table
+symbols_probe = '''
+import importlib, qlib
+for modname, symbols in qlib._lazy_symbols.items():
+    exported = importlib.import_module('qlib.' + modname).__all__
+    if missing := [s for s in exported if s not in symbols]:
+        print(f'{modname}: missing from qlib._lazy_symbols: {", ".join(missing)}')
+    if extra := [s for s in symbols if s not in exported]:
+        print(f'{modname}: in qlib._lazy_symbols but not in __all__: {", ".join(extra)}')
+'''
+
+def time_import(python:str) -> tuple[float, list[str]]:
+    result = subprocess.run([python, '-c', probe], capture_output=True, text=True, check=True)
+    t,*loaded = result.stdout.split()
+    return float(t), loaded
+
+def check_symbols(python:str) -> list[str]:
+    result = subprocess.run([python, '-c', symbols_probe], capture_output=True, text=True, check=True)
+    return result.stdout.splitlines()
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that "import qlib" stays cheap')
+    parser.add_argument('--budget', '-b', type=float, default=0.15,
+                        help='Maximum acceptable import time in seconds')
+    parser.add_argument('--runs', '-n', type=int, default=5,
+                        help='Number of fresh interpreters to time')
+    parser.add_argument('--python', type=str, default=sys.executable,
+                        help='Interpreter to test with')
+    args = parser.parse_args()
+
+    times = []
+    for _ in range(args.runs):
+        t, loaded = time_import(args.python)
+        if loaded:
+            print(f'import qlib loaded heavy modules: {" ".join(loaded)}')
+            sys.exit(1)
+        times.append(t)
+    best = min(times)
+    print(f'import qlib: best {best*1000:.1f} ms, worst {max(times)*1000:.1f} ms over {args.runs} runs'
+          f' (budget {args.budget*1000:.0f} ms)')
+    if best > args.budget:
+        sys.exit(1)
+    if drift := check_symbols(args.python):
+        print('\n'.join(drift))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+import sys
+from pathlib import Path
+import argparse
+from qlib.defs import *
+from qlib.pipeline import QuantBuild
+from qlib.scheduler import SchedulingError
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the quants of a model directory made by setup.py')
+    parser.add_argument('directory', type=Path, nargs='?', default=Path('.'),
+                        help='Model build directory containing the GNUmakefile')
+    parser.add_argument('--dry-run', '-n', action='store_true',
+                        help='Show what would be run')
+    parser.add_argument('--ppl', '-p', action='store_true',
+                        help='Also run the KL-divergence/perplexity checks')
+    parser.add_argument('--threads-per-job', '-t', type=int,
+                        help='Threads given to each llama-quantize')
+    parser.add_argument('--threads', '-T', type=int,
+                        help='Total threads to use (default: all CPUs)')
+    parser.add_argument('--ram', '-m', type=float,
+                        help='Memory budget in GiB (default: from /proc/meminfo)')
+    parser.add_argument('--only', '-o', type=str.upper, action='append',
+                        help='Only build these quant types')
+    parser.add_argument('--force', '-f', action='store_true',
+                        help='Start even if the predicted outputs exceed the free disk space')
+    args = parser.parse_args()
+
+    build = QuantBuild(args.directory, threads_per_job=args.threads_per_job, ppl=args.ppl, qtypes=args.only)
+    sched = build.scheduler(ram=args.ram and int(args.ram * GiB), threads=args.threads, dry_run=args.dry_run)
+    try:
+        ok = sched.run(args.force)
+    except SchedulingError as e:
+        sys.exit(str(e))
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+from pathlib import Path
+import qlib
+from qlib.defs import *
+import argparse
+
+def describe(e) -> str:
+    types = ' '.join(f'{t}:{n}' for t,(n,_) in sorted(e.tensor_types.items(), key=lambda i: -i[1][1]))
+    split = f' [{e.split_no + 1}/{e.split_count}]' if e.split_count > 1 else ''
+    imatrix = ' imatrix' if any(k.startswith('quantize.imatrix.') for k in e.provenance) else ''
+    return (f'{e.path.name}{split}: {e.qtype} {e.size/GB:.2f} GB, {sum(map(bool, e.blocks))} blocks, {types}{imatrix}'
+            + (f', sha256 {e.sha256[:16]}' if e.sha256 else ''))
+
+def show_duplicates(groups, limit: int):
+    wasted = sum(g[0][1].n_bytes * (len(g) - 1) for g in groups)
+    print(f'{len(groups)} tensors stored more than once, {wasted/GB:.2f} GB of duplicate data')
+    for g in groups[:limit]:
+        t = g[0][1]
+        print(f'  {t.sha256[:12]} {t.tensor_type} {t.n_bytes/MB:9.1f} MB x{len(g)}: '
+              + ', '.join(f'{p.parent.name}/{p.name}:{t.name}' for p,t in g))
+
+def show_diff(diffs):
+    for d in diffs:
+        print(f'{d.path.name}: {d.status}'
+              + (f', {d.changed_tensors} tensors ({d.changed_bytes/GB:.2f} GB)' if d.changed_tensors else ''))
+    same = sum(d.path.size for d in diffs if d.status == 'unchanged')
+    print(f'{sum(d.status == "unchanged" for d in diffs)} of {len(diffs)} files unchanged, '
+          f'{same/GB:.2f} GB that needn\'t be uploaded again')
+
+def main():
+    parser = argparse.ArgumentParser(description='Update and query the catalog of local GGUFs')
+    parser.add_argument('--hash', action='store_true',
+                        help='Hash files the hash cache does not know yet')
+    parser.add_argument('--json', '-j', action='store_true',
+                        help='Print the entries as JSON')
+    parser.add_argument('--where', '-w', type=str, default=None,
+                        help='Only list entries matching this SQL condition (e.g. "qtype LIKE \'IQ%%\'")')
+    parser.add_argument('--tensors', '-t', action='store_true',
+                        help='Hash each tensor too, and list them')
+    parser.add_argument('--duplicates', '-D', action='store_true',
+                        help='Report tensors that are stored more than once among the paths')
+    parser.add_argument('--limit', '-n', type=int, default=20,
+                        help='Duplicate groups to list')
+    parser.add_argument('--diff', type=Path, action='append', metavar='OLD',
+                        help='Show which files of the paths (a new build) differ from this GGUF or directory '
+                             '(an old one); may be repeated')
+    parser.add_argument('paths', type=Path, nargs='*', default=[Path('.')],
+                        help='GGUFs, or directories of them, to bring up to date (default: .)')
+    args = parser.parse_args()
+
+    catalog = qlib.gguf_catalog
+    if args.duplicates or args.diff:
+        files = [p for p in args.paths + (args.diff or []) if p.is_dir() or p.suffix == '.gguf']
+        todo = [e for e in catalog.update(files) if not catalog.tensors(e.path, hash=False)]
+        pl = qlib.misc.ProgressLine(sum(e.tensor_bytes for e in todo), 'Hashing tensors')
+        for e in todo:
+            catalog.tensors(e.path, progress=pl.update_progress)
+        if todo:
+            pl.finish()
+        if args.duplicates:
+            show_duplicates(catalog.duplicates(args.paths), args.limit)
+        if args.diff:
+            show_diff(catalog.diff(args.diff, args.paths))
+        return
+
+    entries = catalog.update(args.paths, hash=args.hash)
+    if args.where:
+        wanted = {e.path for e in catalog.query(args.where)}
+        entries = [e for e in entries if e.path in wanted]
+    if args.json:
+        json.dump([{**e.__dict__, 'path': str(e.path)} for e in entries], sys.stdout, indent=4)
+        print()
+    else:
+        for e in entries:
+            print(describe(e))
+            if args.tensors:
+                for t in catalog.tensors(e.path):
+                    print(f'    {t.sha256[:16]} {t.tensor_type:>7} {t.n_bytes:15,} {t.name}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+from pathlib import Path
+import gguf
+import qlib
+from qlib.defs import *
+import argparse
+
+def parse_value(editor, key: str, text: str):
+    # Existing keys keep their type; new ones take JSON, or else a string
+    types = editor.types(key) if key in editor else []
+    if types == [gguf.GGUFValueType.STRING]:
+        return text
+    if types and types[0] == gguf.GGUFValueType.BOOL:
+        return text.lower() in ('1', 'true', 'yes', 'on')
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        if types and types[0] != gguf.GGUFValueType.STRING:
+            raise SystemExit(f'{key}: {text!r} is not a valid {types[0].name.lower()}')
+        return text
+
+def show(editor, key: str):
+    value = editor[key]
+    if isinstance(value, list) and len(value) > 8:
+        print(f'{key} = [{", ".join(map(repr, value[:8]))}, ... {len(value)} items]')
+    else:
+        print(f'{key} = {value!r}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Edit GGUF metadata without rewriting tensor data')
+    parser.add_argument('--set', '-s', metavar='KEY=VALUE', action='append', default=[],
+                        help='Set a key (existing keys keep their type)')
+    parser.add_argument('--set-file', '-f', metavar='KEY=FILE', action='append', default=[],
+                        help='Set a string key to the contents of a file')
+    parser.add_argument('--remove', '-r', metavar='KEY', action='append', default=[],
+                        help='Remove a key')
+    parser.add_argument('--list', '-l', action='store_true',
+                        help='List the metadata (after any changes are saved)')
+    parser.add_argument('gguf', type=Path,
+                        help='GGUF to edit; for a split GGUF, any of its shards')
+    args = parser.parse_args()
+
+    editor = qlib.GGUFEditor(args.gguf)
+    try:
+        for key in args.remove:
+            editor.remove(key)
+        for item in args.set:
+            key, _, text = item.partition('=')
+            editor.set(key, parse_value(editor, key, text))
+        for item in args.set_file:
+            key, _, fname = item.partition('=')
+            editor.set(key, Path(fname).read_text())
+    except (KeyError, ValueError) as e:
+        raise SystemExit(f'{editor.path.name}: {e}')
+
+    if editor.changed:
+        pl = qlib.misc.ProgressLine(editor.path.size - editor.data_offset, f'Rewriting {editor.path.name}')
+        how = editor.save(progress=pl.update_progress)
+        if how == 'rewritten':
+            pl.finish()
+        print(f'{editor.path.name}: metadata {how}')
+
+    if args.list:
+        editor = qlib.GGUFEditor(editor.path)
+        for key in editor.keys():
+            show(editor, key)
+
+if __name__ == '__main__':
+    main()
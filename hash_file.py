@@ -1,25 +1,13 @@
 #!/usr/bin/env python3
 from pathlib import Path
-import hashlib
-from qlib import IOBuffer
+from qlib import file_hash
 import argparse
 
 MAX_BLOB_SIZE = 1_000_000
 
 def hash_file(p: Path) -> str:
     if p.exists() and p.is_file():
-        fsize = p.stat().st_size
-        with open(p, 'rb') as srcfile:
-            if fsize > MAX_BLOB_SIZE:
-                h = hashlib.file_digest(srcfile, 'sha256')
-            else:
-                h = hashlib.sha1(usedforsecurity=False)
-                h.update(b'blob %d\0'%(fsize,))
-                buffer = IOBuffer(MAX_BLOB_SIZE)
-                while buffer.readfrom(srcfile):
-                    h.update(buffer.bytes)
-
-        return h.hexdigest()
+        return file_hash(p, 'sha256' if p.stat().st_size > MAX_BLOB_SIZE else 'blob')
 
 def main():
     parser = argparse.ArgumentParser()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+from pathlib import Path
+import qlib
+import argparse
+
+def input_file(s: str) -> tuple[Path, float]:
+    # FILE or FILE:WEIGHT; a suffix that isn't a number is part of the path
+    path, _, weight = s.rpartition(':')
+    try:
+        if path:
+            return Path(path), float(weight)
+    except ValueError:
+        pass
+    return Path(s), 1.0
+
+def show_stats(im):
+    print(f'{len(im.entries)} tensors, {im.chunks} chunks, dataset {im.dataset}')
+    for s in im.stats():
+        zeros = f', {s.zeros} never active' if s.zeros else ''
+        print(f'  {s.name:48} {s.ncall:6} calls {s.nval:7} values  mean {s.mean:10.4g} max {s.max:10.4g}{zeros}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge imatrices from separate calibration runs')
+    parser.add_argument('--output', '-o', type=Path,
+                        help='Write the merged imatrix here')
+    parser.add_argument('--dataset', '-s', type=str, default=None,
+                        help='Dataset name for the output (default: the inputs\' joined with +)')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print per-tensor statistics of the result')
+    parser.add_argument('inputs', type=input_file, nargs='+', metavar='FILE[:WEIGHT]',
+                        help='Imatrices to merge, each optionally weighted')
+    args = parser.parse_args()
+
+    imatrices = [qlib.Imatrix.load(p) for p,_ in args.inputs]
+    for (p,_),im in zip(args.inputs, imatrices):
+        print(f'{p.name}: {len(im.entries)} tensors, {im.chunks} chunks, dataset {im.dataset}')
+    merged = qlib.merge_imatrices(imatrices, [w for _,w in args.inputs])
+    if args.dataset:
+        merged.dataset = args.dataset
+    if args.stats:
+        show_stats(merged)
+    if args.output:
+        merged.save(args.output)
+        print(f'Wrote {args.output}: {len(merged.entries)} tensors, {merged.chunks} chunks, dataset {merged.dataset}')
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@
 
 import struct
 from pathlib import Path
+import qlib
 import argparse
 
 def main():
@@ -13,35 +14,37 @@ def main():
     args = parser.parse_args()
 
     if args.from_file.exists() and args.from_file.is_file() and not args.from_file.is_symlink():
-        if args.to_file.exists():
-            if args.force:
-                args.to_file.unlink()
-            else:
-                raise ValueError(f'File "{args.to_file}" exists and --force not given')
+        in_place = args.to_file.exists() and args.from_file.samefile(args.to_file)
+        if args.to_file.exists() and not (args.force or in_place):
+            raise ValueError(f'File "{args.to_file}" exists and --force not given')
         if args.dataset:
             with args.from_file.open('rb') as f:
-                filebuf = f.read()
-            fnidx = filebuf.rindex(0) + 1
-            fnlen = len(filebuf) - fnidx
-            if fnlen < 1 or fnlen > 32767:
-                raise RuntimeError(f'Improbable dataset name length of {fnlen}')
-            olddataset = str(filebuf[fnidx:],'utf-8')
-            print(f'Old dataset name ({fnlen} bytes): {olddataset}')
-            lenidx = fnidx - 4
-            (lenval,) = struct.unpack('I', filebuf[lenidx:fnidx])
-            if lenval == fnlen:
-                newdataset = bytes(args.dataset, 'utf-8')
-                lenval = len(newdataset)
-                with args.to_file.open('wb') as f:
-                    f.write(filebuf[0:lenidx])
-                    f.write(struct.pack('I', lenval))
+                lenidx, olddataset = qlib.imatrix.dataset_record(f)
+            print(f'Old dataset name ({len(olddataset.encode())} bytes): {olddataset}')
+            newdataset = bytes(args.dataset, 'utf-8')
+            def rewrite_tail(p: Path):
+                with p.open('r+b') as f:
+                    f.truncate(lenidx)
+                    f.seek(lenidx)
+                    f.write(struct.pack('I', len(newdataset)))
                     f.write(newdataset)
-                if args.force:
-                    args.from_file.unlink()
-            else:
-                raise RuntimeError(f'Dataset length mismatch, read {lenval} from file')
+            if in_place:
+                rewrite_tail(args.from_file)
+                return
+            # Only the tail is rewritten, of a reflink or in-kernel copy; the
+            # source stays until the new file is complete and in place
+            tmp = args.to_file.with_name(args.to_file.name + '.tmp')
+            try:
+                qlib.copy_file(args.from_file, tmp)
+                rewrite_tail(tmp)
+                tmp.replace(args.to_file)
+            except BaseException:
+                tmp.unlink(missing_ok=True)
+                raise
+            if args.force:
+                args.from_file.unlink()
         else:
-            args.from_file.rename(args.to_file)
+            args.from_file.replace(args.to_file)
 
 if __name__ == '__main__':
     main()
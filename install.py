@@ -2,62 +2,17 @@
 import sys
 import os
 from pathlib import Path
-import datetime
 import argparse
-from qlib import IOBuffer
+import qlib
 from qlib.defs import *
-
-class statusline(object):
-    def __init__(self, stream=sys.stdout):
-        self.out = stream
-        self.pos = 0
-        self.line = 0
-
-    def retn(self, linefeed = False):
-        if (pad := self.line - self.pos) > 0:
-            self.out.write(' '*pad)
-        if linefeed:
-            self.out.write('\n')
-            self.line = 0
-        else:
-            self.out.write('\r')
-            self.out.flush()
-            self.line = self.pos
-        self.pos = 0
-
-    def print(self, text):
-        self.pos += self.out.write(text)
-
-def format_timedelta(delta: datetime.timedelta) -> str:
-    """Formats a timedelta duration to %H:%M:%S format"""
-    seconds = int(delta.total_seconds())
-
-    hours, seconds = divmod(seconds, 3600)
-    minutes, seconds = divmod(seconds, 60)
-
-    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+from qlib.misc import ProgressLine
 
 def copy_file(srcpath: Path, destpath: Path):
-    filesize = srcpath.stat().st_size
-
-    with open(destpath, 'wb', buffering=0) as destfile:
-        with open(srcpath, 'rb', buffering=0) as srcfile:
-            buffer = IOBuffer(MiB)
-            statln = statusline()
-            copied = 0
-            start_time = datetime.datetime.now()
-            while buffer.readfrom(srcfile):
-                copied += buffer.writeto(destfile)
-                progress = copied/filesize
-                elapsed = datetime.datetime.now() - start_time
-                estr = format_timedelta(elapsed)
-                remaining = elapsed/progress
-                rstr = format_timedelta(remaining)
-                statln.print(f'Wrote {copied:15,} of {filesize:15,} ({progress*100:.1f}%) [{estr}<{rstr}]')
-                statln.retn()
-            statln.retn(True)
-            stop_time = datetime.datetime.now()
-            sys.stdout.write(f'Copied {copied:,} bytes in {format_timedelta(stop_time - start_time)}\n')
+    pl = ProgressLine(srcpath.stat().st_size, 'Wrote')
+    result = qlib.copy_file(srcpath, destpath, progress=pl.update_progress)
+    pl.finish(f'Copied ({result.method})')
+    if result.sha256:
+        sys.stdout.write(f'sha256 {result.sha256}\n')
 
 if sys.platform == 'win32':
     nulldev = Path('nul')
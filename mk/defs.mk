@@ -80,15 +80,20 @@ ASSETS := $(notdir $(wildcard $S/assets/*.png))
 convert_py := convert_hf_to_gguf.py --model-name=$(or $(FULLNAME),$(BASEMODEL)) $(if $(PRETOKENIZER),--vocab-pre=$(PRETOKENIZER))
 xconvert = python $T/bin/$1 --outtype=$3 --outfile=$(patsubst $Q.auto,$Q.{FTYPE},$4) $(CONVERT_OPTS) $2
 convert = $(call xconvert,$(convert_py),$1,$2,$3)
-imatrix_rename := python $S/imatrix_rename.py
+# A build reads and writes each file once; keep it from flushing the page cache
+QLIB_STREAM_IO ?= fadvise
+export QLIB_STREAM_IO
+# qrun hands the script to a running qworker, or runs it directly if there is none
+qrun := python $S/qrun.py
+imatrix_rename := $(qrun) imatrix_rename
 imatrix_data := $(notdir $(IMATRIX_DATASET))
 imatrix_url := $(call isurl,$(IMATRIX_DATASET))
 imatrix_src := $(or $(imatrix_url),$(imatrix_data))
 imatrix_input := $S/data/$(imatrix_data)
 imatrix = $T/bin/llama-imatrix $(IMATRIX_OPTS) -c 4096 -m $1 $(ngl) -f $(imatrix_input) -o $2
-mkreadme := python $S/mkreadme.py
+mkreadme := $(qrun) mkreadme
 qupload := python $S/qupload.py
-postquantize := python $S/postquantize.py
+postquantize := $(qrun) postquantize
 quantize = $T/bin/llama-quantize $1 $2 $(call qtype,$2)
 perplexity := $T/bin/llama-perplexity
 
@@ -106,12 +111,19 @@ tidy:
 	rm -f *.tmp tmp
 
 clean: tidy
-	rm -f *.xguf *.xguf-in *.gguf *.sha256 *.bin *.imatrix *.png *.json $(README) imatrix_dataset.txt
+	rm -f *.xguf *.xguf-in *.gguf *.sha256 *.chunks *.bin *.imatrix *.png *.json $(README) imatrix_dataset.txt
+	rm -rf _build
 
 upload: assets
 	$(qupload) -i -p -R $(QUANTREPO) .
 
-.PHONY: all bin imat klb ppl quants assets clean tidy upload
+worker:
+	python $S/qworker.py --detach
+
+worker-stop:
+	python $S/qworker.py --stop
+
+.PHONY: all bin imat klb ppl quants assets clean tidy upload worker worker-stop
 
 .SUFFIXES:
 .SECONDARY:
@@ -144,7 +156,7 @@ $Q.imatrix: | $R.bin $(imatrix_input)
 endif
 
 _meta.json: $R.bin
-	python $S/mkmeta.py $(META_OPTS) $@ $<
+	$(qrun) mkmeta $(META_OPTS) $@ $<
 
 $Q.klb: $R.bin $(ppl_input)
 	$(perplexity) -sm none -m $< -f $(ppl_input) --kl-divergence-base $@.tmp && rm -f $@.sav && ln $@.tmp $@.sav && mv -f $@.tmp $@
@@ -170,7 +182,7 @@ $(KQUANTS:=-in): %:
 	$(postquantize) $< $@
 
 %.gguf.sha256: %.gguf
-	python $S/sha256_files.py $<
+	$(qrun) sha256_files --chunks $<
 
 %.ppl.out: %.xguf $Q.klb
 	$(perplexity) -m $< $(ngl) --kl-divergence --kl-divergence-base $Q.klb | tee $@.tmp && mv -f $@.tmp $@
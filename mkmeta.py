@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 
 from pathlib import Path
-from gguf.gguf_reader import GGUFReader,ReaderTensor
+import itertools
 import json
+import sqlite3
+import qlib
 import argparse
 
 def convert_num(s:str) -> float|None:
@@ -21,9 +23,6 @@ def convert_num(s:str) -> float|None:
     else:
         return 0
     
-def block_num(t:ReaderTensor, nonblock=None) -> int|None:
-    return int(t.name.split('.')[1]) if t.name.startswith('blk.') else nonblock
-
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--description', '-d', type=str, default=None,
@@ -49,23 +48,20 @@ def main():
     if args.description:
         meta['description'] = args.description
     
-    input = GGUFReader(args.gguf)
-    paramsize = 0
-    parambytes = 0
-    numblocks = max(filter(bool,map(block_num, input.tensors))) + 1
-    blocksize = [0] * numblocks
+    # Block sizes come from the catalog, which only parses the header when the file is new
+    try:
+        entry = qlib.gguf_catalog.entry(args.gguf)
+    except sqlite3.Error:
+        entry = qlib.CatalogEntry.scan(args.gguf.absolute(), args.gguf.stat())
+    blocksize = entry.blocks
     lastgpublock = None
-    for t in input.tensors:
-        paramsize += t.n_elements
-        parambytes += t.n_bytes
-        if (blk := block_num(t)) is not None:
-            blocksize[blk] += t.n_bytes
-            if gpu_memory > parambytes:
-                lastgpublock = blk
-    meta['paramsize'] = paramsize
+    for blk,parambytes in enumerate(itertools.accumulate(blocksize, initial=entry.leading_bytes)):
+        if blk and gpu_memory > parambytes:
+            lastgpublock = blk - 1
+    meta['paramsize'] = entry.n_params
     meta['blocksize'] = blocksize
     if lastgpublock:
-        meta['gpulayers'] = blk
+        meta['gpulayers'] = lastgpublock
 
     with args.json.open('wt', encoding='utf-8') as f:
         json.dump(meta, f, ensure_ascii=False, indent=4)
@@ -1,11 +1,10 @@
 #!/usr/bin/env python3
 import sys
 import os
+import sqlite3
 from pathlib import Path
 from typing import Iterable
 import qlib
-import hashlib
-import subprocess
 import argparse
 
 class PurgeFailed(Exception):
@@ -13,43 +12,35 @@ class PurgeFailed(Exception):
         self.path = path
         self.srcpath = srcpath
 
-def init_paths():
-    def chk(p:Path) -> Path:
-        if not p.exists():
-            raise FileNotFoundError("'{p}' not found")
-        return p
-
-    global toaster_root, gguf_split_exe
-    if toaster_root := os.getenv('TOASTER_ROOT'):
-        toaster_root = Path(toaster_root)
-    else:
-        raise RuntimeError('TOASTER_ROOT environment variable is not set')
-    bin = chk(toaster_root / 'bin')
-    gguf_split_exe = chk(bin / 'llama-gguf-split')
-
-def hash_file(p: Path):
-    if p.exists() and p.is_file():
-        outp = p.with_name(p.name + '.sha256')
-        outp.unlink(missing_ok = True)
-        fsize = p.stat().st_size
-        with open(p, 'rb') as srcfile:
-            if fsize > qlib.MAX_BLOB_SIZE:
-                sys.stdout.write(f'Hashing {p.name}... ')
-                hx = hashlib.file_digest(srcfile, 'sha256').hexdigest()
-                sys.stdout.write(f'{hx[:16]}\n')
-                with outp.open('wt') as outfile:
-                    outfile.write(hx)
+def hash_files(paths: Iterable[Path]):
+    paths = [p for p in paths if p.exists() and p.is_file()]
+    for p in paths:
+        p.with_name(p.name + '.sha256').unlink(missing_ok = True)
+        p.with_name(p.name + '.chunks').unlink(missing_ok = True)
+    ggufs = [p for p in paths if p.suffix == '.gguf']
+    paths = [p for p in paths if p.stat().st_size > qlib.MAX_BLOB_SIZE]
+    if paths:
+        sys.stdout.write(f'Hashing {", ".join(p.name for p in paths)}\n')
+    for p,hx in qlib.file_hashes(paths, manifests=True):
+        sys.stdout.write(f'{p.name}: {hx[:16]}\n')
+        qlib.write_sidecar(p, hx)
+    # The catalog is bookkeeping: a locked or damaged catalog.db mustn't fail a finished quant
+    try:
+        qlib.gguf_catalog.update(ggufs)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        sys.stderr.write(f'Not cataloged: {e}\n')
 
 def gguf_split(xguf, outp):
-    result = subprocess.run([gguf_split_exe, '--split-max-size', '50G', str(xguf), str(outp)])
-    if result.returncode:
-        raise RuntimeError(f'llama-gguf-split returned {result.returncode}')
+    # The shards are hashed as they're written, so hash_files finds them cached
+    pl = qlib.misc.ProgressLine(xguf.size, f'Splitting {xguf.name}')
+    shards = qlib.split_gguf(xguf, outp, progress=pl.update_progress)
+    pl.finish()
+    return [s.path for s in shards]
 
 def split_or_link(xguf: Path, dest: Path):
     if xguf.size > qlib.MAX_UPLOAD_SIZE:
         outp = dest.with_suffix('') + '-split'
-        gguf_split(xguf, outp)
-        for p in xguf.parent.glob(outp.name + '*.gguf'):
+        for p in gguf_split(xguf, outp):
             yield(p)
     else:
         dest.hardlink_to(xguf)
@@ -63,7 +54,7 @@ def purge(p, srcp=None):
 def purge_all(dirp, pattern, srcp=None):
     for p in list(dirp.glob(pattern)):
         purge(p, srcp)
-    for p in list(dirp.glob(pattern + '.sha256')):
+    for p in list(dirp.glob(pattern + '.sha256')) + list(dirp.glob(pattern + '.chunks')):
         purge(p)
 
 def validate(args):
@@ -86,12 +77,10 @@ def main():
     parser.add_argument('infile', type=Path, help='Name of gguf file to operate on')
     parser.add_argument('outfile', type=Path, nargs='?', help='Name of gguf file to operate on')
     args = validate(parser.parse_args())
-    init_paths()
     dirp = args.outfile.parent
     stem = args.outfile.stem
     purge_all(dirp, stem + '*.gguf', args.infile)
-    for outp in split_or_link(args.infile, args.outfile.with_suffix('.gguf')):
-        hash_file(outp)
+    hash_files(split_or_link(args.infile, args.outfile.with_suffix('.gguf')))
     if args.rename:
         args.infile.rename(args.outfile)
 
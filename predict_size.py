@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+import sys
+from pathlib import Path
+import argparse
+from qlib.defs import *
+from qlib.pipeline import IQTYPES, KQTYPES
+from qlib.quantsize import QuantSizePredictor
+from qlib.scheduler import disk_free
+
+def main():
+    parser = argparse.ArgumentParser(description='Predict quant output sizes from the tensor metadata of a GGUF')
+    parser.add_argument('gguf', type=Path, help='Unquantized GGUF (usually $R.bin)')
+    parser.add_argument('qtypes', type=str.upper, nargs='*', help='Quant types (default: all built by defs.mk)')
+    parser.add_argument('--directory', '-d', type=Path,
+                        help='Check that the outputs fit in the free space here')
+    parser.add_argument('--types', '-t', action='store_true', help='Show per-tensor type counts')
+    args = parser.parse_intermixed_args()
+
+    predictor = QuantSizePredictor(args.gguf)
+    total = 0
+    for qtype in args.qtypes or IQTYPES + KQTYPES:
+        p = predictor.predict(qtype)
+        total += p.size
+        split = f'  -> {p.shards} shards' if p.needs_split else ''
+        print(f'{qtype:8} {p.size:19,} ({p.size/GB:7.2f} GB){split}')
+        if args.types:
+            print('         ' + ', '.join(f'{k}:{v}' for k,v in p.tensor_types.most_common()))
+    print(f'{"total":8} {total:19,} ({total/GB:7.2f} GB)')
+    if args.directory:
+        free = disk_free(args.directory)
+        print(f'{"free":8} {free:19,} ({free/GB:7.2f} GB)')
+        if total > free:
+            sys.exit(f'Outputs will not fit in {args.directory}')
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,67 @@
 from .defs import *
 from . import hacks
 from .iobuffer import *
-from .hfutil import *
-from . import backyard
 from .misc import *
-from .xguf import *
+import importlib
+import importlib.util
+
+# Submodules that pull in heavy dependencies (gguf/numpy, huggingface_hub,
+# requests) are only imported when one of their symbols is first looked up
+# on the package, so scripts that just hash or rename files start quickly.
+# Each module's symbols are its __all__; bench_import.py fails if they drift.
+_lazy_symbols = {
+    'xguf': ('GGUFReader', 'GGUFMetadataReader', 'HTTPRangeFile', 'http_opener', 'TensorInfo'),
+    'hfutil': ('hfapi', 'hfs', 'organization', 'hf_url_prefix', 'Uploader', 'UploadJournal', 'list_models',
+               'is_safetensors_model', 'recent_safetensors_models', 'ModelFile', 'RepositoryNotFoundError',
+               'Model', 'SourceModel', 'QuantModel', 'repo_type_and_id_from_hf_id_default',
+               'repo_type_and_id_from_hf_id', 'paramsize_rx', 'UploadInfo_from_path', 'required_source_files',
+               'snapshot_is_safetensors_model', 'safetensors_probe', 'remote_safetensors_tensors'),
+    'hashing': ('PipelinedReader', 'SHA256State', 'hash_stream', 'hash_file', 'hash_files', 'git_blob_header',
+                'BufferPool', 'open_stream', 'device_is_rotational', 'concurrent_files'),
+    'ggufsplit': ('GGUFSplitter', 'ShardResult', 'split_gguf', 'split_rx', 'KV_SPLIT_NO', 'KV_SPLIT_COUNT',
+                  'KV_SPLIT_TENSORS_COUNT', 'shard_path', 'pad', 'gguf_string', 'kv_bytes', 'tensor_info_bytes',
+                  'TensorStream'),
+    'ggufedit': ('GGUFEditor', 'edit_gguf', 'scalar_formats', 'protected_keys', 'value_bytes', 'first_shard'),
+    'catalog': ('Catalog', 'CatalogEntry', 'gguf_catalog', 'quant_type', 'max_array_items', 'block_num',
+                'TensorHash', 'ShardDiff', 'tensor_hashes', 'header_digest'),
+    'imatrix': ('Imatrix', 'ImatrixEntry', 'merge_imatrices', 'max_dataset_len', 'ImatrixStats',
+                'dataset_record'),
+    'checkpoint': ('TensorMeta', 'checkpoint_tensors', 'model_tensors', 'count_params', 'main_dtype',
+                   'max_header_size', 'legacy_magic', 'legacy_protocol', 'safetensors_header_size',
+                   'parse_safetensors_header', 'safetensors_tensors', 'storage_dtypes', 'StorageType',
+                   'StorageRef', 'rebuild_tensor', 'CheckpointUnpickler', 'state_dict_tensors',
+                   'legacy_torch_tensors', 'torch_tensors', 'checkpoint_files', 'unique_tensors'),
+    'copier': ('CopyResult', 'copy_file', 'FICLONE', 'unsupported_errors', 'reflink', 'preallocate',
+               'kernel_copy', 'user_copy'),
+    'chunks': ('ChunkManifest', 'hash_file_chunked', 'verify_chunks', 'valid_manifest', 'default_chunk_size',
+               'checkpoint_interval', 'manifest_path'),
+    'hubcache': ('HubCache', 'hub_cache', 'default_ttl', 'missing_ttl', 'content_ttl', 'purge_interval', 'RepoFile',
+                 'RepoSnapshot'),
+    'fakehub': ('FakeHub', 'lfs_threshold', 'FakeHubHandler', 'hub_time', 'git_blob_id'),
+    'lfsupload': ('LFSUploader', 'retry_statuses', 'FileSlice', 'is_transient'),
+    'hashcache': ('HashCache', 'hash_cache', 'hash_kind', 'file_hash', 'file_hashes', 'write_sidecar',
+                  'hash_kinds', 'stat_key', 'sidecar_path'),
+}
+# Loading a lazy module also loads these, for the side effects they install
+_lazy_companions = {
+    'hfutil': ('backyard',)
+}
+
+def _load(name:str):
+    module = importlib.import_module('.' + name, __name__)
+    for companion in _lazy_companions.get(name, ()):
+        importlib.import_module('.' + companion, __name__)
+    return module
+
+_symbol_modules = {sym: modname for modname,symbols in _lazy_symbols.items() for sym in symbols}
+
+def __getattr__(name:str):
+    if modname := _symbol_modules.get(name):
+        globals()[name] = value = getattr(_load(modname), name)
+        return value
+    if not name.startswith('__') and (name in _lazy_symbols or importlib.util.find_spec('.' + name, __name__)):
+        return _load(name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def __dir__():
+    return sorted(set(globals()).union(*_lazy_symbols.values()))
@@ -223,7 +223,7 @@ class Manifest:
         for mf in sorted(self.nonsplitggufs(), key=attrgetter('sortkey')):
             lname = f'{self.catalog_name}.{self.file_format}.{mf.qtype.lower()}'
             yield {
-                'commitHash': self.model.model_info.sha,
+                'commitHash': self.model.snapshot.sha,
                 'isDeprecated': False,
                 'displayLink' : self.model.url + '/',
                 'hfPathFromRoot': mf.name,
@@ -0,0 +1,304 @@
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from dataclasses import dataclass, fields, astuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, NamedTuple
+import gguf
+from .defs import *
+from .misc import cache_dir
+from .xguf import *
+from .ggufsplit import split_rx, KV_SPLIT_NO, KV_SPLIT_COUNT
+from .hashing import *
+from .hashcache import *
+from .pagecache import *
+
+__exclude__ = set(locals())
+
+# Arrays longer than this (vocabularies, merges) are left out of the stored metadata
+max_array_items = 64
+
+def quant_type(path: os.PathLike[str] | str) -> str:
+    """The quant type in a <model>.<qtype>.gguf or <model>.<qtype>-split-NNNNN-of-NNNNN.gguf name"""
+    stem = Path(path).stem
+    if m := split_rx.search(stem):
+        stem = stem[:m.start()].removesuffix('-split')
+    return stem.rpartition('.')[2]
+
+def block_num(name: str) -> int | None:
+    return int(name.split('.')[1]) if name.startswith('blk.') else None
+
+@dataclass
+class CatalogEntry:
+    """What the catalog knows about one GGUF file or shard"""
+    path: Path
+    dev: int
+    ino: int
+    size: int
+    mtime_ns: int
+    qtype: str
+    name: str | None = None
+    arch: str | None = None
+    file_type: int | None = None
+    split_no: int = 0
+    split_count: int = 1
+    n_tensors: int = 0
+    n_params: int = 0
+    tensor_bytes: int = 0
+    leading_bytes: int = 0                  # tensor data before the first block
+    sha256: str | None = None
+    metadata: dict[str, Any] | None = None
+    tensor_types: dict[str, list[int]] | None = None   # type name -> [count, bytes]
+    blocks: list[int] | None = None                    # tensor bytes of each block
+    provenance: dict[str, Any] | None = None           # quantize.* keys
+
+    json_fields = ('metadata', 'tensor_types', 'blocks', 'provenance')
+
+    @property
+    def key(self) -> tuple[int, int, int, int]:
+        return (self.dev, self.ino, self.size, self.mtime_ns)
+
+    def to_row(self) -> tuple:
+        return tuple(str(v) if f.name == 'path' else json.dumps(v) if f.name in self.json_fields else v
+                     for f,v in zip(fields(self), astuple(self)))
+
+    @classmethod
+    def from_row(cls, row: tuple) -> 'CatalogEntry':
+        return cls(*(Path(v) if f.name == 'path' else json.loads(v) if f.name in cls.json_fields else v
+                     for f,v in zip(fields(cls), row)))
+
+    @classmethod
+    def scan(cls, path: Path, st: os.stat_result) -> 'CatalogEntry':
+        reader = GGUFMetadataReader(path)
+        metadata, provenance = {}, {}
+        for f in reader.fields.values():
+            if f.name.startswith('GGUF.'):
+                continue
+            # parts are key length, key, type, item type, item count, items
+            if f.types[0] == gguf.GGUFValueType.ARRAY and int(f.parts[4][0]) > max_array_items:
+                continue
+            value = f.contents()
+            metadata[f.name] = value
+            if f.name.startswith('quantize.'):
+                provenance[f.name] = value
+        tensor_types, blocks = {}, []
+        leading = n_params = total = 0
+        for t in reader.tensor_infos:
+            counts = tensor_types.setdefault(t.tensor_type.name, [0, 0])
+            counts[0] += 1
+            counts[1] += t.n_bytes
+            n_params += t.n_elements
+            total += t.n_bytes
+            if (blk := block_num(t.name)) is not None:
+                blocks.extend([0] * (blk + 1 - len(blocks)))
+                blocks[blk] += t.n_bytes
+            elif not blocks:
+                leading += t.n_bytes
+        return cls(path, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, quant_type(path),
+                   name=metadata.get('general.name'), arch=metadata.get('general.architecture'),
+                   file_type=metadata.get('general.file_type'),
+                   split_no=metadata.get(KV_SPLIT_NO, 0), split_count=metadata.get(KV_SPLIT_COUNT, 1),
+                   n_tensors=len(reader.tensor_infos), n_params=n_params, tensor_bytes=total,
+                   leading_bytes=leading, sha256=hash_cache.lookup(path, 'sha256', st),
+                   metadata=metadata, tensor_types=tensor_types, blocks=blocks, provenance=provenance)
+
+class TensorHash(NamedTuple):
+    name: str
+    tensor_type: str
+    offset: int                 # of the data, from the start of the file
+    n_bytes: int
+    sha256: str
+
+class ShardDiff(NamedTuple):
+    path: Path
+    status: str                 # 'unchanged', 'metadata' (same tensors, new header) or 'changed'
+    changed_tensors: int
+    changed_bytes: int
+
+def tensor_hashes(path: os.PathLike[str] | str, *, workers: int | None = None,
+                  progress: Callable[[int], None] | None = None, stream: str | None = None) -> list[TensorHash]:
+    """Hashes the data of each tensor in a GGUF, several tensors at once on flash storage."""
+    reader = GGUFMetadataReader(path)
+    stream = stream_io_mode() if stream is None else stream
+    lock = threading.Lock()
+    with open(path, 'rb', buffering=0) as f:
+        cached = b''
+        if stream:
+            with Residency(f.fileno()) as r:
+                cached = r.pages()
+        def hash_tensor(t: TensorInfo) -> TensorHash:
+            h = hashlib.sha256(usedforsecurity=False)
+            buffer = bytearray(4*MiB)
+            start = offset = reader.data_offset + t.offset
+            end = start + t.n_bytes
+            while offset < end:
+                n = os.preadv(f.fileno(), [memoryview(buffer)[:min(len(buffer), end - offset)]], offset)
+                if not n:
+                    raise EOFError(f'{path} ends in the middle of {t.name}')
+                h.update(memoryview(buffer)[:n])
+                offset += n
+                if progress:
+                    with lock:
+                        progress(n)
+            # Like ReadBehind, leave pages alone that were cached before we came
+            if stream and not cached[start // page_size:-(-end // page_size)].strip(b'\0'):
+                fadvise(f.fileno(), start, t.n_bytes, os.POSIX_FADV_DONTNEED)
+            return TensorHash(t.name, t.tensor_type.name, start, t.n_bytes, h.hexdigest())
+        workers = workers or (1 if device_is_rotational(path) else min(8, os.cpu_count() or 1))
+        with ThreadPoolExecutor(workers) as executor:
+            return list(executor.map(hash_tensor, reader.tensor_infos))
+
+def header_digest(path: os.PathLike[str] | str, tensors: list[TensorHash]) -> str:
+    # Everything before the first tensor's data: the header and its padding
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read(min((t.offset for t in tensors), default=os.path.getsize(path))),
+                              usedforsecurity=False).hexdigest()
+
+class Catalog:
+    """A SQLite catalog of local GGUF files and shards, one row each.
+
+    Rows hold the header metadata, a histogram of tensor types, per-block
+    sizes, the sha256 (when the hash cache knows it) and the quantize.*
+    provenance keys. A row is only rebuilt when the file's inode, size or
+    mtime changes, so answering questions about a directory of quants costs
+    a stat per file instead of a header parse.
+    """
+    def __init__(self, db_path: Path | None = None):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self._db = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.db_path = self.db_path or cache_dir() / 'catalog.db'
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            columns = ', '.join(f.name for f in fields(CatalogEntry))
+            self._db.execute(f'CREATE TABLE IF NOT EXISTS ggufs ({columns}, PRIMARY KEY (path))')
+            self._db.execute('CREATE INDEX IF NOT EXISTS ggufs_qtype ON ggufs (qtype)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS tensors (path TEXT, name TEXT, tensor_type TEXT, '
+                             '"offset" INTEGER, n_bytes INTEGER, sha256 TEXT, PRIMARY KEY (path, name))')
+            self._db.execute('CREATE INDEX IF NOT EXISTS tensors_sha256 ON tensors (sha256)')
+        return self._db
+
+    def get(self, path: os.PathLike[str] | str) -> CatalogEntry | None:
+        with self.lock:
+            row = self.db.execute('SELECT * FROM ggufs WHERE path=?', (str(Path(path).absolute()),)).fetchone()
+        return row and CatalogEntry.from_row(row)
+
+    def put(self, entry: CatalogEntry):
+        row = entry.to_row()
+        with self.lock:
+            self.db.execute(f'INSERT OR REPLACE INTO ggufs VALUES ({", ".join("?" * len(row))})', row)
+
+    def forget(self, paths: Iterable[os.PathLike[str] | str]):
+        keys = [(str(Path(p).absolute()),) for p in paths]
+        with self.lock:
+            self.db.executemany('DELETE FROM ggufs WHERE path=?', keys)
+            self.db.executemany('DELETE FROM tensors WHERE path=?', keys)
+
+    def entry(self, path: os.PathLike[str] | str, *, hash=False, **kwargs) -> CatalogEntry:
+        """The up to date entry for a GGUF, scanning it only if it is new or has changed"""
+        path = Path(path).absolute()
+        st = path.stat()
+        entry = self.get(path)
+        if not (entry and entry.key == stat_key(st)):
+            entry = CatalogEntry.scan(path, st)
+            with self.lock:
+                self.db.execute('DELETE FROM tensors WHERE path=?', (str(path),))
+        elif entry.sha256:
+            return entry
+        elif digest := hash_cache.lookup(path, 'sha256', st):
+            entry.sha256 = digest
+        elif not hash:
+            return entry
+        if hash and not entry.sha256:
+            entry.sha256 = hash_cache.file_hash(path, 'sha256', **kwargs)
+        self.put(entry)
+        return entry
+
+    def update(self, paths: Iterable[os.PathLike[str] | str], *, hash=False,
+               **kwargs) -> list[CatalogEntry]:
+        """Brings the entries for GGUFs (and *.gguf in directories) up to date and returns them.
+
+        Entries for files that have gone from a directory are dropped.
+        """
+        entries = []
+        for p in map(Path, paths):
+            if p.is_dir():
+                p = p.absolute()
+                files = sorted(f for f in p.glob('*.gguf') if f.is_file())
+                with self.lock:
+                    known = [Path(r[0]) for r in self.db.execute('SELECT path FROM ggufs WHERE path >= ? AND path < ?',
+                                                                 (f'{p}/', f'{p}0'))]
+                self.forget(f for f in known if f.parent == p and f not in files)
+            else:
+                files = [p]
+            entries.extend(self.entry(f, hash=hash, **kwargs) for f in files)
+        return entries
+
+    def tensors(self, path: os.PathLike[str] | str, *, hash=True, **kwargs) -> list[TensorHash]:
+        """Per-tensor sha256s of a GGUF, hashing them (if hash) when the catalog has none for this version"""
+        entry = self.entry(path)
+        with self.lock:
+            rows = self.db.execute('SELECT name, tensor_type, "offset", n_bytes, sha256 FROM tensors '
+                                   'WHERE path=? ORDER BY "offset"', (str(entry.path),)).fetchall()
+        if rows or not hash or not entry.n_tensors:
+            return [TensorHash(*r) for r in rows]
+        hashes = tensor_hashes(entry.path, **kwargs)
+        if stat_key(entry.path.stat()) == entry.key:
+            with self.lock:
+                self.db.executemany('INSERT OR REPLACE INTO tensors VALUES (?, ?, ?, ?, ?, ?)',
+                                    ((str(entry.path), *h) for h in hashes))
+        return hashes
+
+    def duplicates(self, paths: Iterable[os.PathLike[str] | str], **kwargs) -> list[list[tuple[Path, TensorHash]]]:
+        """Groups of identical tensors among GGUFs (and directories of them), most wasted bytes first"""
+        groups = {}
+        for e in self.update(paths):
+            for t in self.tensors(e.path, **kwargs):
+                groups.setdefault(t.sha256, []).append((e.path, t))
+        dups = [g for g in groups.values() if len(g) > 1]
+        return sorted(dups, key=lambda g: -g[0][1].n_bytes * (len(g) - 1))
+
+    def diff(self, old: Iterable[os.PathLike[str] | str], new: Iterable[os.PathLike[str] | str],
+             **kwargs) -> list[ShardDiff]:
+        """How each GGUF or shard of a new build differs from an old build of the same model.
+
+        A shard with the same header and tensors as one in the old build is
+        'unchanged' (byte for byte, so it needn't be uploaded again); one whose
+        tensors are all in the old build but whose header isn't is 'metadata'.
+        """
+        known, shards = {}, set()
+        for e in self.update(old):
+            tensors = self.tensors(e.path, **kwargs)
+            known.update((t.name, t.sha256) for t in tensors)
+            shards.add((header_digest(e.path, tensors), tuple((t.name, t.sha256) for t in tensors)))
+        diffs = []
+        for e in self.update(new):
+            tensors = self.tensors(e.path, **kwargs)
+            changed = [t for t in tensors if known.get(t.name) != t.sha256]
+            if changed:
+                status = 'changed'
+            elif (header_digest(e.path, tensors), tuple((t.name, t.sha256) for t in tensors)) in shards:
+                status = 'unchanged'
+            else:
+                status = 'metadata'
+            diffs.append(ShardDiff(e.path, status, len(changed), sum(t.n_bytes for t in changed)))
+        return diffs
+
+    def query(self, where: str = '', params: Iterable = (), order: str = 'path') -> list[CatalogEntry]:
+        """Entries matching an SQL condition on the ggufs table, without refreshing them"""
+        sql = 'SELECT * FROM ggufs' + (f' WHERE {where}' if where else '') + f' ORDER BY {order}'
+        with self.lock:
+            rows = self.db.execute(sql, tuple(params)).fetchall()
+        return [CatalogEntry.from_row(r) for r in rows]
+
+gguf_catalog = Catalog()
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
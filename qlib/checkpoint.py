@@ -0,0 +1,177 @@
+import os
+import json
+import struct
+import pickle
+import zipfile
+import collections
+from pathlib import Path
+from typing import Iterable, NamedTuple
+from .defs import *
+
+__exclude__ = set(locals())
+
+# Headers bigger than this aren't safetensors (the format caps them at 100 MB)
+max_header_size = 100*MB
+
+# What torch.save wrote before the zip format (torch < 1.6) starts with
+legacy_magic = 0x1950a86a20f9469cfc6c
+legacy_protocol = 1001
+
+class TensorMeta(NamedTuple):
+    name: str
+    dtype: str                  # as safetensors names them: BF16, F16, F32, I64...
+    shape: tuple[int, ...]
+    storage: tuple | None = None    # (file, storage key, offset) of a PyTorch tensor, for spotting tied ones
+
+    @property
+    def n_elements(self) -> int:
+        n = 1
+        for d in self.shape:
+            n *= d
+        return n
+
+def safetensors_header_size(prefix: bytes) -> int:
+    """Bytes taken by the header of a safetensors file, from its first 8"""
+    (n,) = struct.unpack('<Q', prefix[:8])
+    if n > max_header_size:
+        raise ValueError(f'Improbable safetensors header size of {n}')
+    return 8 + n
+
+def parse_safetensors_header(header: bytes) -> list[TensorMeta]:
+    """Tensors described by a safetensors header (the JSON, with or without its length prefix)"""
+    if header[:1] != b'{':
+        header = header[8:safetensors_header_size(header)]
+    return [TensorMeta(name, t['dtype'], tuple(t['shape']))
+            for name, t in json.loads(header).items() if not name == '__metadata__']
+
+def safetensors_tensors(path: os.PathLike[str] | str) -> list[TensorMeta]:
+    with open(path, 'rb') as f:
+        size = safetensors_header_size(f.read(8))
+        return parse_safetensors_header(f.read(size - 8))
+
+# PyTorch storage classes, as pickled in checkpoints, and their dtypes
+storage_dtypes = {
+    'BFloat16Storage': 'BF16', 'HalfStorage': 'F16', 'FloatStorage': 'F32', 'DoubleStorage': 'F64',
+    'ByteStorage': 'U8', 'CharStorage': 'I8', 'ShortStorage': 'I16', 'IntStorage': 'I32',
+    'LongStorage': 'I64', 'BoolStorage': 'BOOL',
+}
+
+class StorageType(NamedTuple):
+    dtype: str
+
+class StorageRef(NamedTuple):
+    dtype: str
+    source: str
+    key: str
+
+def rebuild_tensor(storage: StorageRef, storage_offset, size, *args) -> TensorMeta:
+    return TensorMeta('', storage.dtype, tuple(size), (storage.source, storage.key, storage_offset))
+
+class CheckpointUnpickler(pickle.Unpickler):
+    """Unpickles a PyTorch state dict into TensorMetas, without torch and without reading tensor data.
+
+    Only the classes a state dict uses are allowed; storages are never loaded.
+    Tensors remember which storage of source they view, so tied ones can be
+    counted once.
+    """
+    rebuilders = {
+        ('torch._utils', '_rebuild_tensor_v2'): rebuild_tensor,
+        ('torch._utils', '_rebuild_tensor'): rebuild_tensor,
+        ('torch._utils', '_rebuild_parameter'): lambda data, *args: data,
+        ('torch._utils', '_rebuild_parameter_with_state'): lambda data, *args: data,
+        ('torch._tensor', '_rebuild_from_type_v2'): lambda func, new_type, args, state: func(*args),
+        ('collections', 'OrderedDict'): collections.OrderedDict,
+    }
+
+    def __init__(self, file, source: str = ''):
+        super().__init__(file)
+        self.source = source
+
+    def find_class(self, module: str, name: str):
+        if module == 'torch' and name in storage_dtypes:
+            return StorageType(storage_dtypes[name])
+        if rebuilder := self.rebuilders.get((module, name)):
+            return rebuilder
+        raise pickle.UnpicklingError(f'{module}.{name} is not expected in a checkpoint')
+
+    def persistent_load(self, pid):
+        # ('storage', storage type, key, location, number of elements[, view metadata])
+        return StorageRef(pid[1].dtype, self.source, str(pid[2]))
+
+def state_dict_tensors(state: dict, prefix: str = '') -> Iterable[TensorMeta]:
+    for name, value in state.items():
+        if isinstance(value, TensorMeta):
+            yield value._replace(name=prefix + name)
+        elif isinstance(value, dict):
+            yield from state_dict_tensors(value, f'{prefix}{name}.')
+
+def legacy_torch_tensors(path: os.PathLike[str] | str) -> list[TensorMeta]:
+    """Tensors of a PyTorch checkpoint in the format before zip: a magic number,
+    protocol version and system info, each pickled, then the state dict and the storages
+    """
+    with open(path, 'rb') as f:
+        load = lambda: CheckpointUnpickler(f, str(path)).load()
+        try:
+            magic = load()
+        except (pickle.UnpicklingError, EOFError, ValueError) as e:
+            raise ValueError(f'{path} is not a PyTorch checkpoint') from e
+        if not magic == legacy_magic:
+            raise ValueError(f'{path} is not a PyTorch checkpoint')
+        if not (protocol := load()) == legacy_protocol:
+            raise ValueError(f'{path} has unsupported PyTorch protocol version {protocol}')
+        load()                  # system info
+        return list(state_dict_tensors(load()))
+
+def torch_tensors(path: os.PathLike[str] | str) -> list[TensorMeta]:
+    """Tensors of a PyTorch checkpoint, read from its pickle alone"""
+    if not zipfile.is_zipfile(path):
+        return legacy_torch_tensors(path)
+    with zipfile.ZipFile(path) as z:
+        pkl = next((n for n in z.namelist() if n.endswith('data.pkl')), None)
+        if not pkl:
+            raise ValueError(f'{path} has no data.pkl')
+        with z.open(pkl) as f:
+            return list(state_dict_tensors(CheckpointUnpickler(f, str(path)).load()))
+
+def checkpoint_tensors(path: os.PathLike[str] | str) -> list[TensorMeta]:
+    return safetensors_tensors(path) if Path(path).suffix == '.safetensors' else torch_tensors(path)
+
+def checkpoint_files(model_dir: os.PathLike[str] | str) -> list[Path]:
+    """The weight files of a model directory: safetensors if it has them, else PyTorch pickles"""
+    model_dir = Path(model_dir)
+    for pattern in ('model*.safetensors', 'pytorch_model*.bin'):
+        if files := sorted(model_dir.glob(pattern)):
+            return files
+    return []
+
+def model_tensors(model_dir: os.PathLike[str] | str) -> list[TensorMeta]:
+    """Tensors across every shard of a model, from headers only"""
+    if not (files := checkpoint_files(model_dir)):
+        raise ValueError(f'{model_dir} seems to be neither safetensors nor pytorch')
+    return [t for f in files for t in checkpoint_tensors(f)]
+
+def unique_tensors(tensors: Iterable[TensorMeta]) -> Iterable[TensorMeta]:
+    """The tensors, with those tied to one already seen (same storage, offset and shape) left out"""
+    seen = set()
+    for t in tensors:
+        if t.storage is not None:
+            if (key := (t.storage, t.shape)) in seen:
+                continue
+            seen.add(key)
+        yield t
+
+def count_params(tensors: Iterable[TensorMeta]) -> int:
+    """Parameters in the tensors, counting tied ones once as transformers' num_parameters does"""
+    return sum(t.n_elements for t in unique_tensors(tensors))
+
+def main_dtype(tensors: Iterable[TensorMeta]) -> str:
+    """The dtype holding the most parameters (norms are often F32 in a BF16 model)"""
+    counts = collections.Counter()
+    for t in unique_tensors(tensors):
+        counts[t.dtype] += t.n_elements
+    if not counts:
+        raise ValueError('No tensors')
+    return counts.most_common(1)[0][0]
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from .defs import *
+from .hashing import *
+
+__exclude__ = set(locals())
+
+default_chunk_size = 64*MiB
+
+# Least time between writes of the resume point while hashing
+checkpoint_interval = 10.0
+
+def manifest_path(path: os.PathLike[str] | str) -> Path:
+    return Path(str(path) + '.chunks')
+
+@dataclass
+class ChunkManifest:
+    """Per-chunk sha256s of a file, written next to it as <file>.chunks.
+
+    Built while the whole-file digest is computed, it lets a copy or download
+    be verified a chunk at a time in parallel and shows which regions differ.
+    While hashing is in progress it also records the SHA-256 context at the
+    end of the last finished chunk, so an interrupted hash resumes there.
+    """
+    size: int
+    mtime_ns: int
+    chunk_size: int = default_chunk_size
+    chunks: list[str] = field(default_factory=list)
+    state: str | None = None
+    sha256: str | None = None
+
+    @property
+    def nchunks(self) -> int:
+        return max(1, -(-self.size // self.chunk_size))
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.sha256) and len(self.chunks) == self.nchunks
+
+    @property
+    def root(self) -> str:
+        return hashlib.sha256(b''.join(bytes.fromhex(c) for c in self.chunks)).hexdigest()
+
+    def matches(self, st: os.stat_result) -> bool:
+        return st.st_size == self.size and st.st_mtime_ns == self.mtime_ns
+
+    @classmethod
+    def load(cls, path: os.PathLike[str] | str) -> 'ChunkManifest | None':
+        try:
+            with manifest_path(path).open('rt') as f:
+                return cls(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def save(self, path: os.PathLike[str] | str) -> bool:
+        """Writes the manifest if the file's directory allows it; returns whether it did"""
+        mp = manifest_path(path)
+        tmp = mp.with_name(mp.name + '.tmp')
+        try:
+            with tmp.open('wt') as f:
+                json.dump(self.__dict__, f)
+            tmp.replace(mp)
+            return True
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            return False
+
+def valid_manifest(path: os.PathLike[str] | str, st: os.stat_result | None = None) -> ChunkManifest | None:
+    m = ChunkManifest.load(path)
+    return m if m and m.matches(st or os.stat(path)) else None
+
+def hash_file_chunked(path: os.PathLike[str] | str, *, progress: Callable[[int], None] | None = None,
+                      chunk_size: int = default_chunk_size, stream: str | None = None, **kwargs):
+    """Returns the sha256 hash object of a file, writing its chunk manifest as it goes.
+
+    The resume point is written at most every checkpoint_interval seconds.
+    Where the manifest can't be written the file is still hashed, just
+    without one.
+    """
+    st = os.stat(path)
+    m = valid_manifest(path, st)
+    if m and m.state and m.chunks and not m.complete and m.chunk_size == chunk_size and SHA256State.available():
+        h = SHA256State(bytes.fromhex(m.state))
+        offset = len(m.chunks) * chunk_size
+        if progress:
+            progress(offset)
+    else:
+        m = ChunkManifest(st.st_size, st.st_mtime_ns, chunk_size)
+        h = SHA256State() if SHA256State.available() else hashlib.sha256(usedforsecurity=False)
+        offset = 0
+    resumable = isinstance(h, SHA256State)
+    checkpointed = time.monotonic()
+
+    chunk = hashlib.sha256(usedforsecurity=False)
+    chunk_left = chunk_size
+    f, stream = open_stream(path, stream)
+    f.seek(offset)
+    with f, ThreadPoolExecutor(1) as executor, PipelinedReader(f, stream=stream, **kwargs) as reader:
+        for buffer in reader:
+            view = memoryview(buffer.buffer)[:buffer.length]
+            while view:
+                part, view = view[:chunk_left], view[chunk_left:]
+                # The two digests are computed side by side on different threads
+                pending = executor.submit(chunk.update, part)
+                h.update(part)
+                pending.result()
+                if not (chunk_left := chunk_left - len(part)):
+                    m.chunks.append(chunk.hexdigest())
+                    chunk = hashlib.sha256(usedforsecurity=False)
+                    chunk_left = chunk_size
+                    if resumable and time.monotonic() - checkpointed >= checkpoint_interval:
+                        m.state = h.state.hex()
+                        resumable = m.save(path)
+                        checkpointed = time.monotonic()
+            nbytes = buffer.length
+            reader.release(buffer)
+            if progress:
+                progress(nbytes)
+    if chunk_left < chunk_size or not m.chunks:
+        m.chunks.append(chunk.hexdigest())
+    m.state = None
+    m.sha256 = h.hexdigest()
+    if os.stat(path).st_mtime_ns == st.st_mtime_ns:
+        m.save(path)
+    return h
+
+def verify_chunks(path: os.PathLike[str] | str, manifest: ChunkManifest, *, workers: int | None = None,
+                  progress: Callable[[int], None] | None = None) -> list[int]:
+    """Hashes the chunks of a file in parallel, returning the indexes that don't match the manifest."""
+    size = os.stat(path).st_size
+    if not size == manifest.size:
+        raise ValueError(f'{path} is {size} bytes, manifest is for {manifest.size}')
+    lock = threading.Lock()
+    def check(i: int) -> bool:
+        h = hashlib.sha256(usedforsecurity=False)
+        buffer = bytearray(4*MiB)
+        offset, end = i * manifest.chunk_size, min(size, (i + 1) * manifest.chunk_size)
+        with open(path, 'rb', buffering=0) as f:
+            while offset < end:
+                n = os.preadv(f.fileno(), [memoryview(buffer)[:min(len(buffer), end - offset)]], offset)
+                if not n:
+                    break
+                h.update(memoryview(buffer)[:n])
+                offset += n
+                if progress:
+                    with lock:
+                        progress(n)
+        return h.hexdigest() == manifest.chunks[i]
+    workers = workers or min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(workers) as executor:
+        return [i for i,ok in enumerate(executor.map(check, range(len(manifest.chunks)))) if not ok]
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
@@ -0,0 +1,140 @@
+import os
+import errno
+import fcntl
+import hashlib
+from pathlib import Path
+from typing import Callable, NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+from .defs import *
+from .hashing import *
+from .hashcache import *
+from .pagecache import *
+
+__exclude__ = set(locals())
+
+FICLONE = 0x40049409
+
+# Errors that mean "this way of copying isn't available here", not that the copy failed
+unsupported_errors = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY,
+                      errno.EBADF, errno.ETXTBSY)
+
+class CopyResult(NamedTuple):
+    method: str
+    size: int
+    sha256: str | None
+
+def reflink(src_fd: int, dst_fd: int) -> bool:
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError as e:
+        if e.errno in unsupported_errors:
+            return False
+        raise
+
+def preallocate(fd: int, size: int):
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as e:
+        if not e.errno in unsupported_errors:
+            raise
+
+def kernel_copy(src_fd: int, dst_fd: int, size: int, progress: Callable[[int], None] | None,
+                step: int = 64*MiB, stream: str = '', src_offset: int = 0, dst_offset: int = 0) -> str | None:
+    """Copies with copy_file_range, else sendfile; None if neither works between these files."""
+    for method in ('copy_file_range', 'sendfile'):
+        offset = 0
+        behind = ReadBehind(src_fd, src_offset) if stream else None
+        wbehind = WriteBehind(dst_fd, dst_offset) if stream else None
+        try:
+            if method == 'sendfile':
+                os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+            while offset < size:
+                cached = behind and behind.before(min(step, size - offset))
+                if method == 'copy_file_range':
+                    n = os.copy_file_range(src_fd, dst_fd, min(step, size - offset),
+                                           src_offset + offset, dst_offset + offset)
+                else:
+                    n = os.sendfile(dst_fd, src_fd, src_offset + offset, min(step, size - offset))
+                if not n:
+                    raise OSError(errno.EIO, f'{method} stopped short at {offset} of {size} bytes')
+                offset += n
+                if stream:
+                    behind.after(n, cached)
+                    wbehind.wrote(n)
+                if progress:
+                    progress(n)
+            if stream:
+                wbehind.close()
+            return method
+        except OSError as e:
+            # Only fall back if nothing has been copied yet
+            if offset or not e.errno in unsupported_errors:
+                raise
+        except AttributeError:
+            pass
+        finally:
+            if stream:
+                behind.close()
+    return None
+
+def user_copy(srcpath: os.PathLike[str] | str, dst, progress: Callable[[int], None] | None,
+              stream: str = '', **kwargs) -> str:
+    h = hashlib.sha256(usedforsecurity=False)
+    src, stream = open_stream(srcpath, stream)
+    wbehind = WriteBehind(dst.fileno()) if stream else None
+    with src, ThreadPoolExecutor(1) as executor, PipelinedReader(src, stream=stream, **kwargs) as reader:
+        for buffer in reader:
+            # Hash on another thread while this one writes the same buffer
+            pending = executor.submit(h.update, buffer.bytes)
+            buffer.writeto(dst)
+            pending.result()
+            nbytes = buffer.length
+            reader.release(buffer)
+            if wbehind:
+                wbehind.wrote(nbytes)
+            if progress:
+                progress(nbytes)
+    if wbehind:
+        wbehind.close()
+    return h.hexdigest()
+
+def copy_file(srcpath: os.PathLike[str] | str, destpath: os.PathLike[str] | str, *,
+              progress: Callable[[int], None] | None = None, userspace=False, stream: str | None = None,
+              **kwargs) -> CopyResult:
+    """Copies a file by the cheapest means available, recording its sha256 in the hash cache.
+
+    Tries a reflink, then copy_file_range and sendfile, then a userspace copy
+    that hashes the data on its way through. For the in-kernel methods the
+    source's digest is carried over if the cache already knows it. Unless
+    stream is '', neither file is left occupying the page cache afterwards.
+    """
+    stream = stream_io_mode() if stream is None else stream
+    st = os.stat(srcpath)
+    size = st.st_size
+    digest = None
+    with open(srcpath, 'rb', buffering=0) as src, open(destpath, 'wb', buffering=0) as dst:
+        method = None
+        if not userspace:
+            if reflink(src.fileno(), dst.fileno()):
+                method = 'reflink'
+                if progress:
+                    progress(size)
+            else:
+                preallocate(dst.fileno(), size)
+                method = kernel_copy(src.fileno(), dst.fileno(), size, progress, stream=stream)
+        if not method:
+            if userspace:
+                preallocate(dst.fileno(), size)
+            digest = user_copy(srcpath, dst, progress, stream, **kwargs)
+            method = 'userspace'
+    if not os.stat(srcpath).st_mtime_ns == st.st_mtime_ns:
+        raise RuntimeError(f'{srcpath} changed while it was being copied')
+    if not digest:
+        digest = hash_cache.lookup(srcpath, 'sha256', st)
+    if digest:
+        hash_cache.put(destpath, 'sha256', digest)
+    return CopyResult(method, size, digest)
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
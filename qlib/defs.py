@@ -9,3 +9,6 @@ GB = MB*KB
 KiB = 1024
 MiB = KiB*KiB
 GiB = MiB*KiB
+
+MAX_BLOB_SIZE = 1*MB
+MAX_UPLOAD_SIZE = 50*GB
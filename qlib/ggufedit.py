@@ -0,0 +1,172 @@
+import os
+import struct
+import shutil
+from pathlib import Path
+from typing import Any, Callable
+import gguf
+from .defs import *
+from .iobuffer import write_all
+from .xguf import *
+from .hashing import *
+from .hashcache import *
+from .chunks import *
+from .pagecache import *
+from .copier import *
+from .ggufsplit import *
+
+__exclude__ = set(locals())
+
+scalar_formats = {
+    gguf.GGUFValueType.UINT8: 'B', gguf.GGUFValueType.INT8: 'b',
+    gguf.GGUFValueType.UINT16: 'H', gguf.GGUFValueType.INT16: 'h',
+    gguf.GGUFValueType.UINT32: 'I', gguf.GGUFValueType.INT32: 'i',
+    gguf.GGUFValueType.UINT64: 'Q', gguf.GGUFValueType.INT64: 'q',
+    gguf.GGUFValueType.FLOAT32: 'f', gguf.GGUFValueType.FLOAT64: 'd',
+    gguf.GGUFValueType.BOOL: '?',
+}
+
+# Keys that describe the file's layout rather than the model
+protected_keys = {'general.alignment', KV_SPLIT_NO, KV_SPLIT_COUNT, KV_SPLIT_TENSORS_COUNT}
+
+def value_bytes(vtype: gguf.GGUFValueType, value, itype: gguf.GGUFValueType | None = None) -> bytes:
+    if vtype == gguf.GGUFValueType.STRING:
+        return gguf_string(value)
+    if vtype == gguf.GGUFValueType.ARRAY:
+        if itype in scalar_formats:
+            items = struct.pack(f'<{len(value)}{scalar_formats[itype]}', *value)
+        else:
+            items = b''.join(value_bytes(itype, v) for v in value)
+        return struct.pack('<IQ', itype, len(value)) + items
+    return struct.pack('<' + scalar_formats[vtype], value)
+
+def first_shard(path: os.PathLike[str] | str) -> Path:
+    """The shard of a split GGUF that holds its metadata; path itself if it isn't split"""
+    path = Path(path)
+    if m := split_rx.search(path.stem):
+        return path.with_name(f'{path.stem[:m.start()]}-00001-of-{m[2]}{path.suffix}')
+    return path
+
+class GGUFEditor:
+    """Changes the metadata of a GGUF without rewriting its tensor data.
+
+    Only the KV section is rebuilt; tensor info is kept byte for byte. If the
+    new header still pads out to the same data offset it is written over the
+    old one in place, otherwise the tensor data is moved to a new file after
+    it with copy_file_range, which on most filesystems never leaves the kernel.
+    A file with other hard links (postquantize links each .gguf to its .xguf)
+    is always rewritten, so the edit breaks the link and never reaches them.
+    Given any shard of a split GGUF, the first one (which has the metadata)
+    is edited.
+    """
+    def __init__(self, path: os.PathLike[str] | str):
+        self.path = first_shard(path)
+        self.reader = reader = GGUFMetadataReader(self.path)
+        if reader.struct_order != '<':
+            raise ValueError(f'{self.path} is big-endian')
+        self.version = int(reader.fields['GGUF.version'].parts[0][0])
+        self.tensor_count = len(reader.tensor_infos)
+        self.alignment = reader.alignment
+        self.data_offset = reader.data_offset
+        self.tensor_info = reader.data[reader.tensor_info_offset:reader.tensor_info_end].tobytes()
+        self.fields = {f.name: f for f in reader.fields.values() if not f.name.startswith('GGUF.')}
+        self.kvs = {name: b''.join(p.tobytes() for p in f.parts) for name, f in self.fields.items()}
+        self.changed = False
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.kvs
+
+    def __getitem__(self, key: str) -> Any:
+        return self.fields[key].contents()
+
+    def keys(self) -> list[str]:
+        return list(self.kvs)
+
+    def types(self, key: str) -> list[gguf.GGUFValueType]:
+        return self.fields[key].types
+
+    def _check(self, key: str):
+        if key in protected_keys or key.startswith('GGUF.'):
+            raise KeyError(f'{key} describes the file layout and can\'t be edited')
+
+    def set(self, key: str, value, vtype: gguf.GGUFValueType | None = None,
+            itype: gguf.GGUFValueType | None = None):
+        """Sets a key, by default keeping its current type (or guessing one for a new key)"""
+        self._check(key)
+        if vtype is None:
+            if key in self.fields:
+                vtype, itype = (self.fields[key].types + [None])[:2]
+            else:
+                vtype = gguf.GGUFValueType.get_type(value)
+                if vtype == gguf.GGUFValueType.ARRAY:
+                    if not value:
+                        raise ValueError(f'Can\'t tell the item type of an empty array for {key}')
+                    itype = gguf.GGUFValueType.get_type(value[0])
+        if vtype == gguf.GGUFValueType.ARRAY and itype == gguf.GGUFValueType.ARRAY:
+            raise ValueError(f'{key}: nested arrays aren\'t supported')
+        kv = gguf_string(key) + struct.pack('<I', vtype) + value_bytes(vtype, value, itype)
+        if self.kvs.get(key) != kv:
+            self.kvs[key] = kv
+            self.changed = True
+
+    def remove(self, key: str):
+        self._check(key)
+        if self.kvs.pop(key, None) is not None:
+            self.changed = True
+
+    def header(self) -> bytes:
+        header = b''.join((b'GGUF', struct.pack('<IQQ', self.version, self.tensor_count, len(self.kvs)),
+                           *self.kvs.values(), self.tensor_info))
+        return header + bytes(pad(len(header), self.alignment))
+
+    def save(self, *, progress: Callable[[int], None] | None = None, stream: str | None = None) -> str:
+        """Writes the changes, returning how: 'unchanged', 'in place' or 'rewritten'"""
+        if not self.changed:
+            return 'unchanged'
+        header = self.header()
+        for stale in (sidecar_path(self.path), manifest_path(self.path)):
+            stale.unlink(missing_ok=True)
+        # Writing in place would edit every other name of a hard-linked file too
+        if len(header) == self.data_offset and self.path.stat().st_nlink == 1:
+            with open(self.path, 'r+b', buffering=0) as f:
+                write_all(f, header, 0)
+                os.fsync(f.fileno())
+            self.changed = False
+            return 'in place'
+        stream = stream_io_mode() if stream is None else stream
+        size = self.path.size - self.data_offset
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        try:
+            with open(self.path, 'rb', buffering=0) as src, open(tmp, 'wb', buffering=0) as dst:
+                preallocate(dst.fileno(), len(header) + size)
+                write_all(dst, header)
+                if not kernel_copy(src.fileno(), dst.fileno(), size, progress, stream=stream,
+                                   src_offset=self.data_offset, dst_offset=len(header)):
+                    dst.seek(len(header))
+                    src.seek(self.data_offset)
+                    with PipelinedReader(src, stream='fadvise' if stream else '') as reader:
+                        for buffer in reader:
+                            buffer.writeto(dst)
+                            if progress:
+                                progress(buffer.length)
+                            reader.release(buffer)
+            shutil.copymode(self.path, tmp)
+            tmp.replace(self.path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        self.data_offset = len(header)
+        self.changed = False
+        return 'rewritten'
+
+def edit_gguf(path: os.PathLike[str] | str, values: dict[str, Any] | None = None,
+              remove: list[str] | None = None, **kwargs) -> str:
+    """Sets and removes metadata keys of a GGUF (or split GGUF), keeping the types of existing keys"""
+    editor = GGUFEditor(path)
+    for key in remove or ():
+        editor.remove(key)
+    for key, value in (values or {}).items():
+        editor.set(key, value)
+    return editor.save(**kwargs)
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
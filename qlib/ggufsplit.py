@@ -0,0 +1,230 @@
+import os
+import re
+import struct
+import hashlib
+from pathlib import Path
+from typing import Callable, Iterator, NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+import gguf
+from .defs import *
+from .iobuffer import write_all
+from .xguf import *
+from .hashing import *
+from .hashcache import *
+from .pagecache import *
+
+__exclude__ = set(locals())
+
+split_rx = re.compile(r'-(\d{5})-of-(\d{5})$')
+
+KV_SPLIT_NO = gguf.Keys.Split.LLM_KV_SPLIT_NO
+KV_SPLIT_COUNT = gguf.Keys.Split.LLM_KV_SPLIT_COUNT
+KV_SPLIT_TENSORS_COUNT = gguf.Keys.Split.LLM_KV_SPLIT_TENSORS_COUNT
+
+class ShardResult(NamedTuple):
+    path: Path
+    size: int
+    sha256: str | None
+
+def shard_path(prefix: os.PathLike[str] | str, i: int, n: int) -> Path:
+    return Path(f'{prefix}-{i + 1:05d}-of-{n:05d}.gguf')
+
+def pad(n: int, alignment: int) -> int:
+    return -n % alignment
+
+def gguf_string(s: str) -> bytes:
+    b = s.encode('utf-8')
+    return struct.pack('<Q', len(b)) + b
+
+def kv_bytes(key: str, vtype: gguf.GGUFValueType, fmt: str, value) -> bytes:
+    return gguf_string(key) + struct.pack('<I', vtype) + struct.pack('<' + fmt, value)
+
+def tensor_info_bytes(t: TensorInfo, offset: int) -> bytes:
+    return (gguf_string(t.name) + struct.pack(f'<I{len(t.shape)}Q', len(t.shape), *t.shape)
+            + struct.pack('<IQ', t.tensor_type, offset))
+
+class TensorStream:
+    """Hands out the bytes of consecutive regions of a sequentially read file as memoryviews.
+
+    The views are only valid until the next call.
+    """
+    def __init__(self, reader: PipelinedReader, offset: int):
+        self.reader = reader
+        self.buffers = iter(reader)
+        self.buffer = None
+        self.view = memoryview(b'')
+        self.offset = offset
+
+    def _next(self):
+        if self.buffer:
+            self.reader.release(self.buffer)
+        if not (buffer := next(self.buffers, None)):
+            raise EOFError(f'GGUF data ends early at {self.offset}')
+        self.buffer = buffer
+        self.view = memoryview(buffer.buffer)[:buffer.length]
+
+    def take(self, nbytes: int) -> Iterator[memoryview]:
+        while nbytes:
+            if not self.view:
+                self._next()
+            part, self.view = self.view[:nbytes], self.view[nbytes:]
+            self.offset += len(part)
+            nbytes -= len(part)
+            yield part
+
+    def skip(self, nbytes: int):
+        for _ in self.take(nbytes):
+            pass
+
+    def close(self):
+        if self.buffer:
+            self.reader.release(self.buffer)
+            self.buffer = None
+        self.reader.close()
+
+class GGUFSplitter:
+    """Splits a GGUF into llama-gguf-split compatible shards in one sequential pass.
+
+    The first shard carries all of the metadata, and every shard has the
+    split.no/split.count/split.tensors.count keys. Unlike llama-gguf-split,
+    shard sizes include their headers, so no shard exceeds max_size.
+    """
+    def __init__(self, path: os.PathLike[str] | str, max_size: int = MAX_UPLOAD_SIZE - 1):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.reader = GGUFMetadataReader(path)
+        if KV_SPLIT_COUNT in self.reader.fields:
+            raise ValueError(f'{path} is already a shard')
+        self.tensors = self.reader.tensor_infos
+        if any(a.offset > b.offset for a,b in zip(self.tensors, self.tensors[1:])):
+            raise ValueError(f'{path} has tensor data out of tensor info order')
+        self.kvs = [b''.join(p.tobytes() for p in f.parts) for f in self.reader.fields.values()
+                    if not f.name.startswith('GGUF.')]
+        self.alignment = self.reader.alignment
+
+    def split_kvs(self, i: int, n: int) -> list[bytes]:
+        return [kv_bytes(KV_SPLIT_NO, gguf.GGUFValueType.UINT16, 'H', i),
+                kv_bytes(KV_SPLIT_COUNT, gguf.GGUFValueType.UINT16, 'H', n),
+                kv_bytes(KV_SPLIT_TENSORS_COUNT, gguf.GGUFValueType.INT32, 'i', len(self.tensors))]
+
+    def shard_alignment(self, i: int) -> int:
+        # Only the first shard has general.alignment; the rest get the default
+        return self.alignment if i == 0 else gguf.GGUF_DEFAULT_ALIGNMENT
+
+    def header(self, i: int, n: int, tensors: list[TensorInfo]) -> bytes:
+        kvs = (self.kvs if i == 0 else []) + self.split_kvs(i, n)
+        alignment = self.shard_alignment(i)
+        infos, offset = [], 0
+        for t in tensors:
+            infos.append(tensor_info_bytes(t, offset))
+            offset += t.n_bytes + pad(t.n_bytes, alignment)
+        header = b''.join((b'GGUF', struct.pack('<IQQ', gguf.GGUF_VERSION, len(tensors), len(kvs)), *kvs, *infos))
+        return header + bytes(pad(len(header), alignment))
+
+    def plan(self) -> list[list[TensorInfo]]:
+        """Tensors of each shard, starting a new one whenever the next tensor would overflow it"""
+        shards = [[]]
+        fixed = len(self.header(0, 0, []))
+        size = 0
+        for t in self.tensors:
+            alignment = self.shard_alignment(len(shards) - 1)
+            nbytes = t.n_bytes + pad(t.n_bytes, alignment) + len(tensor_info_bytes(t, 0))
+            if shards[-1] and fixed + alignment + size + nbytes > self.max_size:
+                shards.append([])
+                fixed = len(self.header(len(shards) - 1, 0, []))
+                size = 0
+            shards[-1].append(t)
+            size += nbytes
+        return shards
+
+    def write(self, prefix: os.PathLike[str] | str, *, hash=True, progress: Callable[[int], None] | None = None,
+              stream: str | None = None, **kwargs) -> list[ShardResult]:
+        """Writes the shards, returning their paths, sizes and (if hash) sha256s.
+
+        With hashing, tensor data passes through userspace once: it is read
+        sequentially, hashed and written in the same pass. Without it, it is
+        copied with copy_file_range and never leaves the kernel.
+        """
+        shards = self.plan()
+        n = len(shards)
+        stream = stream_io_mode() if stream is None else stream
+        if stream == 'direct':
+            stream = 'fadvise'  # tensor data isn't page aligned in the source
+        data_offset = self.reader.data_offset
+        results = []
+        with open(self.path, 'rb', buffering=0) as src, ThreadPoolExecutor(1) as executor:
+            src.seek(data_offset)
+            tensors = hash and TensorStream(PipelinedReader(src, stream=stream, **kwargs), 0)
+            # Progress is of the source: its header, then tensor data and the padding between
+            if progress:
+                progress(data_offset)
+            end = 0
+            try:
+                for i, shard in enumerate(shards):
+                    path = shard_path(prefix, i, n)
+                    tmp = path.with_name(path.name + '.tmp')
+                    alignment = self.shard_alignment(i)
+                    h = hash and hashlib.sha256(usedforsecurity=False)
+                    try:
+                        with open(tmp, 'wb', buffering=0) as dst:
+                            wbehind = WriteBehind(dst.fileno()) if stream else None
+                            def write(data):
+                                # Hash on another thread while this one writes
+                                pending = h and executor.submit(h.update, data)
+                                nbytes = write_all(dst, data)
+                                if pending:
+                                    pending.result()
+                                if wbehind:
+                                    wbehind.wrote(nbytes)
+                                return nbytes
+                            size = write(self.header(i, n, shard))
+                            for t in shard:
+                                if progress:
+                                    progress(t.offset - end)
+                                if tensors:
+                                    tensors.skip(t.offset - tensors.offset)
+                                    for part in tensors.take(t.n_bytes):
+                                        size += write(part)
+                                        if progress:
+                                            progress(len(part))
+                                else:
+                                    copied = 0
+                                    while copied < t.n_bytes:
+                                        if not (nbytes := os.copy_file_range(src.fileno(), dst.fileno(),
+                                                                             t.n_bytes - copied,
+                                                                             data_offset + t.offset + copied)):
+                                            raise EOFError(f'GGUF data ends early in {t.name}')
+                                        copied += nbytes
+                                    size += copied
+                                    if wbehind:
+                                        wbehind.wrote(copied)
+                                    if progress:
+                                        progress(copied)
+                                end = t.offset + t.n_bytes
+                                size += write(bytes(pad(t.n_bytes, alignment)))
+                            if wbehind:
+                                wbehind.close()
+                        tmp.rename(path)
+                    except BaseException:
+                        tmp.unlink(missing_ok=True)
+                        raise
+                    digest = h and h.hexdigest()
+                    if digest:
+                        hash_cache.put(path, 'sha256', digest)
+                    results.append(ShardResult(path, size, digest))
+            finally:
+                if tensors:
+                    tensors.close()
+        if progress:
+            progress(self.path.size - data_offset - end)
+        return results
+
+def split_gguf(path: os.PathLike[str] | str, prefix: os.PathLike[str] | str | None = None, *,
+               max_size: int = MAX_UPLOAD_SIZE - 1, **kwargs) -> list[ShardResult]:
+    """Splits path into <prefix>-NNNNN-of-NNNNN.gguf, by default <path without suffix>-split-..."""
+    path = Path(path)
+    prefix = prefix or path.with_suffix('').with_name(path.with_suffix('').name + '-split')
+    return GGUFSplitter(path, max_size).write(prefix, **kwargs)
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
@@ -0,0 +1,171 @@
+import os
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+from .defs import *
+from .misc import cache_dir
+from .hashing import *
+from .chunks import *
+
+__exclude__ = set(locals())
+
+# Kinds of digest kept per file: what HF LFS wants for large files and the
+# git blob id that identifies small (non-LFS) ones.
+hash_kinds = {
+    'sha256': ('sha256', lambda size: b''),
+    'blob': ('sha1', git_blob_header),
+}
+
+def stat_key(st: os.stat_result) -> tuple[int, int, int, int]:
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+def hash_kind(size: int) -> str:
+    return 'sha256' if size > MAX_BLOB_SIZE else 'blob'
+
+class HashCache:
+    """Digests of local files keyed by (device, inode, size, mtime_ns).
+
+    Entries live in a user xattr on the file itself, so they follow renames
+    and hard links; where xattrs can't be written (other owner, tmpfs, NFS)
+    they go to a SQLite index in the qlib cache directory instead.
+    """
+    xattr_name = 'user.qlib.hashes'
+
+    def __init__(self, db_path: Path | None = None):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self._db = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.db_path = self.db_path or cache_dir() / 'hashes.db'
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS hashes (dev INTEGER, ino INTEGER, size INTEGER, '
+                             'mtime_ns INTEGER, kind TEXT, digest TEXT, PRIMARY KEY (dev, ino, kind))')
+        return self._db
+
+    def read_xattr(self, path: Path) -> dict:
+        try:
+            return json.loads(os.getxattr(path, self.xattr_name))
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, path: os.PathLike[str] | str, kind: str = 'sha256', st: os.stat_result | None = None) -> str | None:
+        key = stat_key(st or os.stat(path))
+        entry = self.read_xattr(path)
+        if tuple(entry.get('key', ())) == key and (digest := entry.get(kind)):
+            return digest
+        with self.lock:
+            row = self.db.execute('SELECT digest FROM hashes WHERE dev=? AND ino=? AND size=? AND mtime_ns=? '
+                                  'AND kind=?', (*key, kind)).fetchone()
+        return row and row[0]
+
+    def put(self, path: os.PathLike[str] | str, kind: str, digest: str, st: os.stat_result | None = None):
+        key = stat_key(st or os.stat(path))
+        if not key == stat_key(os.stat(path)):
+            return  # Changed while it was being hashed
+        entry = self.read_xattr(path)
+        if not tuple(entry.get('key', ())) == key:
+            entry = {'key': key}
+        entry[kind] = digest
+        try:
+            os.setxattr(path, self.xattr_name, json.dumps(entry).encode())
+            return
+        except OSError:
+            pass
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)', (*key, kind, digest))
+
+    def adopt_sidecar(self, path: Path, st: os.stat_result) -> str | None:
+        # .sha256 files written before the cache existed are still trusted
+        # the old way, once, and then remembered by inode
+        sidecar = sidecar_path(path)
+        try:
+            if sidecar.stat().st_mtime > st.st_mtime and (digest := sidecar.read_text().strip()):
+                self.put(path, 'sha256', digest, st)
+                return digest
+        except OSError:
+            pass
+        return None
+
+    def adopt_manifest(self, path: Path, st: os.stat_result) -> str | None:
+        if (m := valid_manifest(path, st)) and m.complete:
+            self.put(path, 'sha256', m.sha256, st)
+            return m.sha256
+        return None
+
+    def lookup(self, path: Path, kind: str = 'sha256', st: os.stat_result | None = None) -> str | None:
+        st = st or os.stat(path)
+        if digest := self.get(path, kind, st):
+            return digest
+        if kind == 'sha256':
+            return self.adopt_manifest(Path(path), st) or self.adopt_sidecar(Path(path), st)
+        return None
+
+    @staticmethod
+    def hasher(kind: str, size: int, manifests: bool = False) -> Callable:
+        """How to hash a file; with manifests, big files get a resumable .chunks manifest beside them"""
+        if manifests and kind == 'sha256' and size > default_chunk_size:
+            return hash_file_chunked
+        algorithm, header = hash_kinds[kind]
+        return lambda p, **kwargs: hash_file(p, algorithm, header=header(size), **kwargs)
+
+    def file_hash(self, path: os.PathLike[str] | str, kind: str = 'sha256', *,
+                  progress: Callable[[int], None] | None = None, manifests: bool = False, **kwargs) -> str:
+        st = os.stat(path)
+        if not (digest := self.lookup(path, kind, st)):
+            digest = self.hasher(kind, st.st_size, manifests)(path, progress=progress, **kwargs).hexdigest()
+            self.put(path, kind, digest, st)
+        return digest
+
+    def file_hashes(self, paths: Iterable[os.PathLike[str] | str], kind: str = 'sha256', *,
+                    progress: Callable[[int], None] | None = None, manifests: bool = False,
+                    **kwargs) -> Iterator[tuple[Path, str]]:
+        """Yields (path, hexdigest), hashing the files not in the cache concurrently."""
+        missing = {}
+        for p in map(Path, paths):
+            st = p.stat()
+            if digest := self.lookup(p, kind, st):
+                yield p, digest
+            else:
+                missing[p] = st
+        hasher = lambda p, **kwargs: self.hasher(kind, missing[p].st_size, manifests)(p, **kwargs)
+        for p,h in hash_files(missing, progress=progress, hasher=hasher, **kwargs):
+            self.put(p, kind, digest := h.hexdigest(), missing[p])
+            yield p, digest
+
+    def missing(self, paths: Iterable[os.PathLike[str] | str], kind: str = 'sha256') -> list[Path]:
+        return [p for p in map(Path, paths) if not self.lookup(p, kind)]
+
+hash_cache = HashCache()
+
+def sidecar_path(path: os.PathLike[str] | str) -> Path:
+    return Path(str(path) + '.sha256')
+
+def write_sidecar(path: os.PathLike[str] | str, digest: str) -> bool:
+    # Sidecars are only for people and other tools now; rewrite them only
+    # when they disagree with the cache. One that agrees but is older than
+    # its file is touched, so make sees it as up to date.
+    sidecar = sidecar_path(path)
+    try:
+        if sidecar.read_text().strip() == digest:
+            if sidecar.stat().st_mtime_ns < os.stat(path).st_mtime_ns:
+                os.utime(sidecar)
+            return False
+    except OSError:
+        pass
+    sidecar.write_text(digest + '\n')
+    return True
+
+def file_hash(path: os.PathLike[str] | str, kind: str = 'sha256', **kwargs) -> str:
+    return hash_cache.file_hash(path, kind, **kwargs)
+
+def file_hashes(paths: Iterable[os.PathLike[str] | str], kind: str = 'sha256', **kwargs) -> Iterator[tuple[Path, str]]:
+    return hash_cache.file_hashes(paths, kind, **kwargs)
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
@@ -0,0 +1,228 @@
+import os
+import io
+import hashlib
+import threading
+import queue
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .defs import *
+from .iobuffer import *
+from .pagecache import *
+
+__exclude__ = set(locals())
+
+class BufferPool:
+    def __init__(self, count: int, capacity: int, aligned=False):
+        self.free = queue.Queue()
+        for _ in range(count):
+            self.free.put(IOBuffer(capacity, aligned))
+
+    def get(self) -> IOBuffer:
+        return self.free.get()
+
+    def put(self, buffer: IOBuffer):
+        self.free.put(buffer)
+
+class PipelinedReader:
+    """Reads a file on a background thread into a pool of reusable buffers.
+
+    Iterating yields filled buffers in file order; each must be handed back
+    with release() once its contents have been consumed. With stream set to
+    'fadvise', pages the read brings into the page cache are dropped behind
+    it; 'direct' means f was opened with O_DIRECT and needs aligned buffers.
+    Used as a context manager, it stops the reader thread on the way out
+    however iteration ended.
+    """
+    def __init__(self, f: io.RawIOBase | io.BufferedIOBase, buffer_size: int = 4*MiB, buffers: int = 4,
+                 stream: str = ''):
+        self.file = f
+        self.pool = BufferPool(buffers, buffer_size, stream == 'direct')
+        self.behind = ReadBehind(f.fileno(), f.tell()) if stream == 'fadvise' else None
+        self.filled = queue.Queue()
+        self.error = None
+        self.stopped = False
+        self.finished = False
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        try:
+            while True:
+                buffer = self.pool.get()
+                if self.stopped or buffer is None:
+                    break
+                cached = self.behind and self.behind.before(buffer.capacity)
+                if not buffer.readfrom(self.file):
+                    break
+                if self.behind:
+                    self.behind.after(buffer.length, cached)
+                self.filled.put(buffer)
+        except BaseException as e:
+            self.error = e
+        if self.behind:
+            self.behind.close()
+        self.filled.put(None)
+
+    def release(self, buffer: IOBuffer):
+        self.pool.put(buffer)
+
+    def close(self):
+        """Stops reading early; safe to call at any point, and more than once"""
+        if not self.finished:
+            self.stopped = True
+            # Wakes the thread even if the caller still holds every buffer
+            self.pool.put(None)
+            while buffer := self.filled.get():
+                self.pool.put(buffer)
+            self.finished = True
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self) -> Iterator[IOBuffer]:
+        while buffer := self.filled.get():
+            yield buffer
+        self.finished = True
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+class SHA256State:
+    """SHA-256 through libcrypto, whose context can be saved and restored.
+
+    hashlib objects can't be serialized, so this is what lets an interrupted
+    hash of a large file carry on from where it stopped.
+    """
+    name = 'sha256'
+    ctx_size = 112  # sizeof(SHA256_CTX)
+    _lib = None
+
+    @classmethod
+    def lib(cls):
+        if cls._lib is None:
+            import ctypes, ctypes.util
+            try:
+                lib = ctypes.CDLL(ctypes.util.find_library('crypto') or 'libcrypto.so.3')
+                lib.SHA256_Init, lib.SHA256_Update, lib.SHA256_Final
+                lib.SHA256_Update.argtypes = (ctypes.c_char_p, ctypes.c_void_p, ctypes.c_size_t)
+            except (OSError, AttributeError):
+                lib = False
+            cls._lib = lib
+        return cls._lib
+
+    @classmethod
+    def available(cls) -> bool:
+        return bool(cls.lib())
+
+    def __init__(self, state: bytes | None = None):
+        import ctypes
+        self._ctypes = ctypes
+        self.ctx = ctypes.create_string_buffer(self.ctx_size)
+        if state:
+            if not len(state) == self.ctx_size:
+                raise ValueError(f'SHA-256 state must be {self.ctx_size} bytes')
+            self.ctx.raw = state
+        else:
+            self.lib().SHA256_Init(self.ctx)
+
+    def update(self, data):
+        ctypes = self._ctypes
+        view = memoryview(data).cast('B')
+        if view.readonly:
+            view = memoryview(bytearray(view))
+        # ctypes drops the GIL for the call, just as hashlib does
+        buf = (ctypes.c_char * len(view)).from_buffer(view)
+        self.lib().SHA256_Update(self.ctx, buf, len(view))
+
+    @property
+    def state(self) -> bytes:
+        return self.ctx.raw
+
+    def digest(self) -> bytes:
+        ctx = self._ctypes.create_string_buffer(self.ctx.raw, self.ctx_size)
+        md = self._ctypes.create_string_buffer(32)
+        self.lib().SHA256_Final(md, ctx)
+        return md.raw
+
+    def hexdigest(self) -> str:
+        return self.digest().hex()
+
+def hash_stream(f, algorithm: str = 'sha256', *, header: bytes = b'',
+                progress: Callable[[int], None] | None = None, **kwargs):
+    h = hashlib.new(algorithm, usedforsecurity=False)
+    h.update(header)
+    with PipelinedReader(f, **kwargs) as reader:
+        for buffer in reader:
+            # hashlib drops the GIL for large updates, so this overlaps the next read
+            h.update(buffer.bytes)
+            nbytes = buffer.length
+            reader.release(buffer)
+            if progress:
+                progress(nbytes)
+    return h
+
+def open_stream(path: os.PathLike[str] | str, stream: str | None = None) -> tuple[io.RawIOBase, str]:
+    """Opens a file for a single sequential pass, returning it and the stream mode it got."""
+    stream = stream_io_mode() if stream is None else stream
+    if stream == 'direct':
+        if f := open_direct(path):
+            return f, stream
+        stream = 'fadvise'
+    return open(path, 'rb', buffering=0), stream
+
+def hash_file(path: os.PathLike[str] | str, algorithm: str = 'sha256', *, header: bytes = b'',
+              progress: Callable[[int], None] | None = None, stream: str | None = None, **kwargs):
+    f, stream = open_stream(path, stream)
+    with f:
+        return hash_stream(f, algorithm, header=header, progress=progress, stream=stream, **kwargs)
+
+def git_blob_header(size: int) -> bytes:
+    return b'blob %d\0' % (size,)
+
+def device_is_rotational(path: os.PathLike[str] | str) -> bool:
+    dev = os.stat(path).st_dev
+    sysdev = Path(f'/sys/dev/block/{os.major(dev)}:{os.minor(dev)}')
+    for d in (sysdev, sysdev / '..'):
+        try:
+            return (d / 'queue' / 'rotational').read_text().strip() == '1'
+        except OSError:
+            pass
+    # Unknown (network, overlay, tmpfs...): treat like a single spindle
+    return True
+
+def concurrent_files(paths: list[Path]) -> int:
+    # A disk head seeking between files is slower than hashing them in turn;
+    # flash devices keep getting faster with more reads in flight.
+    if not paths or any(device_is_rotational(p) for p in paths):
+        return 1
+    return max(1, min(len(paths), 4, os.cpu_count() or 1))
+
+def hash_files(paths: Iterable[os.PathLike[str] | str], algorithm: str = 'sha256', *,
+               max_files: int | None = None, progress: Callable[[int], None] | None = None,
+               hasher: Callable | None = None, **kwargs) -> Iterator[tuple[Path, object]]:
+    """Hashes several files at once, yielding (path, hash) as each finishes."""
+    paths = [Path(p) for p in paths]
+    max_files = max_files or concurrent_files(paths)
+    hasher = hasher or (lambda p, **kw: hash_file(p, algorithm, **kw))
+    lock = threading.Lock()
+    def locked_progress(nbytes):
+        with lock:
+            progress(nbytes)
+    with ThreadPoolExecutor(max_files) as executor:
+        futures = {executor.submit(hasher, p, progress=progress and locked_progress, **kwargs): p
+                   for p in paths}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # If the caller stopped early, files not started yet aren't hashed
+            for future in futures:
+                future.cancel()
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
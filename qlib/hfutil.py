@@ -5,21 +5,24 @@ import re
 from pathlib import Path as LocalPath
 from functools import cached_property
 from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+import time
+import random
 import datetime
 import json
 import clear_screen
 import huggingface_hub
-import hashlib
 from typing import List, Optional, Tuple
 from .defs import *
 from .misc import *
 from .iobuffer import *
+from .hashcache import *
+from .checkpoint import *
+from .hubcache import hub_cache, content_ttl, RepoSnapshot
+from .lfsupload import LFSUploader, is_transient
 
 __exclude__ = set(locals())
 
-MAX_BLOB_SIZE = 1*MB
-MAX_UPLOAD_SIZE = 50*GB
-
 organization = os.getenv('HF_DEFAULT_ORGANIZATION')
 hf_url_prefix = 'https://huggingface.co/'
 
@@ -46,55 +49,150 @@ paramsize_rx = re.compile('((\d+x)?(\d{1,3}(\.\d)?))[Bb]$')
 
 @classmethod
 def UploadInfo_from_path(cls, path: str) -> huggingface_hub.lfs.UploadInfo:
-    hexdigest = digest = None
-    if os.path.exists(sha_path := path + '.sha256'):
-        if os.path.getmtime(sha_path) > os.path.getmtime(path):
-            with open(sha_path, 'rt') as file:
-                hexdigest = file.read().strip()
-                digest = bytes.fromhex(hexdigest)
-                print(f'Read hash from {sha_path}')
-        else:
-            os.unlink(sha_path)
-
     size = os.path.getsize(path)
     if size >= MAX_UPLOAD_SIZE:
         raise ValueError(f'File {path} size {size} exceeds maximum of 50 GB')
     with io.open(path, 'rb') as file:
         sample = file.peek(512)[:512]
-        if not digest:
-            print(size, f'Hashing {os.path.basename(path)}')
-            pl = ProgressLine(size)
-            h = hashlib.sha256(usedforsecurity=False)
-            buffer = IOBuffer(MiB)
-            while nbytes := buffer.readfrom(file):
-                h.update(buffer.bytes)
-                pl.update_progress(nbytes)
-            pl.finish()
-            digest = h.digest()
 
-    if not hexdigest and size > MAX_BLOB_SIZE:
-        hexdigest = digest.hex()
-        with io.open(sha_path, 'wt') as file:
-            file.write(hexdigest + '\n')
-            print(f'Wrote hash to {sha_path}')
+    if hexdigest := hash_cache.lookup(path):
+        print(f'Cached hash for {os.path.basename(path)}')
+    else:
+        print(size, f'Hashing {os.path.basename(path)}')
+        pl = ProgressLine(size)
+        hexdigest = hash_cache.file_hash(path, progress=pl.update_progress)
+        pl.finish()
+
+    if size > MAX_BLOB_SIZE and write_sidecar(path, hexdigest):
+        print(f'Wrote hash to {path}.sha256')
 
-    return cls(size=size, sha256=digest, sample=sample)
+    return cls(size=size, sha256=bytes.fromhex(hexdigest), sample=sample)
 
 setattr(huggingface_hub.lfs.UploadInfo, 'from_path', UploadInfo_from_path)
 
+class UploadJournal:
+    """What has become of each file of a folder being uploaded to a repo, kept on disk.
+
+    An entry is reset when its file's size or mtime changes. Once a file's
+    LFS object is on the hub it is marked uploaded, and once it is in a
+    commit, that commit is recorded, so retries and reruns skip both steps;
+    Uploader checks committed files against the repo before skipping them.
+    """
+    # Uncommitted LFS objects don't stay on the hub forever
+    upload_ttl = 24*3600
+
+    def __init__(self, repo_id: str, folder_path: os.PathLike[str] | str):
+        self.path = cache_dir('uploads') / (repo_id.replace('/', '--') + '.json')
+        self.folder = str(LocalPath(folder_path).absolute())
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            data = {}
+        self.files = data.get('files', {}) if data.get('folder') == self.folder else {}
+
+    def entry(self, name: str, path: LocalPath) -> dict:
+        st = path.stat()
+        e = self.files.get(name)
+        if not (e and e['size'] == st.st_size and e['mtime_ns'] == st.st_mtime_ns):
+            e = self.files[name] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': None,
+                                    'mode': None, 'uploaded': None, 'commit': None}
+        return e
+
+    def is_uploaded(self, e: dict) -> bool:
+        return bool(e['uploaded'] and time.time() - e['uploaded'] < self.upload_ttl)
+
+    def save(self):
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'folder': self.folder, 'files': self.files}, indent=1))
+        tmp.replace(self.path)
+
 class Uploader(object):
-    def __init__(self, repo_id: str, folder_path: LocalPath, max_retries:int = 0):
+    # Files are committed in batches of at most this many, or this many bytes
+    max_batch_files = 16
+    max_batch_bytes = 64*GB
+
+    def __init__(self, repo_id: str, folder_path: LocalPath, max_retries:int = 0, *,
+                 workers:int = 4, connections:int = 8, bandwidth:float|None = None):
         self.repo_id = repo_id
         self.folder_path = folder_path
         self.max_retries = max_retries
         self.total_retries = 0
         self.repo_exists = hfapi.repo_exists(repo_id)
         self.start_time = None
+        self.engine_options = dict(workers=workers, connections=connections, bandwidth=bandwidth)
 
     @property
     def elapsed(self):
         return datetime.datetime.now() - self.start_time if self.start_time else datetime.timedelta(0)
-        
+
+    def is_committed(self, e: dict, name: str, path: LocalPath, snap: RepoSnapshot | None) -> bool:
+        """Whether the hub has the file as the journal says it was committed"""
+        if not (e['commit'] and snap and (f := snap.files.get(name)) and f.size == e['size']):
+            return False
+        # LFS files are listed by sha256, small ones by git blob id
+        return f.hash == (e['sha256'] if len(f.hash) == 64 else hash_cache.file_hash(path, 'blob'))
+
+    def pending(self, journal: UploadJournal, allow_patterns:List[str], ignore_patterns:List[str]=None) -> list[tuple[str, LocalPath]]:
+        """Files of the folder that the patterns select and that the hub doesn't have yet.
+
+        Files the journal has as committed are checked against the repo as it
+        is now, in case it was deleted, recreated or rolled back since. The
+        rest come smallest first, except README.md, which describes the others
+        and so goes last.
+        """
+        folder = LocalPath(self.folder_path)
+        paths = {p.relative_to(folder).as_posix(): p for p in folder.rglob('*') if p.is_file()}
+        names = huggingface_hub.utils.filter_repo_objects(
+            paths, allow_patterns=allow_patterns,
+            ignore_patterns=list(ignore_patterns or []) + huggingface_hub.utils.DEFAULT_IGNORE_PATTERNS)
+        entries = {name: journal.entry(name, paths[name]) for name in names}
+        snap = hub_cache.snapshot(self.repo_id) if any(e['commit'] for e in entries.values()) else None
+        files = []
+        for name, e in entries.items():
+            if self.is_committed(e, name, paths[name], snap):
+                continue
+            if e['commit']:
+                print(f'{name} is no longer in {self.repo_id} as committed, uploading it again')
+                e['uploaded'] = e['commit'] = None
+            files.append((name, paths[name]))
+        return sorted(files, key=lambda f: (f[0] == 'README.md', f[1].size))
+
+    def batches(self, files: list[tuple[str, LocalPath]]) -> list[list[tuple[str, LocalPath]]]:
+        batches, size = [[]], 0
+        for f in files:
+            if batches[-1] and (len(batches[-1]) >= self.max_batch_files or size + f[1].size > self.max_batch_bytes):
+                batches.append([])
+                size = 0
+            batches[-1].append(f)
+            size += f[1].size
+        return [b for b in batches if b]
+
+    def commit_batch(self, journal: UploadJournal, batch: list[tuple[str, LocalPath]], message: str):
+        ops = {}
+        for name, path in batch:
+            e = journal.entry(name, path)
+            op = ops[name] = huggingface_hub.CommitOperationAdd(name, str(path))
+            e['sha256'] = op.upload_info.sha256.hex()
+
+        def uploaded(op, mode):
+            # Recorded file by file, so a failure loses only the files in flight
+            e = journal.files[op.path_in_repo]
+            e['mode'], e['uploaded'] = mode, time.time()
+            journal.save()
+
+        # What the journal has as uploaded is already on the hub: create_commit's own
+        # preupload finds those objects there and only commits them
+        todo = [op for name, op in ops.items() if not journal.is_uploaded(journal.files[name])]
+        pl = ProgressLine(sum(op.upload_info.size for op in todo), 'Uploading')
+        LFSUploader(self.repo_id, progress=pl.update_progress, total=pl.set_total,
+                    **self.engine_options).upload(todo, uploaded)
+        if todo:
+            pl.finish()
+        info = hfapi.create_commit(self.repo_id, operations=list(ops.values()), commit_message=message)
+        for name, path in batch:
+            journal.files[name]['commit'] = info.oid
+        journal.save()
+
     def upload(self, message: str, allow_patterns:List[str], ignore_patterns:List[str]=None, *, skip=False):
         if skip:
             return True
@@ -105,6 +203,9 @@ class Uploader(object):
             hfapi.create_repo(self.repo_id, private = True, repo_type = 'model')
             self.repo_exists = True
         self.start_time = datetime.datetime.now()
+        journal = UploadJournal(self.repo_id, self.folder_path)
+        # The journal is checked against the repo as it is now, not as cached
+        hub_cache.forget(self.repo_id)
 
         while not (finished or (self.max_retries and retries > self.max_retries)):
             clear_screen.clear()
@@ -117,15 +218,25 @@ class Uploader(object):
                 sys.stdout.write(')')
             sys.stdout.write('\n')
             try:
-                hfapi.upload_folder(repo_id=self.repo_id, folder_path=self.folder_path, commit_message=message,
-                                    repo_type='model', allow_patterns=allow_patterns, ignore_patterns=ignore_patterns)
+                # Only what the journal doesn't have as committed, so a retry resumes where it failed
+                batches = self.batches(self.pending(journal, allow_patterns, ignore_patterns))
+                for n, batch in enumerate(batches, 1):
+                    if len(batches) > 1:
+                        print(f'Batch {n} of {len(batches)}: {", ".join(name for name, _ in batch)}')
+                    self.commit_batch(journal, batch, message if len(batches) == 1 else f'{message} ({n}/{len(batches)})')
+                    hub_cache.forget(self.repo_id)
                 finished = True
             except KeyboardInterrupt:
                 print('\n*** Keyboard interrupt ***')
                 break
-            except RuntimeError:
+            except Exception as e:
+                # Only what may go away by itself is retried: a 401 or a missing file won't
+                if not is_transient(e):
+                    raise
                 retries += 1
-                print('Upload failed')
+                delay = min(60, 2**retries) * random.uniform(0.5, 1.0)
+                print(f'Upload failed: {e}, retrying in {delay:.0f}s')
+                time.sleep(delay)
 
         self.total_retries += retries
         return finished
@@ -133,37 +244,94 @@ class Uploader(object):
 def list_models(private=False):
     return [m.id for m in hfapi.list_models(author=organization) if private or not m.private]
 
+# Files a source model needs before it's worth quantizing
+required_source_files = tuple(jf + '.json' for jf in
+                              ('config', 'generation_config', 'special_tokens_map', 'tokenizer', 'tokenizer_config'))
+
+def snapshot_is_safetensors_model(snap: RepoSnapshot) -> bool:
+    return snap.has_files(*required_source_files) and snap.safetensors_size >= 12_000_000_000
+
 def is_safetensors_model(repo_id:str) -> bool:
     try:
-        for jf in ('config', 'generation_config', 'special_tokens_map', 'tokenizer', 'tokenizer_config'):
-            if not hfapi.file_exists(repo_id, jf + '.json'):
-                return False
-        msize = 0
-        for rs in hfapi.model_info(repo_id, files_metadata=True).siblings:
-            if rs.rfilename.endswith('.safetensors'):
-                if (msize := msize + rs.size) >= 12_000_000_000:
-                    return True
+        if snap := hub_cache.snapshot(repo_id):
+            return snapshot_is_safetensors_model(snap)
     except KeyboardInterrupt as kbe:
         raise kbe
     except:
         pass
     return False
 
-def recent_safetensors_models(*,days=0, hours=0, mins=0, secs=0, limit=None):
+def recent_safetensors_models(*,days=0, hours=0, mins=0, secs=0, limit=None, workers=8, rate=10.0):
+    """Ids of newly created safetensors models, newest first as far as checks finish in order.
+
+    Listings come with each repo's files and commit, so repos missing the
+    required files are dropped without a request, and verdicts are kept by
+    commit so a repo is only looked at again once it changes. The rest are
+    checked by a pool of workers making at most rate hub requests a second.
+    """
     secs = ((((days * 24) + hours) * 60) + mins) * 60 + secs
     cutoff = secs and (datetime.datetime.now(tz=datetime.timezone.utc) - 
                 datetime.timedelta(seconds=int(secs), microseconds=int((secs % 1) * 1_000_000))) or None
     count = 0
     if not (cutoff or limit):
         raise ValueError('unbounded search not allowed')
-    for mi in hfapi.list_models(sort='createdAt'):
-        if cutoff and mi.created_at < cutoff:
-            break
-        if is_safetensors_model(mi.id):
-            count += 1
-            yield mi.id
-            if limit and not count < limit:
-                break
+
+    def candidates():
+        for mi in hfapi.list_models(sort='createdAt', full=True):
+            if cutoff and mi.created_at < cutoff:
+                return
+            if mi.siblings is not None and not {rs.rfilename for rs in mi.siblings}.issuperset(required_source_files):
+                continue
+            yield mi
+
+    def check(mi) -> bool:
+        key = f'safetensors:{mi.id}@{mi.sha}'
+        if mi.sha and (found := hub_cache.get(key, content_ttl))[0]:
+            return found[1]
+        limiter.acquire()
+        try:
+            if (snap := hub_cache.snapshot(mi.id)) and mi.sha and not snap.sha == mi.sha:
+                # Cached from before the listed commit
+                hub_cache.forget(mi.id)
+                snap = hub_cache.snapshot(mi.id)
+        except Exception:
+            return False        # not cached, so it's checked again next time
+        verdict = bool(snap) and snapshot_is_safetensors_model(snap)
+        if mi.sha and snap and snap.sha == mi.sha:
+            hub_cache.put(key, mi.id, verdict)
+        return verdict
+
+    limiter = RateLimiter(rate, burst=workers)
+    results = bounded_map(check, candidates(), workers)
+    try:
+        for mi, verdict in results:
+            if verdict:
+                count += 1
+                yield mi.id
+                if limit and not count < limit:
+                    break
+    finally:
+        results.close()
+
+# First read of a remote safetensors file: the whole header, for most models
+safetensors_probe = 64*KiB
+
+def remote_safetensors_tensors(path: str, sha256: str | None = None) -> list[TensorMeta]:
+    """Tensors of a safetensors file on the hub, from range reads of just its header.
+
+    Headers are cached by the file's LFS sha256, so each is fetched once.
+    """
+    cached = sha256 and cache_dir('safetensors') / f'{sha256}.json'
+    if cached and cached.exists():
+        return [TensorMeta(name, dtype, tuple(shape)) for name, dtype, shape in json.loads(cached.read_text())]
+    with hfs.open(path, 'rb', block_size=safetensors_probe, cache_type='none') as f:
+        header = f.read(safetensors_probe)
+        if (size := safetensors_header_size(header)) > len(header):
+            header += f.read(size - len(header))
+    tensors = parse_safetensors_header(header[:size])
+    if cached:
+        cached.write_text(json.dumps([(t.name, t.dtype, t.shape) for t in tensors]))
+    return tensors
 
 @dataclass
 class ModelFile:
@@ -192,8 +360,8 @@ class Model(ProxyObject):
         return self.repo_id + '/' + name
 
     def read_json(self, filename:str) -> dict:
-        if hfs.isfile(path := self.path(filename)):
-            return json.loads(hfs.read_text(path))
+        if (text := hub_cache.read_text(self.repo_id, filename)) is not None:
+            return json.loads(text)
         else:
             raise FileNotFoundError(f"'{filename}' not found in model {self.repo_id}")
 
@@ -215,21 +383,25 @@ class Model(ProxyObject):
 
     @cached_property
     def model_info(self):
-        return hfapi.model_info(self.repo_id, files_metadata=False)
+        return hub_cache.model_info(self.repo_id)
     
-    @cached_property
+    @property
     def model_info_full(self):
-        self.model_info = mi = hfapi.model_info(self.repo_id, files_metadata=True)
-        return mi
+        # model_info is fetched with file metadata, so there's no fuller one to get
+        return self.model_info
     
+    @cached_property
+    def snapshot(self) -> RepoSnapshot:
+        return hub_cache.snapshot(self.repo_id)
+
     @cached_property
     def files(self):
-        return [ModelFile.from_sibling(self, rs) for rs in self.model_info_full.siblings]
+        return [ModelFile(self, *f) for f in self.snapshot.files.values()]
 
-    def iterfiles(self, full=False, matcher=None, cls=ModelFile):
-        for rs in hfapi.model_info(self.repo_id, files_metadata=full).siblings:
+    def iterfiles(self, matcher=None, cls=ModelFile):
+        for rs in hub_cache.model_info(self.repo_id).siblings:
             if not matcher or matcher(rs.rfilename):
-                yield cls(self, rs)
+                yield cls.from_sibling(self, rs)
 
     @cached_property
     def card_data(self): return self.model_info.card_data
@@ -248,14 +420,16 @@ class Model(ProxyObject):
 
     @settable_cached_property
     def readme(self):
-        if hfs.exists(path := self.path('README.md')):
-            return hfs.read_text(path, encoding='utf-8')
-        else:
-            return None
+        return hub_cache.read_text(self.repo_id, 'README.md')
     
     @readme.setter
     def readme(self, value:str):
         hfs.write_text(self.path('README.md'), value, encoding='utf-8')
+        hub_cache.forget(self.repo_id)
+
+    def refresh(self):
+        hub_cache.forget(self.repo_id)
+        super().refresh()
 
     def download(self):
         return LocalPath(hfapi.snapshot_download(repo_id=self.repo_id))
@@ -282,7 +456,7 @@ class Model(ProxyObject):
                 repo_id = organization + '/' + repo_id
             if (repo_id := Model.aliases.get(repo_id,repo_id)) in Model.cache:
                 return Model.cache[repo_id]
-            if not hfapi.repo_exists(repo_id):
+            if not hub_cache.repo_exists(repo_id):
                 raise RepositoryNotFoundError(repo_id)
             if instcls := cls.repo_model_type(repo_id):
                 if obj := object.__new__(instcls):
@@ -302,14 +476,10 @@ class Model(ProxyObject):
 
     @staticmethod
     def repo_model_type_default(repo_id:str) -> type | None:
-        if repo_id.endswith('-GGUF') or '-GGUF-' in repo_id:
-            return QuantModel
-        if hfapi.file_exists(repo_id, 'config.json'):
-            if any(hfapi.file_exists(repo_id, fn) for fn in ('model.safetensors', 'model.safetensors.index.json', 'pytorch_model.bin.index.json')):
-                return SourceModel
-        if any(f.casefold().endswith('.gguf') for f in hfapi.list_repo_files(repo_id)):
-            return QuantModel
-        return None
+        match (snap := hub_cache.snapshot(repo_id)) and snap.kind:
+            case 'quant': return QuantModel
+            case 'source': return SourceModel
+            case _: return None
 
     def parse_param_size(self):
         if nexperts := self.num_experts:
@@ -379,8 +549,26 @@ class SourceModel(Model):
         except:
             return '{# error #}'
 
+    @cached_property
+    def remote_tensors(self) -> list[TensorMeta] | None:
+        # The same weight files checkpoint_files would pick locally
+        shards = [f for f in self.files if '/' not in f.name and f.name.startswith('model')
+                  and f.name.endswith('.safetensors')]
+        if not shards:
+            return None
+        with ThreadPoolExecutor(min(8, len(shards))) as executor:
+            headers = executor.map(lambda f: remote_safetensors_tensors(self.path(f.name), f.hash), shards)
+            return [t for tensors in headers for t in tensors]
+
+    @cached_property
+    def dtype(self):
+        return (tensors := self.remote_tensors) and main_dtype(tensors)
+
     @cached_property
     def calculated_params(self):
+        # Exact from the safetensors headers where there are any, else estimated from config.json
+        if tensors := self.remote_tensors:
+            return count_params(tensors)
         if config := self.llm_config:
             blocks = config['num_hidden_layers']
             embeds = config['hidden_size']
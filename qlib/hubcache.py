@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Callable, NamedTuple
+from huggingface_hub import ModelInfo, constants, hf_hub_url
+from huggingface_hub.utils import RepositoryNotFoundError, build_hf_headers, get_session, hf_raise_for_status
+from .defs import *
+from .misc import cache_dir
+
+__exclude__ = set(locals())
+
+# How long what a repo looks like now (its head commit, files, existence) is trusted
+default_ttl = float(os.getenv('QLIB_HUB_TTL', 3600))
+
+# That a repo doesn't exist is only trusted briefly, as another tool may be about to create it
+missing_ttl = 10.0
+
+# File contents are keyed by commit, so they never go stale; they're only dropped when old
+content_ttl = 30*24*3600
+
+# Old entries are purged when the cache is opened, at most this often
+purge_interval = 24*3600
+
+class RepoFile(NamedTuple):
+    name: str
+    size: int
+    hash: str                   # LFS sha256, or git blob id for small files
+
+class RepoSnapshot:
+    """Every file of a repo at one commit, with sizes, from a single model info request"""
+    # Any of these beside config.json makes a source model
+    source_weights = ('model.safetensors', 'model.safetensors.index.json', 'pytorch_model.bin.index.json')
+
+    def __init__(self, repo_id: str, data: dict):
+        self.repo_id = repo_id
+        self.sha = data.get('sha')
+        self.files = {s['rfilename']: RepoFile(s['rfilename'], s.get('size') or 0,
+                                               s['lfs']['sha256'] if s.get('lfs') else s.get('blobId'))
+                      for s in data.get('siblings', ())}
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self.files
+
+    def has_files(self, *filenames: str) -> bool:
+        return all(f in self.files for f in filenames)
+
+    @property
+    def safetensors_size(self) -> int:
+        return sum(f.size for f in self.files.values() if f.name.endswith('.safetensors'))
+
+    @property
+    def kind(self) -> str | None:
+        """'quant' or 'source', as Model classifies repos, or None"""
+        if self.repo_id.endswith('-GGUF') or '-GGUF-' in self.repo_id:
+            return 'quant'
+        if 'config.json' in self.files and any(f in self.files for f in self.source_weights):
+            return 'source'
+        if any(f.casefold().endswith('.gguf') for f in self.files):
+            return 'quant'
+        return None
+
+class HubCache:
+    """Hub metadata that scripts would otherwise fetch again on every run.
+
+    Model info (with file sizes and LFS hashes, so it also answers file
+    listings and existence checks) is kept for a TTL, but that a repo is
+    missing only for a few seconds. Small files such as config.json are
+    kept by repo and commit sha. Everything about a repo is dropped by
+    forget(), which Model.refresh and anything writing to the hub call.
+    Entries too old to be used are purged once a day.
+    """
+    def __init__(self, db_path: Path | None = None, ttl: float | None = None):
+        self.db_path = db_path
+        self.ttl = default_ttl if ttl is None else ttl
+        self.lock = threading.RLock()
+        self.snapshots = {}
+        self._db = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.db_path = self.db_path or cache_dir() / 'hub.db'
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, repo_id TEXT, '
+                             'value TEXT, stored REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entries_repo_id ON entries (repo_id)')
+            self.purge_if_due()
+        return self._db
+
+    def get(self, key: str, ttl: float) -> tuple[bool, Any]:
+        """(found, value) for a key stored less than ttl seconds ago"""
+        with self.lock:
+            row = self.db.execute('SELECT value, stored FROM entries WHERE key=?', (key,)).fetchone()
+        if row and time.time() - row[1] < ttl:
+            return True, json.loads(row[0])
+        return False, None
+
+    def put(self, key: str, repo_id: str, value: Any):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                            (key, repo_id, json.dumps(value), time.time()))
+
+    def cached(self, key: str, repo_id: str, ttl: float, fetch: Callable[[], Any],
+               none_ttl: float | None = None) -> Any:
+        """The value stored under key, fetching it if it's older than ttl, or none_ttl if it's None"""
+        found, value = self.get(key, ttl)
+        if found and value is None and none_ttl is not None:
+            found, value = self.get(key, none_ttl)
+        if not found:
+            self.put(key, repo_id, value := fetch())
+        return value
+
+    def forget(self, repo_id: str):
+        self.snapshots.pop(repo_id, None)
+        with self.lock:
+            self.db.execute('DELETE FROM entries WHERE repo_id=?', (repo_id,))
+
+    def purge(self):
+        """Drops entries too old to be used again"""
+        with self.lock:
+            self.db.execute('DELETE FROM entries WHERE stored < ?', (time.time() - max(self.ttl, content_ttl),))
+
+    def purge_if_due(self):
+        # The last purge is recorded as an entry of its own, under no repo
+        found, _ = self.get('purged', purge_interval)
+        if not found:
+            self.purge()
+            self.put('purged', '', True)
+
+    @staticmethod
+    def fetch_model_info(repo_id: str) -> dict | None:
+        r = get_session().get(f'{constants.ENDPOINT}/api/models/{repo_id}',
+                              headers=build_hf_headers(), params={'blobs': True})
+        if r.status_code in (401, 404):
+            return None
+        hf_raise_for_status(r)
+        return r.json()
+
+    def model_info_json(self, repo_id: str) -> dict | None:
+        """The hub's model info for a repo, with file metadata; None if there's no such repo"""
+        return self.cached(f'info:{repo_id}', repo_id, self.ttl, lambda: self.fetch_model_info(repo_id),
+                           none_ttl=min(self.ttl, missing_ttl))
+
+    def model_info(self, repo_id: str) -> ModelInfo:
+        if (data := self.model_info_json(repo_id)) is None:
+            raise RepositoryNotFoundError(f'{repo_id} not found')
+        return ModelInfo(**data)
+
+    def snapshot(self, repo_id: str) -> RepoSnapshot | None:
+        """The repo's files as of its cached model info; None if there's no such repo"""
+        if (snap := self.snapshots.get(repo_id)) is None:
+            if (data := self.model_info_json(repo_id)) is None:
+                return None
+            snap = self.snapshots[repo_id] = RepoSnapshot(repo_id, data)
+        return snap
+
+    def repo_exists(self, repo_id: str) -> bool:
+        return self.snapshot(repo_id) is not None
+
+    def sha(self, repo_id: str) -> str | None:
+        return (snap := self.snapshot(repo_id)) and snap.sha
+
+    def list_repo_files(self, repo_id: str) -> list[str]:
+        return list(snap.files) if (snap := self.snapshot(repo_id)) else []
+
+    def file_exists(self, repo_id: str, filename: str) -> bool:
+        return (snap := self.snapshot(repo_id)) is not None and filename in snap
+
+    def read_text(self, repo_id: str, filename: str) -> str | None:
+        """Contents of a (small) file at the repo's current commit; None if it has no such file"""
+        if not self.file_exists(repo_id, filename):
+            return None
+        sha = self.sha(repo_id)
+        def fetch():
+            url = hf_hub_url(repo_id, filename, revision=sha)
+            r = get_session().get(url, headers=build_hf_headers())
+            hf_raise_for_status(r)
+            return r.content.decode('utf-8')
+        return self.cached(f'file:{repo_id}@{sha}/{filename}', repo_id, content_ttl, fetch)
+
+hub_cache = HubCache()
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
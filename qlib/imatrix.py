@@ -0,0 +1,130 @@
+import os
+import struct
+from typing import Iterable, NamedTuple
+import numpy
+from .defs import *
+
+__exclude__ = set(locals())
+
+# The dataset name is the last record, an int32 length and up to 32767 bytes
+max_dataset_len = 32767
+
+class ImatrixEntry(NamedTuple):
+    name: str
+    ncall: int
+    values: numpy.ndarray       # float32, summed over ncall calls
+
+class ImatrixStats(NamedTuple):
+    name: str
+    ncall: int
+    nval: int
+    mean: float                 # of the per-call averages
+    max: float
+    zeros: int                  # columns that saw no activation at all (unused experts)
+
+def dataset_record(f) -> tuple[int, str]:
+    """Offset and contents of the dataset name record at the end of an imatrix, reading only the tail"""
+    size = f.seek(0, os.SEEK_END)
+    start = max(0, size - max_dataset_len - 4)
+    f.seek(start)
+    tail = f.read()
+    fnidx = tail.rindex(0) + 1
+    fnlen = len(tail) - fnidx
+    if fnlen < 1 or fnlen > max_dataset_len:
+        raise RuntimeError(f'Improbable dataset name length of {fnlen}')
+    lenidx = fnidx - 4
+    (lenval,) = struct.unpack('I', tail[lenidx:fnidx])
+    if not lenval == fnlen:
+        raise RuntimeError(f'Dataset length mismatch, read {lenval} from file')
+    return start + lenidx, str(tail[fnidx:],'utf-8')
+
+class Imatrix:
+    """A llama-imatrix file in the legacy binary layout.
+
+    The file is a count of entries, then for each a name, the number of
+    calls and the per-column sums of squared activations, and finally the
+    number of chunks and the dataset name. Loaded values are views into a
+    memory map, so nothing is read until it is used.
+    """
+    def __init__(self, entries: dict[str, ImatrixEntry] | None = None, chunks: int = 0,
+                 dataset: str | None = None):
+        self.entries = entries or {}
+        self.chunks = chunks
+        self.dataset = dataset
+
+    @classmethod
+    def load(cls, path: os.PathLike[str] | str) -> 'Imatrix':
+        data = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+        buf = memoryview(data)
+        def take(fmt: str) -> tuple:
+            nonlocal offs
+            values = struct.unpack_from(fmt, buf, offs)
+            offs += struct.calcsize(fmt)
+            return values
+        offs = 0
+        (n_entries,) = take('<i')
+        entries = {}
+        for _ in range(n_entries):
+            (nlen,) = take('<i')
+            name = str(buf[offs:offs + nlen], 'utf-8')
+            offs += nlen
+            ncall, nval = take('<ii')
+            entries[name] = ImatrixEntry(name, ncall, data[offs:offs + 4*nval].view('<f4'))
+            offs += 4*nval
+        chunks, dataset = 0, None
+        if offs + 4 <= len(data):
+            (chunks,) = take('<i')
+        if offs + 4 <= len(data):
+            (dlen,) = take('<i')
+            dataset = str(buf[offs:offs + dlen], 'utf-8')
+        return cls(entries, chunks, dataset)
+
+    def save(self, path: os.PathLike[str] | str):
+        with open(path, 'wb') as f:
+            f.write(struct.pack('<i', len(self.entries)))
+            for e in self.entries.values():
+                name = e.name.encode('utf-8')
+                f.write(struct.pack('<i', len(name)) + name + struct.pack('<ii', e.ncall, len(e.values)))
+                f.write(numpy.ascontiguousarray(e.values, dtype='<f4').data)
+            dataset = (self.dataset or '').encode('utf-8')
+            f.write(struct.pack('<ii', self.chunks, len(dataset)) + dataset)
+
+    def stats(self) -> list[ImatrixStats]:
+        stats = []
+        for e in self.entries.values():
+            averages = e.values / max(e.ncall, 1)
+            mean, high = (float(averages.mean()), float(averages.max())) if len(averages) else (0.0, 0.0)
+            stats.append(ImatrixStats(e.name, e.ncall, len(e.values), mean, high,
+                                      int(numpy.count_nonzero(e.values == 0))))
+        return stats
+
+def merge_imatrices(imatrices: Iterable[Imatrix], weights: Iterable[float] | None = None) -> Imatrix:
+    """Combines imatrices as if their calibration runs had been one, optionally weighting some more.
+
+    As when llama-imatrix is given several --in-file, the sums and call
+    counts of each tensor are added, so every run counts in proportion to
+    its chunks. A weight scales both, changing a run's influence but not
+    its own averages.
+    """
+    imatrices = list(imatrices)
+    weights = list(weights) if weights is not None else [1.0] * len(imatrices)
+    merged = {}
+    for im, w in zip(imatrices, weights, strict=True):
+        for e in im.entries.values():
+            if (m := merged.get(e.name)) is None:
+                merged[e.name] = [e.ncall * w, e.values.astype(numpy.float64) * w]
+            elif not len(m[1]) == len(e.values):
+                raise ValueError(f'{e.name} has {len(e.values)} values, expected {len(m[1])}')
+            else:
+                m[0] += e.ncall * w
+                m[1] += e.values * w
+    # Calls are whole numbers, so rescale the sums to keep each average exact
+    entries = {name: ImatrixEntry(name, round(ncall),
+                                  (values * (round(ncall) / ncall) if ncall else values).astype(numpy.float32))
+               for name, (ncall, values) in merged.items()}
+    chunks = round(sum(im.chunks * w for im, w in zip(imatrices, weights)))
+    dataset = '+'.join(dict.fromkeys(im.dataset for im in imatrices if im.dataset))
+    return Imatrix(entries, chunks, dataset or None)
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
@@ -1,7 +1,16 @@
+import os
+
+__exclude__ = set(locals())
+
 class IOBuffer(object):
-    def __init__(self, capacity):
+    def __init__(self, capacity, aligned=False):
         self.capacity = capacity
-        self.buffer = bytearray(capacity)
+        if aligned:
+            import mmap
+            # Anonymous maps are page aligned, as O_DIRECT needs
+            self.buffer = memoryview(mmap.mmap(-1, capacity))
+        else:
+            self.buffer = bytearray(capacity)
         self.length = 0
 
     @property
@@ -16,5 +25,21 @@ class IOBuffer(object):
         return self.length
     
     def writeto(self, f):
-        return f.write(self.bytes) if self.length else 0
+        return write_all(f, self.bytes) if self.length else 0
+
+def write_all(f, data, offset: int | None = None) -> int:
+    """Writes all of data to a raw file, or with pwrite at offset, carrying on after short writes"""
+    view = memoryview(data).cast('B')
+    done = 0
+    while done < len(view):
+        if offset is None:
+            n = f.write(view[done:])
+        else:
+            n = os.pwrite(f.fileno(), view[done:], offset + done)
+        if not n:
+            raise OSError(f'Write to {getattr(f, "name", f)} made no progress')
+        done += n
+    return done
 
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
@@ -0,0 +1,213 @@
+import os
+import time
+import base64
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable
+import requests
+from huggingface_hub import CommitOperationAdd, constants
+from huggingface_hub.lfs import LFS_HEADERS, post_lfs_batch_info
+from huggingface_hub.utils import build_hf_headers, get_session, hf_raise_for_status
+from .defs import *
+from .misc import RateLimiter
+
+__exclude__ = set(locals())
+
+# Responses worth trying again; anything else from the hub is final
+retry_statuses = {408, 429, 500, 502, 503, 504}
+
+class FileSlice:
+    """length bytes of a file from offset, as a request body, read through a bandwidth limiter"""
+    def __init__(self, path: os.PathLike[str] | str, offset: int, length: int,
+                 limiter: RateLimiter | None = None, progress: Callable[[int], None] | None = None):
+        self.file = open(path, 'rb')
+        self.file.seek(offset)
+        self.length = length
+        self.remaining = length
+        self.limiter = limiter
+        self.progress = progress
+
+    def __len__(self):
+        return self.length
+
+    def read(self, n: int = -1) -> bytes:
+        n = self.remaining if n is None or n < 0 else min(n, self.remaining)
+        data = self.file.read(n)
+        self.remaining -= len(data)
+        if self.limiter and data:
+            self.limiter.acquire(len(data))
+        if self.progress and data:
+            self.progress(len(data))
+        return data
+
+    @property
+    def sent(self) -> int:
+        return self.length - self.remaining
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class LFSUploader:
+    """Pushes the LFS objects of files to a repo, several files at a time, big ones in parallel parts.
+
+    The hub asks for objects above its multipart threshold in parts; those
+    are sent on up to connections connections between all files. bandwidth
+    (bytes per second) caps all of it together. Each request is retried
+    with exponential backoff and jitter, so one flaky part doesn't cost a
+    file. Objects the hub already has aren't sent. Hashes come from the
+    operations' UploadInfo, which qlib gets from its hash cache and .sha256
+    sidecars. progress is called with bytes sent, and total, once the hub
+    has said which files are LFS, with the bytes there are to send.
+    """
+    def __init__(self, repo_id: str, *, workers: int = 4, connections: int = 8, bandwidth: float | None = None,
+                 retries: int = 5, backoff: float = 1.0, progress: Callable[[int], None] | None = None,
+                 total: Callable[[int], None] | None = None, revision: str = constants.DEFAULT_REVISION):
+        self.repo_id = repo_id
+        self.workers = workers
+        self.connections = connections
+        self.limiter = RateLimiter(bandwidth, burst=max(bandwidth / 4, MiB)) if bandwidth else None
+        self.retries = retries
+        self.backoff = backoff
+        self.revision = revision
+        self.progress_lock = threading.Lock()
+        self._progress = progress
+        self.total = total
+        self.parts = None
+
+    def progress(self, n: int):
+        if self._progress:
+            with self.progress_lock:
+                self._progress(n)
+
+    def retry(self, fn: Callable, what: str):
+        for attempt in range(self.retries + 1):
+            try:
+                return fn()
+            except requests.RequestException as e:
+                status = e.response.status_code if e.response is not None else None
+                if attempt == self.retries or not is_transient(e):
+                    raise
+                delay = self.backoff * 2**attempt * random.uniform(0.5, 1.0)
+                print(f'{what} failed ({status or type(e).__name__}), retrying in {delay:.1f}s')
+                time.sleep(delay)
+
+    def fetch_upload_modes(self, ops: list[CommitOperationAdd]) -> dict[str, dict]:
+        """Asks the hub how each file is to be uploaded, as preupload_lfs_files does, by path in repo"""
+        modes = {}
+        for i in range(0, len(ops), 256):
+            chunk = ops[i:i + 256]
+            payload = {'files': [{'path': op.path_in_repo, 'sample': base64.b64encode(op.upload_info.sample).decode(),
+                                  'size': op.upload_info.size} for op in chunk]}
+            def post():
+                r = get_session().post(f'{constants.ENDPOINT}/api/models/{self.repo_id}/preupload/{self.revision}',
+                                       json=payload, headers=build_hf_headers())
+                hf_raise_for_status(r)
+                return r.json()['files']
+            modes.update((f['path'], f) for f in self.retry(post, 'preupload'))
+        return modes
+
+    def put(self, path: str, offset: int, length: int, url: str) -> requests.Response:
+        with FileSlice(path, offset, length, self.limiter, self.progress) as body:
+            try:
+                r = get_session().put(url, data=body)
+                hf_raise_for_status(r)
+                return r
+            except requests.RequestException:
+                self.progress(-body.sent)
+                raise
+
+    def upload_object(self, op: CommitOperationAdd, action: dict):
+        if not isinstance(op.path_or_fileobj, str):
+            raise TypeError(f'{op.path_in_repo}: only files on disk can be uploaded')
+        path, size = op.path_or_fileobj, op.upload_info.size
+        actions = action.get('actions') or {}
+        if upload := actions.get('upload'):
+            header = upload.get('header') or {}
+            if (chunk_size := header.get('chunk_size')) is not None:
+                chunk_size = int(chunk_size)
+                urls = [url for _, url in sorted((int(k), url) for k, url in header.items() if k.isdigit())]
+                if not len(urls) == -(-size // chunk_size):
+                    raise ValueError(f'{op.path_in_repo}: hub asked for {len(urls)} parts of {chunk_size}')
+                def part(i: int) -> str:
+                    return self.retry(lambda: self.put(path, i*chunk_size, min(chunk_size, size - i*chunk_size),
+                                                       urls[i]).headers['ETag'],
+                                      f'{op.path_in_repo} part {i + 1}/{len(urls)}')
+                etags = list(self.parts.map(part, range(len(urls))))
+                def complete():
+                    r = get_session().post(upload['href'], headers=LFS_HEADERS, json={
+                        'oid': action['oid'], 'parts': [{'partNumber': i + 1, 'etag': e} for i, e in enumerate(etags)]})
+                    hf_raise_for_status(r)
+                self.retry(complete, f'{op.path_in_repo} completion')
+            else:
+                self.retry(lambda: self.put(path, 0, size, upload['href']), op.path_in_repo)
+        else:
+            self.progress(size)
+        if verify := actions.get('verify'):
+            def post():
+                r = get_session().post(verify['href'], headers=build_hf_headers(),
+                                       json={'oid': action['oid'], 'size': size})
+                hf_raise_for_status(r)
+            self.retry(post, f'{op.path_in_repo} verification')
+
+    def upload(self, ops: Iterable[CommitOperationAdd],
+               on_uploaded: Callable[[CommitOperationAdd, str], None] | None = None) -> list[CommitOperationAdd]:
+        """Uploads the LFS objects the hub doesn't have, calling on_uploaded(op, upload mode) as each file lands.
+
+        Regular files go in the commit itself, so they count as landed at
+        once. The operations aren't changed: create_commit finds the
+        objects on the hub and doesn't send them again. Files that fail
+        don't stop the others; the first failure is raised at the end.
+        """
+        ops = list(ops)
+        if not ops:
+            return ops
+        modes = self.fetch_upload_modes(ops)
+        def mode(op) -> str:
+            return 'regular' if op.upload_info.size == 0 else modes[op.path_in_repo]['uploadMode']
+        lfs = [op for op in ops if mode(op) == 'lfs' and not modes[op.path_in_repo]['shouldIgnore']]
+        # Only LFS objects report progress; regular files go in the commit itself
+        if self.total:
+            self.total(sum(op.upload_info.size for op in lfs))
+        for op in ops:
+            if op not in lfs and on_uploaded:
+                on_uploaded(op, mode(op))
+        actions = {}
+        for i in range(0, len(lfs), 256):
+            batch, errors = self.retry(lambda: post_lfs_batch_info([op.upload_info for op in lfs[i:i + 256]],
+                                                                   None, 'model', self.repo_id, self.revision,
+                                                                   headers=build_hf_headers()), 'LFS batch')
+            if errors:
+                raise ValueError('LFS batch errors: ' + ', '.join(f'{e["oid"][:12]}: {e["error"]["message"]}'
+                                                                  for e in errors))
+            actions.update((a['oid'], a) for a in batch)
+        failure = None
+        with ThreadPoolExecutor(self.connections) as parts, ThreadPoolExecutor(self.workers) as files:
+            self.parts = parts
+            futures = {files.submit(self.upload_object, op, actions[op.upload_info.sha256.hex()]): op for op in lfs}
+            for future in as_completed(futures):
+                op = futures[future]
+                if (e := future.exception()) is not None:
+                    print(f'{op.path_in_repo} failed: {e}')
+                    failure = failure or e
+                    continue
+                if on_uploaded:
+                    on_uploaded(op, 'lfs')
+        if failure:
+            raise failure
+        return ops
+
+def is_transient(e: BaseException) -> bool:
+    """Whether a failed upload is worth trying again: a dropped connection or a status in retry_statuses"""
+    if isinstance(e, requests.RequestException):
+        return e.response is None or e.response.status_code in retry_statuses
+    return isinstance(e, RuntimeError)
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
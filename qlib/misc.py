@@ -1,15 +1,16 @@
 import sys
+import os
 import io
 import re
 import json
+import time
+import threading
 from enum import StrEnum
 from datetime import datetime as dt, timedelta
-from typing import Any, Callable
+from typing import Any, Callable, Iterable, Iterator
 from functools import cached_property
 import dataclasses
 import argparse
-import torch
-import safetensors
 import pathlib
 
 __exclude__ = set(locals())
@@ -101,6 +102,11 @@ class JSONEncoder(json.JSONEncoder):
 def to_json(obj:Any, readable=False):
     return json.dumps(obj, cls=JSONEncoder, indent=bool(readable))
 
+def cache_dir(*parts:str) -> pathlib.Path:
+    d = pathlib.Path(os.getenv('QLIB_CACHE_DIR') or '~/.cache/qlib').expanduser().joinpath(*parts)
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
 def varname(s:str):
     return s.lower().replace(' ','_')
 
@@ -216,6 +222,9 @@ class ProgressLine(StatusLine):
         self.completed = 0
         self.last_update = self.start_time = dt.now()
 
+    def set_total(self, total_amount:int):
+        self.total_amount = total_amount
+
     def update_progress(self, amount):
         self.completed += amount
         if self.staleness > self.max_staleness:
@@ -250,22 +259,59 @@ class ProgressLine(StatusLine):
 
         return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
 
-def torch_type_str(dtype: torch.dtype) -> str:
-    return (str(dtype).split('.')[-1]).replace('float','f').replace('uint', 'u').replace('int', 'i').upper()
+class RateLimiter:
+    """A token bucket: acquire() blocks so calls average at most rate per second, in bursts of up to burst.
+
+    acquire(n) takes n tokens at once (bytes, say, to cap bandwidth). What
+    the bucket lacks is borrowed, and the caller sleeps until it's repaid,
+    so later callers queue behind it.
+    """
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate) - amount
+            self.last = now
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+def bounded_map(fn: Callable[[Any], Any], items: Iterable[Any], workers: int = 8) -> Iterator[tuple[Any, Any]]:
+    """(item, fn(item)) as each call finishes, from a pool of workers.
+
+    Items are drawn from the iterable only as workers free up, so a lazy
+    (or endless) source is never read far ahead of the results. Closing the
+    generator cancels whatever hasn't started.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    items = iter(items)
+    with ThreadPoolExecutor(workers) as executor:
+        pending = {}
+        try:
+            while True:
+                for item in items:
+                    pending[executor.submit(fn, item)] = item
+                    if len(pending) >= 2*workers:
+                        break
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        finally:
+            for future in pending:
+                future.cancel()
 
 def guess_model_datatype(model_dir: str | pathlib.Path) -> str:
-    model_dir = pathlib.Path(model_dir)
-    for f in model_dir.glob('model*.safetensors'):
-        # safetensors model
-        with safetensors.safe_open(f, framework="pt", device="cpu") as part:
-            for name in part.keys():
-                data = part.get_slice(name)
-                return data.get_dtype()
-    for f in model_dir.glob('pytorch_model*.bin'):
-        part = torch.load(f, map_location="cpu", mmap=True, weights_only=True)
-        for data in part.values():
-            return torch_type_str(data.dtype)
-    raise ValueError(f'{model_dir} seems to be neither safetensors nor pytorch')
+    # Only checkpoint headers are read, so neither torch nor safetensors is needed
+    from .checkpoint import model_tensors, main_dtype
+    return main_dtype(model_tensors(model_dir))
 
 __all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
 del __exclude__
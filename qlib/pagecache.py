@@ -0,0 +1,171 @@
+import os
+import mmap
+import ctypes
+import ctypes.util
+from .defs import *
+
+__exclude__ = set(locals())
+
+page_size = mmap.PAGESIZE
+
+SYNC_FILE_RANGE_WAIT_BEFORE = 1
+SYNC_FILE_RANGE_WRITE = 2
+SYNC_FILE_RANGE_WAIT_AFTER = 4
+
+_libc = None
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _libc.mmap.restype = ctypes.c_void_p
+        _libc.mmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+                               ctypes.c_long)
+        _libc.munmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+        _libc.mincore.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_char_p)
+        _libc.sync_file_range.argtypes = (ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong, ctypes.c_uint)
+    return _libc
+
+def stream_io_mode() -> str:
+    """How one-pass reads and writes treat the page cache, from $QLIB_STREAM_IO.
+
+    'fadvise' drops what they brought into the cache once it has been used,
+    'direct' reads with O_DIRECT instead, and unset or '0' leaves the cache
+    to the kernel. Builds (defs.mk and the scheduler) turn on 'fadvise'.
+    """
+    mode = os.getenv('QLIB_STREAM_IO', '').lower()
+    return '' if mode in ('0', 'off', 'no', 'false', '') else mode
+
+def fadvise(fd: int, offset: int, length: int, advice: int):
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
+
+class Residency:
+    """Which pages of an open file are in the page cache, via mincore(2)."""
+    def __init__(self, fd: int, size: int | None = None):
+        self.size = os.fstat(fd).st_size if size is None else size
+        self.addr = None
+        if self.size:
+            addr = _load_libc().mmap(None, self.size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+            if addr not in (None, ctypes.c_void_p(-1).value):
+                self.addr = addr
+
+    def close(self):
+        if self.addr:
+            _load_libc().munmap(self.addr, self.size)
+            self.addr = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def pages(self, offset: int = 0, length: int | None = None) -> bytes:
+        if not self.addr:
+            return b''
+        start = offset - offset % page_size
+        end = min(self.size, offset + (self.size - offset if length is None else length))
+        if end <= start:
+            return b''
+        npages = -(-(end - start) // page_size)
+        vec = ctypes.create_string_buffer(npages)
+        if _load_libc().mincore(self.addr + start, end - start, vec):
+            return b''
+        return vec.raw
+
+    def resident(self, offset: int = 0, length: int | None = None) -> int:
+        """Number of resident pages in the range"""
+        pages = self.pages(offset, length)
+        return len(pages) - pages.count(0)
+
+    def any_resident(self, offset: int, length: int) -> bool:
+        return bool(self.pages(offset, length).strip(b'\0'))
+
+def residency(path: os.PathLike[str] | str) -> tuple[int, int]:
+    """(resident pages, total pages) of a file"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        with Residency(fd) as r:
+            return r.resident(), -(-r.size // page_size)
+    finally:
+        os.close(fd)
+
+class ReadBehind:
+    """Drops pages a sequential reader brought into the cache once it is past them.
+
+    Pages that were already cached when the read started are left alone, so
+    a file that another process is using (the shared .bin) keeps them. That
+    is decided from a snapshot taken up front, since the reader's own
+    readahead would otherwise make every range look cached.
+    """
+    def __init__(self, fd: int, offset: int = 0):
+        self.fd = fd
+        self.offset = offset
+        with Residency(fd) as r:
+            self.cached = r.pages()
+        fadvise(fd, offset, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def before(self, length: int) -> bool:
+        first = self.offset // page_size
+        return bool(self.cached[first:first + -(-length // page_size)].strip(b'\0'))
+
+    def after(self, length: int, was_cached: bool):
+        if not was_cached:
+            fadvise(self.fd, self.offset, length, os.POSIX_FADV_DONTNEED)
+        self.offset += length
+
+    def close(self):
+        self.cached = b''
+
+class WriteBehind:
+    """Starts writeback as a file is written and drops the pages once they are on disk.
+
+    Dirty pages can't be dropped, so each window is flushed asynchronously
+    and the one before it waited for and then evicted.
+    """
+    window = 64*MiB
+
+    def __init__(self, fd: int, offset: int = 0):
+        self.fd = fd
+        self.start = self.offset = offset
+        self.flushed = offset
+
+    def sync_range(self, offset: int, length: int, flags: int):
+        try:
+            _load_libc().sync_file_range(self.fd, offset, length, flags)
+        except (AttributeError, OSError):
+            os.fdatasync(self.fd)
+
+    def wrote(self, length: int):
+        self.offset += length
+        if self.offset - self.flushed >= self.window:
+            self.sync_range(self.flushed, self.offset - self.flushed, SYNC_FILE_RANGE_WRITE)
+            if self.flushed > self.start:
+                self.sync_range(self.start, self.flushed - self.start,
+                                SYNC_FILE_RANGE_WAIT_BEFORE | SYNC_FILE_RANGE_WRITE | SYNC_FILE_RANGE_WAIT_AFTER)
+                fadvise(self.fd, self.start, self.flushed - self.start, os.POSIX_FADV_DONTNEED)
+                self.start = self.flushed
+            self.flushed = self.offset
+
+    def close(self):
+        if self.offset > self.start:
+            self.sync_range(self.start, self.offset - self.start,
+                            SYNC_FILE_RANGE_WAIT_BEFORE | SYNC_FILE_RANGE_WRITE | SYNC_FILE_RANGE_WAIT_AFTER)
+            fadvise(self.fd, self.start, self.offset - self.start, os.POSIX_FADV_DONTNEED)
+            self.start = self.offset
+
+def open_direct(path: os.PathLike[str] | str):
+    """Opens a file for unbuffered O_DIRECT reads, or returns None where that isn't supported."""
+    if not hasattr(os, 'O_DIRECT'):
+        return None
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECT)
+    except OSError:
+        return None
+    return open(fd, 'rb', buffering=0)
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
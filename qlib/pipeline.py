@@ -0,0 +1,236 @@
+import os
+import re
+import math
+from pathlib import Path
+from functools import cached_property
+from .defs import *
+from .scheduler import *
+
+__exclude__ = set(locals())
+
+# These mirror IQTYPES/KQTYPES in mk/defs.mk
+IQTYPES = ('IQ1_S', 'IQ1_M', 'IQ2_XXS', 'IQ2_XS', 'IQ2_S', 'IQ2_M', 'IQ3_XXS', 'IQ3_XS', 'IQ3_S', 'IQ3_M', 'IQ4_XS')
+KQTYPES = ('Q3_K_S', 'Q3_K_M', 'Q3_K_L', 'Q4_K_S', 'Q4_K_M', 'Q5_K_S', 'Q5_K_M', 'Q6_K', 'Q8_0')
+
+FTYPE_BITS = {'F32': 32, 'F16': 16, 'BF16': 16}
+
+imatrix_default_dataset = 'https://github.com/ggerganov/llama.cpp/files/15440637/groups_merged-enhancedV3.txt'
+ppl_default_dataset = 'wiki_test.txt'
+
+makevar_rx = re.compile(r'^\s*(?:export\s+)?([A-Za-z_]\w*)\s*[:?]?=\s*(.*?)\s*$')
+
+def read_makefile_vars(path: Path) -> dict[str, str]:
+    mvars = {}
+    with path.open('rt', encoding='utf-8') as f:
+        for line in f:
+            if m := makevar_rx.match(line):
+                value = m.group(2)
+                if len(value) > 1 and value[0] == value[-1] == '"':
+                    value = value[1:-1]
+                mvars[m.group(1)] = value
+    return mvars
+
+def tree_size(p: Path) -> int:
+    if p.is_dir():
+        return sum(f.stat().st_size for f in p.resolve().rglob('*') if f.is_file())
+    return p.stat().st_size if p.exists() else 0
+
+class QuantBuild:
+    """The quantization pipeline of mk/defs.mk, expressed as scheduler jobs.
+
+    Settings come from the GNUmakefile that setup.py writes, overridden by
+    the environment the same way make would see them.
+    """
+    # llama-quantize mmaps the input and works a tensor at a time, so its
+    # private memory is a small fraction of the input; llama-imatrix needs
+    # the whole model.
+    quantize_ram_fraction = 1/8
+    min_quantize_ram = 1*GiB
+    convert_ram = 4*GiB
+
+    def __init__(self, workdir: Path, *, threads_per_job: int | None = None, ppl=False, qtypes=None):
+        self.workdir = workdir.absolute()
+        self.vars = read_makefile_vars(self.workdir / 'GNUmakefile')
+        self.threads_per_job = threads_per_job or max(1, (os.cpu_count() or 1) // 4)
+        self.ppl = ppl
+        self.qtypes = qtypes
+
+    def var(self, name: str, default: str | None = None) -> str | None:
+        return self.vars.get(name) or os.getenv(name) or default
+
+    def path(self, name: str) -> Path:
+        return self.workdir / name
+
+    @cached_property
+    def script_dir(self) -> Path:
+        return Path(__file__).parent.parent
+
+    @cached_property
+    def toaster_bin(self) -> Path:
+        if not (root := self.var('TOASTER_ROOT')):
+            raise RuntimeError('TOASTER_ROOT is not set')
+        return Path(root) / 'bin'
+
+    @cached_property
+    def quantmodel(self) -> str:
+        return self.var('QUANTMODEL') or self.basemodel
+
+    @cached_property
+    def basemodel(self) -> str:
+        return self.var('BASEMODEL') or self.var('BASEREPO').split('/')[-1]
+
+    @cached_property
+    def ftype(self) -> str:
+        if (ftype := self.var('FTYPE', 'F32')) not in FTYPE_BITS:
+            raise ValueError(f'FTYPE {ftype} is not supported by the scheduler')
+        return ftype
+
+    @cached_property
+    def bin_path(self) -> Path:
+        if cache := self.var('QUANTIZE_CACHE_DIR'):
+            if not (cache := Path(cache).absolute()) == self.workdir:
+                return cache / (self.quantmodel + '.bin')
+        return self.path(self.quantmodel + '.bin')
+
+    @cached_property
+    def bin_size(self) -> int:
+        if self.bin_path.exists():
+            return self.bin_path.stat().st_size
+        # Estimate from the source checkpoint, assumed to be 16 bit
+        return tree_size(self.path('basemodel') / self.basemodel) * FTYPE_BITS[self.ftype] // 16
+
+    @cached_property
+    def no_imatrix(self) -> bool:
+        return bool(self.var('NO_IMATRIX'))
+
+    def quant_types(self) -> list[str]:
+        types = ([] if self.no_imatrix else list(IQTYPES)) + [t for t in KQTYPES if not t == self.ftype]
+        if self.qtypes:
+            types = [t for t in types if t in self.qtypes]
+        return types
+
+    @cached_property
+    def predictor(self):
+        if self.bin_path.exists():
+            from .quantsize import QuantSizePredictor
+            return QuantSizePredictor(self.bin_path)
+        return None
+
+    def estimate_output_size(self, qtype: str) -> int:
+        if self.predictor:
+            p = self.predictor.predict(qtype, qtype in IQTYPES)
+            # Oversize outputs are split into shards next to the original
+            return p.size * (2 if p.needs_split else 1)
+        # Without the .bin to look at, bound every type by the size of Q8_0
+        return math.ceil(self.bin_size * 8.5 / FTYPE_BITS[self.ftype])
+
+    def estimate_quantize_ram(self, qtype: str) -> int:
+        if self.predictor:
+            return max(self.min_quantize_ram, self.predictor.quantize_ram())
+        return max(self.min_quantize_ram, int(self.bin_size * self.quantize_ram_fraction))
+
+    def qrun(self, script: str, *args) -> list[str]:
+        return ['python', str(self.script_dir / 'qrun.py'), script, *map(str, args)]
+
+    def xguf(self, qtype: str) -> Path:
+        return self.path(f'{self.quantmodel}.{qtype}.xguf')
+
+    def jobs(self) -> list[Job]:
+        Q, F = self.quantmodel, self.ftype
+        ncpu = os.cpu_count() or 1
+        jobs = []
+
+        base = self.path('basemodel') / self.basemodel
+        convert = [self.toaster_bin / 'convert_hf_to_gguf.py', f'--model-name={self.var("FULLNAME") or self.basemodel}']
+        if pretok := self.var('PRETOKENIZER'):
+            convert.append(f'--vocab-pre={pretok}')
+        xguf_in = self.path(f'{Q}.{F}.xguf-in')
+        jobs.append(Job(f'convert-{F}', [self.xguf(F)], [base],
+                        [['sh', '-c', f'test -f "{xguf_in}" || "$@"', 'convert',
+                          'python', *map(str, convert), f'--outtype={F}', f'--outfile={xguf_in}',
+                          *(self.var('CONVERT_OPTS') or '').split(), str(base)],
+                         self.qrun('postquantize', xguf_in, self.xguf(F))],
+                        ram=self.convert_ram, disk=self.bin_size, temps=[xguf_in]))
+
+        local_bin = self.bin_path.parent == self.workdir
+        jobs.append(Job('bin', [self.bin_path], [self.xguf(F)],
+                        [['rm', '-f', self.bin_path], ['ln' if local_bin else 'cp', self.xguf(F), self.bin_path]],
+                        disk=0 if local_bin else self.bin_size))
+
+        ngl = self.var('NGL') or self.var('N_GPU_LAYERS')
+        ngl = ['-ngl', ngl] if ngl else []
+
+        if not self.no_imatrix:
+            dataset = self.var('IMATRIX_DATASET', imatrix_default_dataset)
+            is_url = re.match('(https?|ftp)://', dataset)
+            imatrix_input = self.script_dir / 'data' / dataset.split('/')[-1]
+            if is_url:
+                jobs.append(Job('imatrix-dataset', [imatrix_input], [],
+                                [['wget', '-O', imatrix_input, dataset]], priority=0))
+            opts = (self.var('IMATRIX_OPTS') or '').split()
+            if chunks := self.var('IMATRIX_CHUNKS'):
+                opts = ['--chunks', chunks] + opts
+            imatrix = self.path(f'{Q}.imatrix')
+            jobs.append(Job('imatrix', [imatrix], [self.bin_path, imatrix_input],
+                            [[self.toaster_bin / 'llama-imatrix', *opts, '-c', '4096', '-m', self.bin_path, *ngl,
+                              '-f', imatrix_input, '-o', imatrix + '.tmp'],
+                             self.qrun('imatrix_rename', '--dataset', dataset if is_url else imatrix_input.name,
+                                       imatrix + '.tmp', imatrix)],
+                            ram=self.bin_size, threads=ncpu, priority=0))
+
+        # Quantizations all read the shared .bin, so they are preferred over
+        # anything that reads the outputs and would push it out of page cache.
+        for qtype in self.quant_types():
+            inputs = [self.bin_path]
+            opts = []
+            if qtype in IQTYPES:
+                inputs.append(imatrix := self.path(f'{Q}.imatrix'))
+                opts = ['--imatrix', imatrix]
+            xguf_in = self.path(f'{Q}.{qtype}.xguf-in')
+            jobs.append(Job(f'quantize-{qtype}', [self.xguf(qtype)], inputs,
+                            [[self.toaster_bin / 'llama-quantize', *opts, self.bin_path, xguf_in, qtype,
+                              str(self.threads_per_job)],
+                             self.qrun('postquantize', xguf_in, self.xguf(qtype))],
+                            ram=self.estimate_quantize_ram(qtype), threads=self.threads_per_job,
+                            disk=self.estimate_output_size(qtype), priority=1))
+
+        meta = self.path('_meta.json')
+        jobs.append(Job('meta', [meta], [self.bin_path],
+                        [self.qrun('mkmeta', *(self.var('META_OPTS') or '').split(), meta, self.bin_path)],
+                        priority=2))
+        if not self.var('REQUANT'):
+            readme = self.path('README.md')
+            opts = []
+            for opt,name in (('--description', 'DESCRIPTION'), ('--author', 'AUTHOR'), ('--title', 'FULLNAME')):
+                if value := self.var(name):
+                    opts += [opt, value]
+            jobs.append(Job('readme', [readme], [meta, self.path('GNUmakefile')],
+                            [['rm', '-f', readme], self.qrun('mkreadme', '-m', meta, *opts, '-o', readme,
+                                                             self.var('BASEREPO'))],
+                            priority=2))
+        for png in sorted((self.script_dir / 'assets').glob('*.png')):
+            jobs.append(Job(f'asset-{png.name}', [self.path(png.name)], [], [['cp', png, self.path(png.name)]],
+                            priority=2))
+
+        if self.ppl:
+            perplexity = self.toaster_bin / 'llama-perplexity'
+            ppl_input = self.script_dir / 'data' / self.var('PPL_DATASET', ppl_default_dataset)
+            klb = self.path(f'{Q}.klb')
+            jobs.append(Job('klb', [klb], [self.bin_path, ppl_input],
+                            [[perplexity, '-sm', 'none', '-m', self.bin_path, '-f', ppl_input,
+                              '--kl-divergence-base', klb + '.tmp'],
+                             ['mv', '-f', klb + '.tmp', klb]],
+                            ram=self.bin_size, threads=ncpu, priority=1))
+            for qtype in self.quant_types():
+                out = self.path(f'{Q}.{qtype}.ppl.out')
+                jobs.append(Job(f'ppl-{qtype}', [out], [self.xguf(qtype), klb],
+                                [['sh', '-c', '"$@" > "$0.tmp" && mv -f "$0.tmp" "$0"', out, perplexity,
+                                  '-m', self.xguf(qtype), *ngl, '--kl-divergence', '--kl-divergence-base', klb]],
+                                threads=ncpu, priority=3))
+        return jobs
+
+    def scheduler(self, **kwargs) -> Scheduler:
+        return Scheduler(self.jobs(), self.workdir, keep_cached=self.bin_size, **kwargs)
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
@@ -0,0 +1,252 @@
+import os
+import re
+import math
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import cached_property
+import gguf
+from .defs import *
+from .xguf import GGUFMetadataReader, TensorInfo
+
+T = gguf.GGMLQuantizationType
+
+__exclude__ = set(locals())
+
+# Predominant tensor type of each llama-quantize ftype
+ftype_base_types = {
+    'Q4_0': T.Q4_0, 'Q4_1': T.Q4_1, 'Q5_0': T.Q5_0, 'Q5_1': T.Q5_1, 'Q8_0': T.Q8_0,
+    'F16': T.F16, 'BF16': T.BF16, 'F32': T.F32,
+    'Q2_K': T.Q2_K, 'Q2_K_S': T.Q2_K,
+    'Q3_K_S': T.Q3_K, 'Q3_K_M': T.Q3_K, 'Q3_K_L': T.Q3_K,
+    'Q4_K_S': T.Q4_K, 'Q4_K_M': T.Q4_K,
+    'Q5_K_S': T.Q5_K, 'Q5_K_M': T.Q5_K,
+    'Q6_K': T.Q6_K,
+    'IQ1_S': T.IQ1_S, 'IQ1_M': T.IQ1_M,
+    'IQ2_XXS': T.IQ2_XXS, 'IQ2_XS': T.IQ2_XS, 'IQ2_S': T.IQ2_XS, 'IQ2_M': T.IQ2_S,
+    'IQ3_XXS': T.IQ3_XXS, 'IQ3_XS': T.IQ3_S, 'IQ3_S': T.IQ3_S, 'IQ3_M': T.IQ3_S,
+    'IQ4_NL': T.IQ4_NL, 'IQ4_XS': T.IQ4_XS,
+}
+
+# Types whose blocks span 256 values, and what llama-quantize uses instead
+# when a tensor's rows aren't a multiple of that
+k_block_fallbacks = {
+    T.IQ2_XXS: T.IQ4_NL, T.IQ2_XS: T.IQ4_NL, T.IQ2_S: T.IQ4_NL, T.IQ3_XXS: T.IQ4_NL, T.IQ3_S: T.IQ4_NL,
+    T.IQ1_S: T.IQ4_NL, T.IQ1_M: T.IQ4_NL, T.Q2_K: T.IQ4_NL, T.Q3_K: T.IQ4_NL, T.IQ4_XS: T.IQ4_NL,
+    T.Q4_K: T.Q5_0, T.Q5_K: T.Q5_1, T.Q6_K: T.Q8_0,
+}
+QK_K = 256
+
+# Tensors llama-quantize leaves in their original type
+unquantized_rx = re.compile(r'(_norm|ffn_gate_inp|pos_embd|token_types|ssm_conv1d|ssm_a|ssm_d)\.weight$|\.bias$')
+
+layer_rx = re.compile(r'blk\.(\d+)\.')
+
+IQ2_FTYPES = ('IQ2_XXS', 'IQ2_XS', 'IQ1_S', 'IQ2_S', 'IQ2_M', 'IQ1_M')
+
+def use_more_bits(i_layer: int, n_layers: int) -> bool:
+    return i_layer < n_layers // 8 or i_layer >= 7 * n_layers // 8 or (i_layer - n_layers // 8) % 3 == 2
+
+def padded(n: int, alignment: int) -> int:
+    return -(-n // alignment) * alignment
+
+@dataclass
+class QuantPrediction:
+    qtype: str
+    size: int
+    shard_sizes: list[int]
+    tensor_types: Counter = field(default_factory=Counter)
+
+    @property
+    def shards(self) -> int:
+        return len(self.shard_sizes)
+
+    @property
+    def needs_split(self) -> bool:
+        return self.shards > 1
+
+class QuantSizePredictor:
+    """Predicts the size of llama-quantize outputs from the tensor metadata of its input.
+
+    Per-tensor types follow llama.cpp's llama_tensor_get_type closely enough
+    that predicted sizes are normally within a percent or two of the real ones.
+    """
+    # Keys llama-quantize adds to the header (file type, imatrix provenance)
+    header_slack = 4*KiB
+
+    def __init__(self, path: os.PathLike[str] | str, max_shard_size: int = MAX_UPLOAD_SIZE):
+        self.reader = GGUFMetadataReader(path)
+        self.max_shard_size = max_shard_size
+
+    def field(self, key: str, default=None):
+        return f.decode() if (f := self.reader.fields.get(key)) else default
+
+    @cached_property
+    def arch(self) -> str:
+        return self.field('general.architecture', 'llama')
+
+    @cached_property
+    def tensors(self) -> list[TensorInfo]:
+        return self.reader.tensor_infos
+
+    @cached_property
+    def n_layers(self) -> int:
+        return self.field(f'{self.arch}.block_count') or 1 + max(
+            (int(m.group(1)) for t in self.tensors if (m := layer_rx.match(t.name))), default=0)
+
+    @cached_property
+    def n_gqa(self) -> int:
+        heads = self.field(f'{self.arch}.attention.head_count') or 1
+        kv_heads = self.field(f'{self.arch}.attention.head_count_kv') or heads
+        if isinstance(heads, list): heads = max(heads)
+        if isinstance(kv_heads, list): kv_heads = max(kv_heads) or 1
+        return heads // kv_heads
+
+    @cached_property
+    def n_expert(self) -> int:
+        return self.field(f'{self.arch}.expert_count') or 0
+
+    @cached_property
+    def has_output(self) -> bool:
+        return any(t.name == 'output.weight' for t in self.tensors)
+
+    @cached_property
+    def is_70b(self) -> bool:
+        return self.arch == 'llama' and self.n_layers == 80
+
+    @cached_property
+    def alignment(self) -> int:
+        return self.field('general.alignment') or gguf.GGUF_DEFAULT_ALIGNMENT
+
+    @cached_property
+    def largest_tensor(self) -> TensorInfo:
+        return max(self.tensors, key=lambda t: t.n_elements)
+
+    def tensor_type(self, t: TensorInfo, qtype: str, has_imatrix: bool) -> T:
+        base = ftype_base_types[qtype]
+        if len(t.shape) < 2 or unquantized_rx.search(t.name) or not t.name.endswith('weight'):
+            return t.tensor_type
+        name = t.name
+        m = layer_rx.match(name)
+        i_layer, n_layer = (int(m.group(1)) if m else 0), self.n_layers
+        new = base
+        if name == 'output.weight' or (not self.has_output and name == 'token_embd.weight'):
+            if self.arch == 'falcon' or t.shape[0] % QK_K:
+                new = T.Q8_0
+            elif qtype in IQ2_FTYPES or qtype == 'IQ3_XXS':
+                new = T.Q5_K
+            elif not new == T.Q8_0:
+                new = T.Q6_K
+        elif name == 'token_embd.weight':
+            if qtype in ('IQ2_XXS', 'IQ2_XS', 'IQ1_S', 'IQ1_M'):
+                new = T.Q2_K
+            elif qtype in ('IQ2_S', 'IQ2_M', 'IQ3_XXS'):
+                new = T.IQ3_S
+        elif qtype in IQ2_FTYPES:
+            if 'attn_v.weight' in name:
+                if self.n_gqa >= 4 or self.n_expert >= 4:
+                    new = T.Q4_K
+                else:
+                    new = T.IQ3_S if qtype in ('IQ2_S', 'IQ2_M') else T.Q2_K
+            elif self.n_expert == 8 and 'attn_k.weight' in name:
+                new = T.Q4_K
+            elif 'ffn_down' in name:
+                if i_layer < n_layer // 8:
+                    new = T.IQ3_S if qtype in ('IQ2_S', 'IQ2_M') else T.Q2_K
+            elif 'attn_output.weight' in name:
+                if self.n_expert == 8:
+                    new = T.Q5_K
+                elif qtype in ('IQ1_S', 'IQ1_M'):
+                    new = T.IQ2_XXS
+                elif qtype in ('IQ2_S', 'IQ2_M'):
+                    new = T.IQ3_S
+        elif 'attn_v.weight' in name:
+            match qtype:
+                case 'Q2_K': new = T.Q4_K if self.n_gqa >= 4 else T.Q3_K
+                case 'Q2_K_S' if self.n_gqa >= 4: new = T.Q4_K
+                case 'IQ3_XXS': new = T.Q4_K if self.n_gqa >= 4 else T.IQ3_XXS if has_imatrix else T.IQ3_S
+                case 'IQ3_XS' | 'IQ3_S' if self.n_gqa >= 4: new = T.Q4_K
+                case 'IQ3_M': new = T.Q4_K
+                case 'Q3_K_M': new = T.Q5_K if i_layer < 2 else T.Q4_K
+                case 'Q3_K_L': new = T.Q5_K
+                case 'IQ4_NL' | 'IQ4_XS' if self.n_gqa >= 4: new = T.Q5_K
+                case 'Q4_K_M' | 'Q5_K_M' if use_more_bits(i_layer, n_layer): new = T.Q6_K
+                case 'Q4_K_S' if i_layer < 4: new = T.Q5_K
+            if self.is_70b and new in (T.Q3_K, T.Q4_K):
+                new = T.Q5_K
+            if self.n_expert == 8:
+                new = T.Q8_0
+        elif 'attn_k.weight' in name or 'attn_q.weight' in name:
+            if 'attn_k' in name and self.n_expert == 8:
+                new = T.Q8_0
+            elif qtype == 'IQ3_XS':
+                new = T.IQ3_XXS
+            elif qtype == 'IQ3_XXS':
+                new = T.IQ2_S
+        elif 'ffn_down' in name:
+            match qtype:
+                case 'Q2_K': new = T.Q3_K
+                case 'Q2_K_S' if i_layer < n_layer // 8: new = T.Q4_K
+                case 'IQ3_XXS' if not has_imatrix: new = T.Q4_K if i_layer < n_layer // 8 else T.Q3_K
+                case 'Q3_K_M':
+                    new = T.Q5_K if i_layer < n_layer // 16 else \
+                        T.Q4_K if not self.arch == 'falcon' or use_more_bits(i_layer, n_layer) else T.Q3_K
+                case 'IQ3_M' if i_layer < n_layer // 8 or (self.n_expert == 8 and use_more_bits(i_layer, n_layer)):
+                    new = T.Q4_K
+                case 'Q3_K_L': new = T.Q4_K if self.arch == 'falcon' else T.Q5_K
+                case 'Q4_K_M' | 'Q5_K_M' if use_more_bits(i_layer, n_layer): new = T.Q6_K
+                case 'IQ4_NL' | 'IQ4_XS' if i_layer < n_layer // 8 and not has_imatrix: new = T.Q5_K
+                case 'Q4_K_S' if not self.arch == 'falcon' and i_layer < n_layer // 8: new = T.Q5_K
+        elif 'attn_output.weight' in name:
+            if self.n_expert == 8:
+                if qtype in ('Q2_K', 'IQ3_XS', 'IQ3_XXS', 'Q3_K_S', 'Q3_K_M', 'IQ4_NL', 'Q4_K_S', 'Q4_K_M',
+                             'IQ3_S', 'IQ3_M', 'IQ4_XS'):
+                    new = T.Q5_K
+            else:
+                new = {'Q2_K': T.Q3_K, 'IQ3_XXS': T.IQ3_S, 'Q3_K_M': T.Q4_K,
+                       'Q3_K_L': T.Q5_K, 'IQ3_M': T.Q4_K}.get(qtype, new)
+        elif 'attn_qkv.weight' in name:
+            new = {'Q3_K_M': T.Q4_K, 'Q3_K_L': T.Q4_K, 'IQ3_M': T.Q4_K,
+                   'Q4_K_M': T.Q5_K, 'Q5_K_M': T.Q6_K}.get(qtype, new)
+        elif 'ffn_gate' in name or 'ffn_up' in name:
+            if qtype == 'IQ3_XS' and n_layer // 8 <= i_layer < 7 * n_layer // 8:
+                new = T.IQ3_XXS
+        if new in k_block_fallbacks and t.shape[0] % QK_K:
+            new = k_block_fallbacks[new]
+        return new
+
+    def predict(self, qtype: str, has_imatrix: bool | None = None) -> QuantPrediction:
+        if qtype not in ftype_base_types:
+            raise ValueError(f'Unknown quantization type {qtype}')
+        if has_imatrix is None:
+            has_imatrix = qtype.startswith('IQ')
+        types = Counter()
+        sizes = []
+        for t in self.tensors:
+            ttype = self.tensor_type(t, qtype, has_imatrix)
+            block_size, type_size = gguf.GGML_QUANT_SIZES[ttype]
+            types[ttype.name] += 1
+            sizes.append(padded(t.n_elements * type_size // block_size, self.alignment))
+        header = padded(self.reader.data_offset + self.header_slack, self.alignment)
+        total = header + sum(sizes)
+        return QuantPrediction(qtype, total, self.shard_sizes(header, sizes, total), types)
+
+    def shard_sizes(self, header: int, sizes: list[int], total: int) -> list[int]:
+        # postquantize only splits files over the upload limit; the splitter
+        # then starts a new shard whenever the next tensor would overflow it,
+        # counting the metadata of the first shard
+        if total <= self.max_shard_size:
+            return [total]
+        shards = [header]
+        for n in sizes:
+            if shards[-1] and shards[-1] + n > self.max_shard_size:
+                shards.append(0)
+            shards[-1] += n
+        return shards
+
+    def quantize_ram(self) -> int:
+        # llama-quantize holds the largest tensor as read, converted to F32, and quantized
+        t = self.largest_tensor
+        return t.n_bytes + 2 * 4 * t.n_elements
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
@@ -0,0 +1,187 @@
+import os
+import sys
+import shutil
+import subprocess
+import threading
+import queue
+from dataclasses import dataclass, field
+from pathlib import Path
+from datetime import datetime as dt
+from .defs import *
+
+__exclude__ = set(locals())
+
+# Defaults for the jobs' environment, as defs.mk exports them to make's recipes
+build_env = {'QLIB_STREAM_IO': 'fadvise'}
+
+def meminfo() -> dict[str, int]:
+    info = {}
+    try:
+        with open('/proc/meminfo', 'rt') as f:
+            for line in f:
+                k,v = line.split(':', 1)
+                n,*unit = v.split()
+                info[k] = int(n) * (KiB if unit else 1)
+    except OSError:
+        pages = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        info['MemTotal'] = info['MemAvailable'] = pages
+    return info
+
+def disk_free(p: Path) -> int:
+    while not p.exists():
+        p = p.parent
+    return shutil.disk_usage(p).free
+
+@dataclass(eq=False)
+class Job:
+    name: str
+    outputs: list[Path]
+    inputs: list[Path] = field(default_factory=list)
+    commands: list[list[str]] = field(default_factory=list)
+    ram: int = 0           # peak private memory, in bytes
+    threads: int = 1
+    disk: int = 0          # bytes written to the output directory
+    priority: int = 0      # lower runs first among ready jobs
+    deps: list['Job'] = field(default_factory=list)
+    status: str = 'pending'
+    temps: list[Path] = field(default_factory=list)  # intermediate files, removed with the outputs on failure
+
+    def is_up_to_date(self) -> bool:
+        if not all(p.exists() for p in self.outputs):
+            return False
+        oldest = min(p.stat().st_mtime for p in self.outputs)
+        return all(p.stat().st_mtime <= oldest for p in self.inputs if p.exists())
+
+    def run(self, log: Path) -> int:
+        env = build_env | dict(os.environ)
+        with log.open('at', encoding='utf-8') as f:
+            for cmd in self.commands:
+                f.write(f'+ {" ".join(map(str, cmd))}\n')
+                f.flush()
+                if rc := subprocess.run(list(map(str, cmd)), stdout=f, stderr=subprocess.STDOUT,
+                                        stdin=subprocess.DEVNULL, env=env).returncode:
+                    return rc
+        return 0
+
+    def clean(self):
+        """Removes what a failed or interrupted run may have left half written"""
+        for p in self.outputs + self.temps:
+            p.unlink(missing_ok=True)
+
+class SchedulingError(Exception):
+    pass
+
+class Scheduler:
+    """Runs a DAG of jobs, starting as many as the machine's RAM, CPUs and disk allow.
+
+    Jobs whose outputs are already newer than their inputs are skipped, so an
+    interrupted build resumes where it left off. Among the jobs that are ready
+    to run, lower priority values start first.
+    """
+    ram_reserve = 2*GiB
+    disk_reserve = 10*GiB
+
+    def __init__(self, jobs: list[Job], workdir: Path, *, ram: int | None = None, threads: int | None = None,
+                 keep_cached: int = 0, logdir: Path | None = None, dry_run=False):
+        self.jobs = jobs
+        self.workdir = workdir
+        self.logdir = logdir or workdir / '_build'
+        self.dry_run = dry_run
+        mi = meminfo()
+        if ram is None:
+            # Keep room for the shared input to stay in page cache if it can
+            cached = keep_cached if keep_cached < mi['MemTotal'] * 3 // 4 else 0
+            ram = min(mi['MemAvailable'], mi['MemTotal'] - cached) - self.ram_reserve
+        self.ram = max(ram, 0)
+        self.threads = threads or os.cpu_count() or 1
+        producers = {p.absolute(): j for j in jobs for p in j.outputs}
+        for j in jobs:
+            j.deps = list({producers[p.absolute()] for p in j.inputs if p.absolute() in producers} - {j})
+
+    def log(self, msg: str):
+        sys.stdout.write(f'{dt.now():%H:%M:%S} {msg}\n')
+        sys.stdout.flush()
+
+    def fits(self, job: Job, running: set[Job]) -> bool:
+        if not running:
+            return True
+        return (sum(j.ram for j in running) + job.ram <= self.ram and
+                sum(j.threads for j in running) + job.threads <= self.threads)
+
+    def disk_ok(self, job: Job, running: set[Job]) -> bool:
+        pending = sum(j.disk for j in running)
+        return disk_free(self.workdir) - pending - job.disk >= self.disk_reserve
+
+    def ready(self) -> list[Job]:
+        return sorted((j for j in self.jobs if j.status == 'pending' and all(d.status == 'done' for d in j.deps)),
+                      key=lambda j: j.priority)
+
+    def plan(self) -> list[Job]:
+        while current := [j for j in self.ready() if j.is_up_to_date()]:
+            for j in current:
+                j.status = 'done'
+        return [j for j in self.jobs if not j.status == 'done']
+
+    def check_space(self, todo: list[Job]):
+        needed = sum(j.disk for j in todo)
+        if needed > (free := disk_free(self.workdir) - self.disk_reserve):
+            raise SchedulingError(f'Build needs {needed/GB:.1f} GB but only {free/GB:.1f} GB is free in {self.workdir}')
+
+    def run(self, force=False) -> bool:
+        todo = self.plan()
+        if not (force or self.dry_run):
+            self.check_space(todo)
+        if self.dry_run:
+            for j in todo:
+                self.log(f'would run {j.name} (ram {j.ram/GiB:.1f} GiB, {j.threads} threads, disk {j.disk/GB:.1f} GB)')
+            return True
+        self.logdir.mkdir(parents=True, exist_ok=True)
+        finished = queue.Queue()
+        running: set[Job] = set()
+        failed = False
+
+        def worker(job: Job):
+            finished.put((job, job.run(self.logdir / (job.name + '.log'))))
+
+        while True:
+            progress = not failed
+            while progress:
+                progress = False
+                for job in self.ready():
+                    if job.is_up_to_date():
+                        job.status = 'done'
+                    elif not self.fits(job, running):
+                        continue
+                    elif not self.disk_ok(job, running):
+                        if running:
+                            continue
+                        raise SchedulingError(f'Not enough disk space in {self.workdir} for {job.name} '
+                                              f'({job.disk/GB:.1f} GB needed)')
+                    else:
+                        job.status = 'running'
+                        running.add(job)
+                        self.log(f'start {job.name}')
+                        threading.Thread(target=worker, args=(job,), daemon=True).start()
+                    progress = True
+            if not running:
+                break
+            try:
+                job, rc = finished.get()
+            except KeyboardInterrupt:
+                # The jobs got the SIGINT too; what they were writing is incomplete
+                for j in running:
+                    j.clean()
+                raise
+            running.discard(job)
+            if rc:
+                job.status = 'failed'
+                failed = True
+                job.clean()
+                self.log(f'FAILED {job.name} (exit {rc}), see {self.logdir / (job.name + ".log")}')
+            else:
+                job.status = 'done'
+                self.log(f'done {job.name}')
+        return not failed and all(j.status == 'done' for j in self.jobs)
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
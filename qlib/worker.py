@@ -0,0 +1,168 @@
+import sys
+import os
+import io
+import json
+import runpy
+import signal
+import socket
+import importlib
+import socketserver
+import traceback
+from pathlib import Path
+from . import misc
+
+__exclude__ = set(locals())
+
+script_dir = Path(__file__).parent.parent
+
+# Scripts the worker will run on behalf of a client
+commands = ('postquantize', 'mkmeta', 'mkreadme', 'imatrix_rename', 'sha256_files')
+
+def default_socket_path() -> Path:
+    if p := os.getenv('QLIB_WORKER_SOCKET'):
+        return Path(p)
+    if d := os.getenv('XDG_RUNTIME_DIR'):
+        return Path(d) / 'qlib-worker.sock'
+    return misc.cache_dir() / 'worker.sock'
+
+def send_message(f, **msg):
+    f.write((misc.to_json(msg) + '\n').encode('utf-8'))
+    f.flush()
+
+class MessageStream(io.TextIOBase):
+    def __init__(self, wfile, name:str):
+        self.wfile = wfile
+        self.name = name
+
+    def writable(self):
+        return True
+
+    def write(self, s:str) -> int:
+        if s:
+            send_message(self.wfile, **{self.name: s})
+        return len(s)
+
+class WorkerRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError as e:
+            send_message(self.wfile, stderr=f'qlib worker: bad request: {e}\n', exit=2)
+            return
+        match request.get('command', 'run'):
+            case 'ping':
+                send_message(self.wfile, pid=self.server.pid, exit=0)
+            case 'shutdown':
+                send_message(self.wfile, exit=0)
+                os.kill(self.server.pid, signal.SIGTERM)
+            case 'run':
+                send_message(self.wfile, exit=self.server.run(request, self.wfile))
+            case command:
+                send_message(self.wfile, stderr=f'qlib worker: unknown command {command!r}\n', exit=2)
+
+class WorkerServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """Runs qlib scripts from a long-lived interpreter with qlib already imported.
+
+    Each request is served in a forked child, so recipes run in parallel
+    under make -j, the warm imports are shared copy-on-write, and the
+    working directory, environment and streams a request takes over are
+    its own and die with it.
+
+    What is saved is the import cost only. Anything a request fills in
+    memory, such as Model.cache or the HTTP session and its connections,
+    goes with its child; hub metadata carries over between recipes only
+    through the on-disk hub cache.
+    """
+    # Settings modules read from the environment when imported, which a child must read again
+    env_modules = ('huggingface_hub.constants',)
+
+    def __init__(self, path: os.PathLike[str] | str):
+        self.path = Path(path)
+        self.path.unlink(missing_ok=True)
+        self.pid = os.getpid()
+        super().__init__(str(self.path), WorkerRequestHandler)
+
+    def warm(self):
+        import qlib
+        for name in ('xguf', 'hfutil'):
+            getattr(qlib, name)
+
+    def serve(self):
+        self.warm()
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+            self.path.unlink(missing_ok=True)
+
+    @classmethod
+    def apply_env(cls, env: dict):
+        os.environ.clear()
+        os.environ.update(env)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        for name in cls.env_modules:
+            if name in sys.modules:
+                importlib.reload(sys.modules[name])
+        if hfutil := sys.modules.get('qlib.hfutil'):
+            hfutil.organization = os.getenv('HF_DEFAULT_ORGANIZATION')
+        if hubcache := sys.modules.get('qlib.hubcache'):
+            hubcache.default_ttl = hubcache.hub_cache.ttl = float(os.getenv('QLIB_HUB_TTL', 3600))
+
+    def run(self, request:dict, wfile) -> int:
+        """Runs a script; called in the request's own forked process"""
+        if (script := request.get('script')) not in commands:
+            send_message(wfile, stderr=f'qlib worker: {script!r} is not a worker command\n')
+            return 2
+        script_path = script_dir / (script + '.py')
+        try:
+            if cwd := request.get('cwd'):
+                os.chdir(cwd)
+            self.apply_env(request.get('env') or dict(os.environ))
+            sys.argv = [str(script_path)] + list(request.get('argv', []))
+            sys.stdout = MessageStream(wfile, 'stdout')
+            sys.stderr = MessageStream(wfile, 'stderr')
+            runpy.run_path(str(script_path), run_name='__main__')
+            return 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+        except Exception:
+            traceback.print_exc()
+            return 1
+        finally:
+            sys.stdout.flush()
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+
+def request(msg:dict, path: os.PathLike[str] | str | None = None) -> int | None:
+    """Sends a request to the worker and relays its output.
+
+    Returns the exit code, or None if no worker is listening.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path or default_socket_path()))
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    with sock, sock.makefile('rwb') as f:
+        send_message(f, **msg)
+        for line in f:
+            reply = json.loads(line)
+            if s := reply.get('stdout'):
+                sys.stdout.write(s)
+                sys.stdout.flush()
+            if s := reply.get('stderr'):
+                sys.stderr.write(s)
+            if 'exit' in reply:
+                return reply['exit']
+    raise RuntimeError('qlib worker closed the connection without an exit status')
+
+def run_script(script:str, argv:list[str], path: os.PathLike[str] | str | None = None) -> int | None:
+    return request({'command': 'run', 'script': script, 'argv': argv,
+                    'cwd': os.getcwd(), 'env': dict(os.environ)}, path)
+
+__all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
+del __exclude__
@@ -1,28 +1,240 @@
 import os
 import io
-from typing import Callable
+import sys
+import math
+import struct
+from collections import OrderedDict
+from typing import Any, Callable, NamedTuple
 import gguf
 import numpy
+from .defs import *
+
+class StringArrayBlob(numpy.ndarray):
+    """The raw bytes of a whole GGUF string array, a (uint64 length, utf-8 bytes) pair per string.
+
+    GGUFReader keeps large string arrays as one of these instead of two
+    ndarrays per element, and decodes them in a single pass.
+    """
+    byteorder = '<'
+
+    def __array_finalize__(self, obj):
+        self.byteorder = getattr(obj, 'byteorder', '<')
+
+    def strings(self) -> list[str]:
+        buf = self.view(numpy.ndarray).tobytes()
+        unpack = struct.Struct(self.byteorder + 'Q').unpack_from
+        strings, pos = [], 0
+        while pos < len(buf):
+            n, = unpack(buf, pos)
+            pos += 8
+            strings.append(buf[pos:pos + n].decode('utf-8'))
+            pos += n
+        return strings
+
+def ndarray_tostring(nda:numpy.ndarray) -> str:
+    return nda.tobytes().decode('utf-8')
+
+def ndarray_toscalar(nda:numpy.ndarray) -> Any:
+    return nda.item()
+
+def is_bulk_array(self:gguf.gguf_reader.ReaderField) -> bool:
+    # Arrays read by qlib's GGUFReader have all their values in one part
+    return self.types[0] == gguf.GGUFValueType.ARRAY and len(self.data) == 1 and \
+        (isinstance(self.parts[self.data[0]], StringArrayBlob) or self.types[-1] != gguf.GGUFValueType.STRING)
+
+def gguf_ReaderField_decode(self:gguf.gguf_reader.ReaderField) -> Any:
+    if is_bulk_array(self):
+        part = self.parts[self.data[0]]
+        return part.strings() if isinstance(part, StringArrayBlob) else part.tolist()
+    if self.types[-1] == gguf.GGUFValueType.STRING:
+        fdec = ndarray_tostring
+    else:
+        fdec = ndarray_toscalar
+    gen=(fdec(self.parts[i]) for i in self.data)
+    if self.types[0] == gguf.GGUFValueType.ARRAY:
+        return list(gen)
+    else:
+        return next(gen,None)
+
+def gguf_ReaderField_array(self:gguf.gguf_reader.ReaderField) -> numpy.ndarray:
+    """The values of a numeric array field as one typed ndarray, without copying"""
+    if is_bulk_array(self) and not isinstance(part := self.parts[self.data[0]], StringArrayBlob):
+        return part
+    return numpy.array(self.decode())
+
+gguf_ReaderField_contents = gguf.gguf_reader.ReaderField.contents
+
+def gguf_ReaderField_bulk_contents(self:gguf.gguf_reader.ReaderField, index_or_slice: int | slice = slice(None)) -> Any:
+    if is_bulk_array(self):
+        return self.decode()[index_or_slice]
+    return gguf_ReaderField_contents(self, index_or_slice)
+
+gguf.gguf_reader.ReaderField.decode = gguf_ReaderField_decode
+gguf.gguf_reader.ReaderField.array = gguf_ReaderField_array
+gguf.gguf_reader.ReaderField.contents = gguf_ReaderField_bulk_contents
 
 __exclude__ = set(locals())
+
+class TensorInfo(NamedTuple):
+    name: str
+    shape: tuple[int, ...]              # ggml order, innermost dimension first
+    tensor_type: gguf.GGMLQuantizationType
+    offset: int                         # relative to the start of the data section
+
+    @property
+    def n_elements(self) -> int:
+        return math.prod(self.shape)
+
+    @property
+    def n_bytes(self) -> int:
+        block_size, type_size = gguf.GGML_QUANT_SIZES[self.tensor_type]
+        return self.n_elements * type_size // block_size
+
+    @classmethod
+    def from_field(cls, field: gguf.gguf_reader.ReaderField):
+        _, _, _, dims, raw_dtype, offset = field.parts
+        return cls(field.name, tuple(dims.tolist()), gguf.GGMLQuantizationType(raw_dtype[0]), int(offset[0]))
+
 class GGUFReader(gguf.gguf_reader.GGUFReader):
     def _build_fields(self, offs: int, count: int) -> int:
         self.tensor_info_offset = offs = super()._build_fields(offs, count)
         return offs
 
+    def _build_tensor_info(self, offs: int, count: int) -> tuple[int, list[gguf.gguf_reader.ReaderField]]:
+        offs, fields = super()._build_tensor_info(offs, count)
+        self.tensor_info_end = offs
+        return offs, fields
+
+    @property
+    def struct_order(self) -> str:
+        return '<' if (self.byte_order == 'I') == (sys.byteorder == 'little') else '>'
+
+    def _string_array_size(self, offs: int, count: int) -> int:
+        unpack = struct.Struct(self.struct_order + 'Q').unpack_from
+        window = 64*KiB
+        while True:
+            buf = self.data[offs:offs + window]
+            pos = 0
+            for _ in range(count):
+                if pos + 8 > len(buf):
+                    break
+                n, = unpack(buf, pos)
+                pos += 8 + n
+            else:
+                if pos <= len(buf):
+                    return pos
+            if len(buf) < window:
+                raise ValueError(f'String array at {offs} runs past the end of the file')
+            window *= 4
+
+    # Arrays are read whole, as one part, rather than as a part (or two) per element
+    def _get_field_parts(self, orig_offs: int, raw_type: int) -> tuple[int, list[numpy.ndarray], list[int], list[gguf.GGUFValueType]]:
+        if raw_type == gguf.GGUFValueType.ARRAY:
+            raw_itype = self._get(orig_offs, numpy.uint32)
+            alen = self._get(orig_offs + 4, numpy.uint64)
+            offs, count = orig_offs + 12, int(alen[0])
+            itype = gguf.GGUFValueType(raw_itype[0])
+            values = None
+            if not count:
+                pass
+            elif (nptype := self.gguf_scalar_to_np.get(itype)) is not None:
+                values = self._get(offs, nptype, count)
+            elif itype == gguf.GGUFValueType.STRING:
+                size = self._string_array_size(offs, count)
+                values = self.data[offs:offs + size].view(StringArrayBlob)
+                values.byteorder = self.struct_order
+            if values is not None:
+                return 12 + values.nbytes, [raw_itype, alen, values], [2], [gguf.GGUFValueType.ARRAY, itype]
+        return super()._get_field_parts(orig_offs, raw_type)
+
+class HTTPRangeFile(io.RawIOBase):
+    """A read-only file over HTTP, fetching whatever is read with Range requests."""
+    def __init__(self, url: str, mode:str = 'rb', headers: dict[str, str] | None = None, session=None):
+        assert mode == 'rb'
+        import requests
+        self.url = url
+        self.headers = headers or {}
+        self.session = session or requests.Session()
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_END:
+            raise io.UnsupportedOperation('HTTPRangeFile can only seek from the start')
+        self.pos = offset if whence == io.SEEK_SET else self.pos + offset
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def readinto(self, b) -> int:
+        if not (nbytes := len(b)):
+            return 0
+        headers = dict(self.headers, Range=f'bytes={self.pos}-{self.pos + nbytes - 1}')
+        r = self.session.get(self.url, headers=headers)
+        if r.status_code == 416:
+            return 0
+        r.raise_for_status()
+        data = r.content[:nbytes] if r.status_code == 206 else r.content[self.pos:self.pos + nbytes]
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+def http_opener(headers: dict[str, str] | None = None) -> Callable[[str, str], HTTPRangeFile]:
+    """An opener for GGUFMetadataReader that reads a remote GGUF header by URL"""
+    import requests
+    session = requests.Session()
+    return lambda url, mode = 'rb': HTTPRangeFile(url, mode, headers, session)
+
 class GGUFMetadataReader(GGUFReader):
     class FileMapper:
+        """Serves the reader's slices from a small LRU cache of aligned blocks.
+
+        The gguf reader asks for every length, type and string separately, so
+        each block read here replaces thousands of seek+read calls, and the
+        slices it hands back are views into the block rather than copies.
+        Blocks are large enough that a remote opener makes few requests too.
+        """
+        block_size = 1*MiB
+        max_blocks = 64
+
         def __init__(self, path: os.PathLike[str] | str, mode:str = 'rb',
                      opener:Callable[[os.PathLike[str] | str, str], io.BufferedReader] | None = None):
             assert mode == 'rb'
             self.file = (opener or open)(path, mode = mode)
+            self.blocks: OrderedDict[int, numpy.ndarray] = OrderedDict()
+            self.reads = 0
 
         def __getitem__(self, i):
             return self._getrange(*self._extent(i))
 
+        def _block(self, n: int) -> numpy.ndarray:
+            if (block := self.blocks.get(n)) is not None:
+                self.blocks.move_to_end(n)
+                return block
+            self.file.seek(n * self.block_size)
+            block = numpy.frombuffer(self.file.read(self.block_size), dtype=numpy.uint8)
+            self.reads += 1
+            self.blocks[n] = block
+            if len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last = False)
+            return block
+
         def _getrange(self, offset:int, nbytes:int = 1):
-            self.file.seek(offset)
-            return numpy.ndarray((nbytes,), dtype=numpy.uint8, buffer=self.file.read(nbytes))
+            if nbytes <= 0:
+                return numpy.empty((0,), dtype=numpy.uint8)
+            first, last = offset // self.block_size, (offset + nbytes - 1) // self.block_size
+            start = offset - first * self.block_size
+            if first == last:
+                return self._block(first)[start:start + nbytes]
+            # Straddles blocks, so it has to be copied
+            parts = [self._block(n) for n in range(first, last + 1)]
+            return numpy.concatenate(parts)[start:start + nbytes]
 
         @staticmethod
         def _extent(i):
@@ -30,11 +242,40 @@ class GGUFMetadataReader(GGUFReader):
 
     def __init__(self, path: os.PathLike[str] | str, mode:str = 'rb', cls:type = FileMapper,
                  opener:Callable[[os.PathLike[str] | str, str], io.BufferedReader] | None = None):
-        super().__init__(path, mode = mode, cls = cls, opener = opener)
+        # gguf's own __init__ memory-maps the whole file, so its header parsing is repeated
+        # here over cls; the field and tensor info parsing is still gguf's
+        self.data = cls(path, mode = mode, opener = opener)
+        self.fields = OrderedDict()
+        self.tensors = []
+        if self._get(0, numpy.uint32, override_order = '<')[0] != gguf.GGUF_MAGIC:
+            raise ValueError('GGUF magic invalid')
+        version = self._get(4, numpy.uint32)
+        if version[0] & 0xffff == 0:
+            # Written on a machine of the other byte order
+            self.byte_order = 'S'
+            version = version.view(version.dtype.newbyteorder(self.byte_order))
+        if version[0] not in gguf.gguf_reader.READER_SUPPORTED_VERSIONS:
+            raise ValueError(f'{path} is GGUF version {version[0]}, which the gguf package can\'t read')
+        ReaderField, ValueType = gguf.gguf_reader.ReaderField, gguf.GGUFValueType
+        offs = 4 + self._push_field(ReaderField(4, 'GGUF.version', [version], [0], [ValueType.UINT32]))
+        counts = self._get(offs, numpy.uint64, 2)
+        offs += self._push_field(ReaderField(offs, 'GGUF.tensor_count', [counts[:1]], [0], [ValueType.UINT64]))
+        offs += self._push_field(ReaderField(offs, 'GGUF.kv_count', [counts[1:]], [0], [ValueType.UINT64]))
+        offs = self._build_fields(offs, int(counts[1]))
+        offs, _ = self._build_tensor_info(offs, int(counts[0]))
+        if (field := self.fields.get('general.alignment')) is not None:
+            if field.types != [ValueType.UINT32]:
+                raise ValueError('Bad type for general.alignment field')
+            self.alignment = int(field.parts[-1][0])
+            if not self.alignment or self.alignment & (self.alignment - 1):
+                raise ValueError('Invalid alignment: must be a non-zero power of two')
+        self.data_offset = offs + -offs % self.alignment
 
+    # Tensor info is parsed (it's part of the header) but no tensor data is mapped
     def _build_tensor_info(self, offs: int, count: int) -> tuple[int, list[gguf.gguf_reader.ReaderField]]:
-        count = 0
-        return super()._build_tensor_info(offs, count)
+        offs, fields = super()._build_tensor_info(offs, count)
+        self.tensor_infos = [TensorInfo.from_field(f) for f in fields]
+        return offs, []
 
 __all__ = [ sym for sym in locals() if not (sym in __exclude__ or sym.startswith('_'))]
 del __exclude__
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+import sys
+import os
+from qlib import worker
+
+# Runs one of the worker scripts through the qlib worker if one is listening,
+# otherwise runs it directly in this interpreter's place.
+def main():
+    if len(sys.argv) < 2 or (script := sys.argv[1]) not in worker.commands:
+        sys.exit(f'usage: {os.path.basename(sys.argv[0])} {{{",".join(worker.commands)}}} [args...]')
+    argv = sys.argv[2:]
+    if (code := worker.run_script(script, argv)) is None:
+        script_path = str(worker.script_dir / (script + '.py'))
+        os.execv(sys.executable, [sys.executable, script_path] + argv)
+    sys.exit(code)
+
+if __name__ == '__main__':
+    main()
@@ -4,24 +4,21 @@ import os
 import re
 from pathlib import Path
 from typing import Iterator
-import subprocess
 import clear_screen
 import argparse
 import qlib
 
 MAX_UPLOAD_SIZE = 50_000_000_000
-TOASTER = Path(os.environ['TOASTER_ROOT'])
 HF_DEFAULT_ORGANIZATION = os.getenv('HF_DEFAULT_ORGANIZATION')
-gguf_split_exe = TOASTER/'bin'/'llama-gguf-split'
 shard_rx = re.compile('.*-split-\d{5}-of-\d{5}$')
 
 def oversize_ggufs(d: Path) -> Iterator[Path]:
     return (f for f in d.iterdir() if f.suffix == '.gguf' and f.size > qlib.MAX_UPLOAD_SIZE)
 
 def gguf_split(p: Path, keep=False):
-    result = subprocess.run([gguf_split_exe, '--split-max-size', '50G', p])
-    if result.returncode:
-        raise RuntimeError(f'llama-gguf-split returned {result.returncode}')
+    pl = qlib.misc.ProgressLine(p.size, f'Splitting {p.name}')
+    qlib.split_gguf(p, progress=pl.update_progress)
+    pl.finish()
     if keep:
         p.rename(p.with_suffix('.dead'))
     else:
@@ -49,6 +46,9 @@ def main():
     parser.add_argument('--upload', '-u', action=qlib.misc.BooleanOptionalAction, default=True, help='Perform the upload')
     parser.add_argument('--keep-oversize', '--keep', '-k', action='store_true', help='Keep oversize GGUFs after splitting')
     parser.add_argument('--publish', '-p', action='store_true', help='Make repository public after upload')
+    parser.add_argument('--jobs', '-j', type=int, default=4, help='Files to upload at once')
+    parser.add_argument('--connections', '-c', type=int, default=8, help='Connections for the parts of large files')
+    parser.add_argument('--bandwidth', '-b', type=float, default=None, help='Upload bandwidth cap in MB/s')
     args = parser.parse_args()
 
     allow_patterns = [
@@ -62,6 +62,7 @@ def main():
 
     ignore_patterns = [
         '*.sha256',
+        '*.chunks',
         '_*'
     ]
     
@@ -87,7 +88,8 @@ def main():
     repo_id = f'{owner}/{repo}'
 
     if args.upload:
-        uploader = qlib.Uploader(repo_id, qdir, args.retries)
+        uploader = qlib.Uploader(repo_id, qdir, args.retries, workers=args.jobs, connections=args.connections,
+                                 bandwidth=args.bandwidth and args.bandwidth * qlib.MB)
 
         success = uploader.upload(f'Upload {repo}', allow_patterns, ignore_patterns)
 
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import sys
+import os
+import subprocess
+from pathlib import Path
+import argparse
+from qlib import worker
+
+def main():
+    parser = argparse.ArgumentParser(description='Long-lived worker that runs qlib scripts for make recipes')
+    parser.add_argument('--socket', '-s', type=Path, default=worker.default_socket_path(),
+                        help='Unix socket to listen on')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--detach', '-d', action='store_true',
+                       help='Start the worker in the background')
+    group.add_argument('--stop', '-x', action='store_true',
+                       help='Stop a running worker')
+    group.add_argument('--status', '-q', action='store_true',
+                       help='Report whether a worker is running')
+    parser.add_argument('--log', '-l', type=Path,
+                        help='Log file for a detached worker')
+    args = parser.parse_args()
+
+    if args.stop or args.status:
+        if worker.request({'command': 'shutdown' if args.stop else 'ping'}, args.socket) is None:
+            print(f'No worker listening on {args.socket}')
+            sys.exit(1)
+        if args.status:
+            print(f'Worker listening on {args.socket}')
+        return
+
+    if worker.request({'command': 'ping'}, args.socket) is not None:
+        print(f'Worker already listening on {args.socket}')
+        return
+
+    if args.detach:
+        log = (args.log or args.socket.with_suffix('.log')).open('ab')
+        subprocess.Popen([sys.executable, __file__, '--socket', str(args.socket)],
+                         stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True)
+        print(f'Worker started on {args.socket}')
+    else:
+        print(f'Worker {os.getpid()} listening on {args.socket}')
+        worker.WorkerServer(args.socket).serve()
+
+if __name__ == '__main__':
+    main()
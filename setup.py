@@ -88,6 +88,9 @@ def main():
             basemodel_link.symlink_to(cache_path, target_is_directory=True)
 
     ftype = args.ftype or qlib.guess_model_datatype(basemodel_link)
+    if basemodel_link.exists():
+        # Exact, from the checkpoint headers, rather than estimated from config.json
+        basemodel.num_params = qlib.count_params(qlib.model_tensors(basemodel_link))
 
     with basemodel_id.open('wt') as f:
         f.write(baserepo)
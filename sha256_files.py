@@ -1,45 +1,47 @@
 #!/usr/bin/env python3
 
+import sys
 from pathlib import Path
-import hashlib
 import qlib
 from qlib.defs import *
 import argparse
 
-def hash_path(p):
-    return p + '.sha256'
-
-def needs_hash(p):
-    return p.is_newer_than(hash_path(p))
-
-def hash_file(p, message):
-    hp = hash_path(p)
-    hp.unlink(missing_ok = True)
-    fsize = p.size
-    pl = qlib.misc.ProgressLine(fsize, message)
-    with p.open('rb') as f:
-        h = hashlib.sha256(usedforsecurity=False)
-        buffer = qlib.IOBuffer(MiB)
-        while nbytes := buffer.readfrom(f):
-            h.update(buffer.bytes)
-            pl.update_progress(nbytes)
+def verify(files):
+    ok = True
+    for p in files:
+        if not (m := qlib.ChunkManifest.load(p)) or not m.complete:
+            print(f'{p.name}: no chunk manifest')
+            ok = False
+            continue
+        pl = qlib.misc.ProgressLine(p.size, f'Verifying {p.name}')
+        bad = qlib.verify_chunks(p, m, progress=pl.update_progress)
         pl.finish()
-        with hp.open('wt') as hf:
-            hf.write(h.hexdigest()+'\n')
+        for i in bad:
+            print(f'{p.name}: chunk {i} (bytes {i*m.chunk_size:,}-{min(p.size, (i+1)*m.chunk_size):,}) differs')
+        ok = ok and not bad
+    return ok
 
 def main():
     parser = argparse.ArgumentParser()
+    parser.add_argument('--verify', '-v', action='store_true',
+                        help='Check files against their .chunks manifests instead of hashing')
+    parser.add_argument('--chunks', '-c', action='store_true',
+                        help='Write a .chunks manifest beside each large file, so an interrupted hash resumes')
     parser.add_argument('files', type=Path, nargs='+',
                         help='Files to hash')
     args = parser.parse_args()
 
-    files = [p for p in args.files if needs_hash(p)]
+    if args.verify:
+        sys.exit(0 if verify(args.files) else 1)
+
+    files = qlib.hash_cache.missing(args.files)
     fstr = 'file' if (fnum := len(files)) == 1 else 'files'
     print(f'Hashing {fnum} {fstr}')
-    fctr = 0
-    for f in files:
-        fctr += 1
-        hash_file(f, f'{fctr}/{fnum} {f.name}')
+    pl = qlib.misc.ProgressLine(sum(p.size for p in files), files[0].name if fnum == 1 else f'{fnum} {fstr}')
+    for p,digest in qlib.file_hashes(args.files, progress=pl.update_progress, manifests=args.chunks):
+        qlib.write_sidecar(p, digest)
+    if fnum:
+        pl.finish()
 
 if __name__ == '__main__':
     main()
@@ -5,6 +5,7 @@ import re
 from pathlib import Path
 import huggingface_hub
 import argparse
+from qlib import hub_cache
 
 script_dir = Path(__file__).parent
 assets_dir = script_dir / 'assets'
@@ -135,6 +136,7 @@ def main():
 
             if args.write:
                 hfs.write_text(readme, new_text, commit_message = 'Update README.md')
+                hub_cache.forget(qualify_repo(repo_id))
                 print(f'Updated {repo_id}')
             else:
                 print(new_text)
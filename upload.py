@@ -9,12 +9,17 @@ import clear_screen
 import huggingface_hub
 from huggingface_hub.hf_api import RepoFile
 import argparse
+import qlib
 
 MAX_UPLOAD_SIZE = 50_000_000_000
 TOASTER = Path(os.environ['TOASTER_ROOT'])
 gguf_split_exe = TOASTER/'bin'/'llama-gguf-split'
 
-hfapi = huggingface_hub.HfApi()
+# qlib's, so hashes come from the hash cache and .sha256 sidecars
+hfapi = qlib.hfapi
+
+# Parallelism and bandwidth cap for LFS uploads, from the command line
+engine_options = {}
 
 split_rx = re.compile('.*-split-\d{5}-of-\d{5}\.gguf$')
 
@@ -47,8 +52,12 @@ def upload_file(repo_id: str, p: Path, new_name:str = None) -> bool:
     name = new_name or p.name
     print(f'{timestamp()} ### Uploading {p.name} to {repo_id}/{name}')
     try:
-        v = hfapi.upload_file(path_or_fileobj=p, repo_id=repo_id, path_in_repo=name,
-                              commit_message=f'Upload {name}')
+        op = huggingface_hub.CommitOperationAdd(name, str(p))
+        pl = qlib.misc.ProgressLine(op.upload_info.size, f'Uploading {name}')
+        qlib.LFSUploader(repo_id, progress=pl.update_progress, total=pl.set_total, **engine_options).upload([op])
+        pl.finish()
+        v = hfapi.create_commit(repo_id, operations=[op], commit_message=f'Upload {name}')
+        qlib.hub_cache.forget(repo_id)
         print_object(p.with_suffix('.log'), v)
     except KeyboardInterrupt as k:
         raise(k)
@@ -100,7 +109,12 @@ def main():
                         help='Directory for source files')
     parser.add_argument('--remove', '-r', action='store_true',
                         help='Remove files after successful upload')
+    parser.add_argument('--connections', '-c', type=int, default=8,
+                        help='Connections for the parts of large files')
+    parser.add_argument('--bandwidth', '-b', type=float, default=None,
+                        help='Upload bandwidth cap in MB/s')
     args = parser.parse_args()
+    engine_options.update(connections=args.connections, bandwidth=args.bandwidth and args.bandwidth * qlib.MB)
 
     if args.dir:
         os.chdir(args.dir)